@@ -15,11 +15,42 @@
 #   along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-__all__ = ["ews_session", "ews_helper", "ews_email", "ews_attachment"];
+__all__ = ["ews_session", "ews_helper", "ews_email", "ews_attachment", "ews_connection", "ews_email_batch", "ews_async_session", "ews_response", "ews_bulk_sender", "ews_throttle", "ews_metrics", "ews_exceptions", "ews_mock_server"];
 
-from pyewsclient.ews_helper import EWSXmlSchemaValidator;
-from pyewsclient.ews_session import EWSSession;
-from pyewsclient.ews_email import EWSEmail;
-from pyewsclient.ews_attachment import EWSAttachment;
+import importlib;
 
+# Classes are imported from their modules on first access, so that e.g. building
+# EWSEmail does not import the HTTP, TLS and asyncio stacks of EWSSession.
+_ews_exports = {'EWSError': 'ews_exceptions', 'EWSInputError': 'ews_exceptions', 'EWSAutodiscoverError': 'ews_exceptions',
+                'EWSTransportError': 'ews_exceptions', 'EWSAuthError': 'ews_exceptions', 'EWSThrottledError': 'ews_exceptions',
+                'EWSSchemaError': 'ews_exceptions', 'EWSResponseError': 'ews_exceptions',
+                'EWSXmlSchemaValidator': 'ews_helper', 'EWSXmlSchemaCache': 'ews_helper', 'EWSAutodiscoverCache': 'ews_helper',
+                'EWSValidationPolicy': 'ews_helper',
+                'EWSResponse': 'ews_response', 'EWSResponseDecoder': 'ews_response',
+                'EWSConnectionPool': 'ews_connection', 'EWSAsyncConnectionPool': 'ews_connection',
+                'EWSCompressionPolicy': 'ews_connection', 'EWSCookieJar': 'ews_connection',
+                'EWSThrottle': 'ews_throttle',
+                'EWSMetrics': 'ews_metrics', 'EWSMetricsRegistry': 'ews_metrics', 'EWSStatsdMetrics': 'ews_metrics',
+                'EWSSession': 'ews_session',
+                'AsyncEWSSession': 'ews_async_session',
+                'EWSEmail': 'ews_email',
+                'EWSEmailBatch': 'ews_email_batch',
+                'EWSAttachment': 'ews_attachment',
+                'EWSBulkSender': 'ews_bulk_sender',
+                'EWSMockServer': 'ews_mock_server'};
 
+
+def __getattr__(name):
+    ''' Imports exported class or submodule on first access '''
+    if name in _ews_exports:
+        value = getattr(importlib.import_module('pyewsclient.' + _ews_exports[name]), name);
+    elif name in __all__:
+        value = importlib.import_module('pyewsclient.' + name);
+    else:
+        raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name));
+    globals()[name] = value;
+    return value;
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__) | set(_ews_exports));
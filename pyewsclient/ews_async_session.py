@@ -0,0 +1,239 @@
+#   PyEwsClient - Microsoft Office 365 EWS (Exchange Web Services) Client Library
+#   Copyright (C) 2013 Paul Greenberg <paul@greenberg.pro>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time;
+import asyncio;
+import traceback;
+
+from pyewsclient.ews_session import EWSSession;
+from pyewsclient.ews_connection import EWSAsyncConnectionPool;
+from pyewsclient.ews_response import EWSResponse;
+from pyewsclient.ews_throttle import EWSThrottle;
+from pyewsclient.ews_exceptions import EWSError, EWSInputError;
+
+
+class AsyncEWSSession(EWSSession):
+    '''Represents Microsoft Office 365 EWS Session driven by asyncio.
+
+    The constructor does not perform any network I/O. The EWS endpoint is
+    discovered by awaiting autodiscover(), or on the first submit(). Requests
+    share a pool of keep-alive connections, and at most limit requests are in
+    flight at any time.
+
+    XML schema validation, see EWSValidationPolicy, runs in the default
+    executor of the event loop, so that it does not block other coroutines.
+
+    As with EWSSession, the outcome of each request is returned in its own EWS
+    Response Object, because self.items, self.id and self.changekey may already
+    be overwritten by a concurrent request by the time the caller inspects them.
+
+    Coroutines that stand in for blocking EWSSession methods carry the async
+    suffix, e.g. warmup_async(), so that inherited code never receives an
+    un-awaited coroutine. close() does not block, and it is inherited as is.
+    '''
+
+    def _ews_pool_init(self, pool_size, pool_idle_timeout, pool_max_requests):
+        ''' Initializes asyncio connection pool '''
+        return EWSAsyncConnectionPool(pool_size, pool_idle_timeout, pool_max_requests, limit=self.limit);
+
+
+    def _ews_endpoint_init(self):
+        ''' Defers EWS endpoint discovery to autodiscover() '''
+        if self.server is not None and self.verbose > 0:
+            self._log( 'EWS Endpoint Server: ' + self._ews_urlsplit('host', self.server), 'INFO');
+        return;
+
+
+    async def autodiscover(self):
+        ''' EWS Autodiscovery, see EWSSession._ews_autodiscover(), returns EWS endpoint server, or None
+
+        Concurrent callers wait for a single autodiscovery.
+        '''
+
+        if self.server is not None:
+            return self.server;
+
+        if self.endpoint_lock_async is None:
+            # created on first use, so that the lock is bound to the event loop of the session
+            self.endpoint_lock_async = asyncio.Lock();
+
+        async with self.endpoint_lock_async:
+            if self.server is not None or self._ews_autodiscover_cache_get():
+                return self.server;
+            await self._ews_autodiscover_async();
+
+        if self.server is None:
+            self._ews_autodiscover_failed();
+        elif self.verbose > 0:
+            self._log( 'EWS Endpoint Server: ' + self._ews_urlsplit('host', self.server), 'INFO');
+
+        return self.server;
+
+
+    async def _ews_autodiscover_async(self):
+        ''' Performs EWS Autodiscovery, see autodiscover() '''
+
+        self.autodiscover_status = None;
+        if self.verbose >= 4:
+            self._log( 'Autodiscovery On', 'INFO');
+
+        (autod_url, autod_params, autod_req, autod_headers) = self._ews_autodiscover_request_builder();
+
+        try:
+            (autod_resp, autod_resp_body) = await self.pool.request("POST", autod_url, autod_params, autod_headers);
+        except Exception as err:
+            self._log(str(err), 'CRIT');
+            self._log(str(traceback.format_exc()), 'CRIT');
+            return;
+
+        autod_url = self._ews_autodiscover_redirect_handler(autod_url, autod_resp);
+        if autod_url is None:
+            return;
+
+        if self.verbose >= 4:
+            self._log('HTTP REQUEST URL: ' + str(autod_url), 'INFO');
+            self._log('HTTP REQUEST BODY:\n' + autod_req.decode('utf-8'), 'INFO');
+
+        try:
+            autod_headers = self._ews_inject_cookies(autod_headers, autod_url);
+            (autod_resp, autod_resp_body) = await self.pool.request("POST", autod_url, autod_req, autod_headers);
+        except Exception as err:
+            self._log(str(err), 'CRIT');
+            self._log(str(traceback.format_exc()), 'CRIT');
+            return;
+
+        self._ews_autodiscover_response_handler(autod_url, autod_resp, autod_resp_body);
+        self._ews_autodiscover_cache_set();
+        return;
+
+
+    def warmup(self, connections=1, background=False):
+        ''' Not supported, the session is warmed up by awaiting warmup_async() '''
+        self._log('AsyncEWSSession is warmed up by awaiting warmup_async()', 'ERROR');
+        raise EWSInputError('AsyncEWSSession is warmed up by awaiting warmup_async()');
+
+
+    async def warmup_async(self, connections=1):
+        ''' Discovers EWS endpoint server and opens connections to it, returns True when the session is ready '''
+
+        if await self.autodiscover() is None:
+            return False;
+
+        try:
+            await self.pool.warmup(self.server, connections);
+        except Exception as err:
+            self._log('EWS Endpoint Warmup Failed: ' + str(err), 'WARN');
+            self._ews_autodiscover_cache_invalidate();
+            return False;
+
+        return True;
+
+
+    async def submit(self, ews_req=None, ews_stage=None, retries=None):
+        ''' Submits EWS request, see EWSSession.submit(), returns EWS Response Object, or raises EWSError '''
+
+        r = EWSResponse(ews_stage);
+        ts = time.monotonic();
+
+        if self.server is None:
+            await self.autodiscover();
+            if self.server is None:
+                (exc, code) = self._ews_autodiscover_error();
+                self._ews_submit_fail(r, exc, 'EWS endpoint is unknown: ' + str(self._ews_last_error()), code);
+                return self._ews_submit_done(r, ts);
+
+        loop = asyncio.get_running_loop();
+        if self.validation.requests:
+            # XML schema validation of the request would block the event loop
+            x = await loop.run_in_executor(None, self._ews_submit_begin, r, ews_req, ews_stage, retries);
+        else:
+            x = self._ews_submit_begin(r, ews_req, ews_stage, retries);
+        if x is None:
+            return self._ews_submit_done(r, ts);
+
+        while True:
+            await self.throttle.acquire_async(self.server);
+            try:
+                (body, headers, timings, decoder) = self._ews_submit_attempt(x);
+                (ews_resp, ews_resp_body) = await self.pool.request("POST", self.server, body, headers, timings, decoder);
+            except Exception as err:
+                delay = self._ews_submit_error(r, x, err);
+                if delay is None:
+                    return self._ews_submit_done(r, ts);
+            else:
+                delay = self._ews_submit_reply(r, x, ews_resp, ews_resp_body);
+                if delay is None:
+                    break;
+            finally:
+                # e.g. asyncio.CancelledError of wait_for() timeout, which is re-raised
+                self._ews_submit_release(x);
+            await asyncio.sleep(delay);
+            r.retries += 1;
+        r.timings['request'] = time.monotonic() - ts;
+
+        if x['validate']:
+            # the response is parsed as a whole and validated against the XML schema
+            await loop.run_in_executor(None, self._ews_submit_response_handler, ews_stage, ews_resp, ews_resp_body, r, True, decoder);
+        else:
+            self._ews_submit_response_handler(ews_stage, ews_resp, ews_resp_body, r, False, decoder);
+        return self._ews_submit_done(r, ts);
+
+
+    async def create_drafts(self, emails=None):
+        ''' Creates email drafts in a single CreateItem request, see EWSSession.create_drafts() '''
+
+        r = self.create_drafts_request(emails);
+        if r is None:
+            return [];
+
+        try:
+            return (await self.submit(r[0], r[1])).items;
+        except EWSError as err:
+            return self._ews_response_items(err);
+
+
+    async def send_drafts(self, ids=None):
+        ''' Sends email drafts in a single SendItem request, see EWSSession.send_drafts() '''
+
+        ews_req = self.send_drafts_request(ids);
+        if ews_req is None:
+            return [];
+
+        try:
+            items = (await self.submit(ews_req, 'send_and_save')).items;
+        except EWSError as err:
+            items = self._ews_response_items(err);
+        return self._ews_send_drafts_response_handler(items, ids);
+
+
+    def __init__(self, u=None, p=None, s=None, verbose=0, pool_size=4, pool_idle_timeout=60, pool_max_requests=100, limit=100,
+                 autodiscover_cache=True, throttle=None, metrics=None, validation=None, autodiscover_url=None, compression=None):
+        ''' Initialize Microsoft Office 365 asyncio Session via SOAP
+
+        limit caps the number of EWS requests in flight. Unless throttle is
+        given, the congestion window of each endpoint starts at limit, and it
+        shrinks only when the endpoint throttles. The remaining arguments are
+        the same as in EWSSession.
+        '''
+
+        self.limit = limit;
+        self.endpoint_lock_async = None;
+        if throttle is None:
+            throttle = EWSThrottle(initial_limit=limit, max_limit=limit);
+        EWSSession.__init__(self, u, p, s, verbose, pool_size, pool_idle_timeout, pool_max_requests, autodiscover_cache,
+                            throttle=throttle, metrics=metrics, validation=validation, autodiscover_url=autodiscover_url,
+                            compression=compression);
+        return;
@@ -16,39 +16,81 @@
 
 import os;
 import sys;
+import logging;
 import io;
 import datetime;
 import traceback;
 from lxml import etree;
-import pprint;
 import base64;
 from random import randint;
-from pyewsclient import EWSXmlSchemaValidator;
+from pyewsclient.ews_helper import EWSXmlSchemaValidator, EWSLogBuffer, _ews_log, _ews_log_format, _ews_last_error;
+from pyewsclient.ews_exceptions import EWSError;
+
+_ews_logger = logging.getLogger(__name__);
+
+
+class EWSAttachmentStream:
+    '''Represents CreateAttachment SOAP request body with attachment files streamed from disk.
+
+    Iterating over the object yields the request body in chunks, reading and
+    base64-encoding attachment files on the fly, so that memory usage does not
+    depend on attachment size. len() returns the size of the request body.
+    '''
+
+    chunk_size = 3 * 65536;
+
+    def __iter__(self):
+        for i in self.segments:
+            if isinstance(i, bytes):
+                yield i;
+                continue;
+            with open(i, 'rb') as f:
+                while True:
+                    fc = f.read(self.chunk_size);
+                    if not fc:
+                        break;
+                    yield base64.b64encode(fc);
+
+
+    def __len__(self):
+        return self.length;
+
+
+    def __repr__(self):
+        return '<EWSAttachmentStream length=' + str(self.length) + '>';
+
+
+    def __init__(self, segments):
+        ''' Initialize Request Body Stream from bytes segments and attachment file paths '''
+
+        self.segments = segments;
+        self.length = 0;
+        for i in self.segments:
+            if isinstance(i, bytes):
+                self.length += len(i);
+            else:
+                self.length += 4 * ((os.path.getsize(i) + 2) // 3);
+
+        return;
 
 
 class EWSAttachment:
-    '''Represents Microsoft Office 365 EWS Email Attachment Object.'''
+    '''Represents Microsoft Office 365 EWS Email Attachment Object.
+
+    In stream mode, attachment files are not read until the request is sent:
+    finalize() sets self.xml to EWSAttachmentStream, which EWSSession.submit()
+    streams into the HTTP request body. Otherwise, self.xml holds UTF-8
+    encoded bytes.
+    '''
 
     def _exit(self, lvl=0):
-        if self.log:
-            self.show('log', 'error');
-        if lvl == 1:
-            exit(1);
-        else:
-            exit(0);
+        ''' Raises EWSError with the last error, instead of exiting the process '''
+        raise EWSError(_ews_last_error(self) or type(self).__name__ + ' failed');
 
 
     def _log(self, msg='TEST', lvl='INFO'):
         ''' Logging '''
-        lvls={'DEBUG': 5, 'CRIT': 4, 'ERROR': 3, 'WARN': 2, 'INFO': 1};
-        cls = str(type(self).__name__);
-        func = str(sys._getframe(1).f_code.co_name);
-        ts = str(datetime.datetime.now());
-        for xmsg in msg.split('\n'):
-            if self.error is not True and lvls[lvl] in [3, 4]:
-                self.error = True;
-            self._log_id += 1;
-            self.log[self._log_id] = {'ts': ts, 'function': __file__.split('/')[-1] + '->' + cls + '.' + func + '()', 'level': lvl, 'text': xmsg}
+        _ews_log(self, _ews_logger, msg, lvl);
         return;
 
 
@@ -56,17 +98,18 @@ class EWSAttachment:
         ''' Display information '''
         if t == 'log':
             ''' Display log buffer '''
-            for x in self.log:
-                if p == 'error' and self.log[x]['level'] not in ['CRIT', 'ERROR']:
+            for entry in self.log.snapshot():
+                if p == 'error' and entry['level'] not in ['CRIT', 'ERROR']:
                     continue;
-                print("{0:26s} | {1:s} | {2:s} | {3:s}".format(self.log[x]['ts'],
-                                                               self.log[x]['function'],
-                                                               self.log[x]['level'],
-                                                               self.log[x]['text']));
+                print(_ews_log_format(self, entry));
         elif t == 'request':
             ''' Display SOAP XML Request '''
-            if self.xml:
-                for x in self.xml.split('\n'):
+            if isinstance(self.xml, EWSAttachmentStream):
+                print("{0:26s} | {1:s} | {2:s} | {3:s}".format(str(datetime.datetime.now()),
+                    __file__.split('/')[-1] + '->' + str(type(self).__name__) + '.' + str(sys._getframe(1).f_code.co_name) + '()',
+                    'INFO', repr(self.xml)));
+            elif self.xml:
+                for x in self.xml.decode('utf-8').split('\n'):
                     print("{0:26s} | {1:s} | {2:s} | {3:s}".format(str(datetime.datetime.now()),
                         __file__.split('/')[-1] + '->' + str(type(self).__name__) + '.' + str(sys._getframe(1).f_code.co_name) + '()',
                         'INFO', x));
@@ -122,6 +165,10 @@ class EWSAttachment:
                't': NS_EWS_TYPES_URI, 
                'soap': NS_SOAP_ENV_URI};
 
+        if self.stream:
+            self.xml = EWSAttachmentStream(self._ews_stream_segments(NSM, NS_SOAP_ENV, NS_EWS_TYPES, NS_EWS_MESSAGES, NS_EWS_MESSAGES_URI));
+            return;
+
         ATTACH = etree.Element(NS_SOAP_ENV + "Envelope", nsmap=NSM);
         ATTACH_B = etree.SubElement(ATTACH, NS_SOAP_ENV + "Body");
         ATTACH_B_CA = etree.SubElement(ATTACH_B, 'CreateAttachment');
@@ -146,9 +193,64 @@ class EWSAttachment:
                 vars()['ATTACH_B_CA_AT_' + str(k) + '_CONTENT'] = etree.SubElement(vars()['ATTACH_B_CA_AT_FL' + str(k)], NS_EWS_TYPES + 'Content');
                 vars()['ATTACH_B_CA_AT_' + str(k) + '_CONTENT'].text = self.skel['attachments'][i]['Content'];
 
-        xmlb = b'<?xml version="1.0" encoding="utf-8"?>\n' + etree.tostring(ATTACH, pretty_print=True);
-        self.xml = xmlb.decode("utf-8");
+        self.xml = etree.tostring(ATTACH, xml_declaration=True, encoding='utf-8', pretty_print=True);
         return;
+
+
+    def _ews_stream_segments(self, NSM, NS_SOAP_ENV, NS_EWS_TYPES, NS_EWS_MESSAGES, NS_EWS_MESSAGES_URI):
+        ''' Serializes SOAP Request Body incrementally, returns bytes segments with the paths of streamed files between them '''
+
+        segments = [];
+        buf = io.BytesIO();
+
+        def cut():
+            xf.flush();
+            segments.append(buf.getvalue());
+            buf.seek(0);
+            buf.truncate();
+
+        with etree.xmlfile(buf, encoding='utf-8') as xf:
+            xf.write_declaration();
+            with xf.element(NS_SOAP_ENV + 'Envelope', nsmap=NSM):
+                with xf.element(NS_SOAP_ENV + 'Body'):
+                    with xf.element(NS_EWS_MESSAGES + 'CreateAttachment', nsmap={None: NS_EWS_MESSAGES_URI}):
+                        with xf.element(NS_EWS_MESSAGES + 'ParentItemId', Id=self.id, ChangeKey=self.changekey):
+                            pass;
+                        with xf.element(NS_EWS_MESSAGES + 'Attachments'):
+                            for i in self.skel['attachments']:
+                                a = self.skel['attachments'][i];
+                                with xf.element(NS_EWS_TYPES + 'FileAttachment'):
+                                    if a['Name'] is not None:
+                                        with xf.element(NS_EWS_TYPES + 'Name'):
+                                            xf.write(str(a['Name']));
+                                    if a['Content'] is not None:
+                                        with xf.element(NS_EWS_TYPES + 'Content'):
+                                            xf.write(a['Content'].decode('ascii') if isinstance(a['Content'], bytes) else str(a['Content']));
+                                    elif a.get('Path') is not None:
+                                        with xf.element(NS_EWS_TYPES + 'Content'):
+                                            # the file is read and encoded between these segments when the request is sent
+                                            cut();
+                                            segments.append(a['Path']);
+        segments.append(buf.getvalue());
+        return segments;
+
+
+    def validate(self):
+        ''' Validates SOAP Request Body against EWS XML schema, returns True when valid
+
+        Meant for debugging: in stream mode, the attachment files are read and
+        encoded in memory.
+        '''
+
+        if self.xml is None:
+            self._log('Attachment is not finalized', 'ERROR');
+            return False;
+
+        xmlb = b''.join(self.xml) if isinstance(self.xml, EWSAttachmentStream) else self.xml;
+        exsv = EWSXmlSchemaValidator(xmlb);
+        for i in exsv.logs:
+            self._log(i[0], i[1]);
+        return exsv.valid;
        
 
     def add(self, fp=None, fn=None):
@@ -175,8 +277,15 @@ class EWSAttachment:
                 return;
             if fn is None:
                 fn = os.path.basename(fp)
-            with open(fp, "rb") as f:
-                fc = base64.b64encode(f.read());
+            if self.stream:
+                fc = None;
+            else:
+                with open(fp, "rb") as f:
+                    fc = base64.b64encode(f.read());
+        elif isinstance(fp, io.IOBase) and self.stream and os.path.isfile(str(getattr(fp, 'name', ''))):
+            fn = os.path.basename(fp.name);
+            fc = None;
+            fp = fp.name;
         elif isinstance(fp, io.IOBase):
             fn = os.path.basename(fp.name);
             fc = base64.b64encode(bytes(fp.read(), 'utf-8'));
@@ -193,6 +302,8 @@ class EWSAttachment:
         try:
             self.skel['attachments'][self.aid]['Name'] = fn
             self.skel['attachments'][self.aid]['Content'] = fc
+            if fc is None:
+                self.skel['attachments'][self.aid]['Path'] = fp
             if self.verbose >= 5:
                 self._log('email attachment ' + str(fn) + ' was added successfully', 'INFO');
         except:
@@ -201,13 +312,13 @@ class EWSAttachment:
         return;
 
 
-    def __init__(self, id=None, changekey=None, verbose=None):
+    def __init__(self, id=None, changekey=None, verbose=None, stream=False):
         ''' Initialize Microsoft Office 365 EWS Email Attachment Object '''
 
         self.verbose = verbose;
+        self.stream = stream;
 
-        self.log = {};
-        self._log_id = 0;
+        self.log = EWSLogBuffer();
         self.error = False;
 
         self.xml = None;
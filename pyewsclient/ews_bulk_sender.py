@@ -0,0 +1,381 @@
+#   PyEwsClient - Microsoft Office 365 EWS (Exchange Web Services) Client Library
+#   Copyright (C) 2013 Paul Greenberg <paul@greenberg.pro>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import re;
+import time;
+import logging;
+import csv;
+import json;
+import datetime;
+import threading;
+import traceback;
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED;
+
+from pyewsclient.ews_helper import EWSLogBuffer, _ews_log, _ews_log_format, _ews_last_error;
+from pyewsclient.ews_exceptions import EWSError, EWSThrottledError;
+from pyewsclient.ews_response import EWSResponse;
+from pyewsclient.ews_email import EWSEmail;
+from pyewsclient.ews_attachment import EWSAttachment;
+
+_ews_logger = logging.getLogger(__name__);
+
+
+class EWSBulkSender:
+    '''Represents a bulk (mail merge) email sender on top of a single EWS Session.
+
+    Message specs are dictionaries, e.g. CSV or JSONL rows, with to, cc, bcc,
+    subject, body, format, sensitivity, importance, delivery_receipt,
+    read_receipt, sender and attach keys. The string values of the template
+    are filled in from each spec with str.format_map(), e.g. 'Hello {name}',
+    and the keys of the spec take precedence over the template.
+
+    Emails without attachments are sent batch_size at a time in a single
+    CreateItem request with SendAndSaveCopy message disposition. Emails with
+    attachments are drafted, get their attachments, and are sent one by one.
+    At most concurrency EWS requests are in flight at any time.
+    '''
+
+    fields = ['to', 'cc', 'bcc', 'subject', 'body', 'format', 'sensitivity', 'importance',
+              'delivery_receipt', 'read_receipt', 'sender', 'attach'];
+
+    def _exit(self, lvl=0):
+        ''' Raises EWSError with the last error, instead of exiting the process '''
+        raise EWSError(_ews_last_error(self) or type(self).__name__ + ' failed');
+
+
+    def _log(self, msg='TEST', lvl='INFO'):
+        ''' Logging '''
+        _ews_log(self, _ews_logger, msg, lvl);
+        return;
+
+
+    def show(self, t=None, p=None):
+        ''' Display information '''
+        if t == 'log':
+            ''' Display log buffer '''
+            for entry in self.log.snapshot():
+                if p == 'error' and entry['level'] not in ['CRIT', 'ERROR']:
+                    continue;
+                print(_ews_log_format(self, entry));
+        elif t == 'stats':
+            ''' Display message counters '''
+            print("{0:26s} | {1:s} | {2:s} | {3:s}".format(str(datetime.datetime.now()),
+                __file__.split('/')[-1] + '->' + str(type(self).__name__) + '.show()',
+                'INFO', ', '.join([k + ': ' + str(self.stats[k]) for k in sorted(self.stats)])));
+        else:
+            pass;
+        return;
+
+
+    def clear(self, t=None, p=None):
+        if t == 'log':
+            self.log.clear();
+        return;
+
+
+    @staticmethod
+    def read_csv(fp):
+        ''' Yields message specs from CSV file with a header row '''
+        with open(fp, newline='') as f:
+            for row in csv.DictReader(f):
+                yield row;
+
+
+    @staticmethod
+    def read_jsonl(fp):
+        ''' Yields message specs from JSON Lines file '''
+        with open(fp) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line);
+
+
+    def _ews_spec(self, spec):
+        ''' Merges message spec with the template '''
+        merged = {};
+        for k in self.template:
+            if isinstance(self.template[k], str):
+                merged[k] = self.template[k].format_map(spec);
+            else:
+                merged[k] = self.template[k];
+        for k in self.fields:
+            if spec.get(k) not in [None, '']:
+                merged[k] = spec[k];
+        return merged;
+
+
+    def _ews_list(self, v, sep=r'[,;]'):
+        if v is None:
+            return [];
+        if isinstance(v, (list, tuple)):
+            return [str(x).strip() for x in v if str(x).strip()];
+        return [x.strip() for x in re.split(sep, str(v)) if x.strip()];
+
+
+    def _ews_flag(self, v):
+        return str(v).strip().lower() in ['1', 'y', 'yes', 'true'];
+
+
+    def _ews_email(self, spec, disposition):
+        ''' Builds EWS Email Object for message spec '''
+        email = EWSEmail(self.email_verbose);
+        email.formatting(spec.get('format') or 'plain');
+        email.sender(spec.get('sender') or self.session.username);
+        email.recipients(self._ews_list(spec.get('to')));
+        if spec.get('cc'):
+            email.cc(self._ews_list(spec.get('cc')));
+        if spec.get('bcc'):
+            email.bcc(self._ews_list(spec.get('bcc')));
+        email.subject(str(spec.get('subject') or ''));
+        email.body(str(spec.get('body') or ''));
+        email.sensitivity(spec.get('sensitivity') or 'Normal');
+        email.importance(spec.get('importance') or 'Normal');
+        if self._ews_flag(spec.get('delivery_receipt')):
+            email.delivery_receipt('Yes');
+        if self._ews_flag(spec.get('read_receipt')):
+            email.read_receipt('Yes');
+        email.disposition(disposition);
+        return email;
+
+
+    def _ews_result(self, index, spec, item=None, text=None, draft=None):
+        ''' Returns per-message outcome, with the Id and ChangeKey of the draft, if any, when the item has none '''
+        result = {'Index': index, 'Spec': spec, 'ResponseClass': 'Error', 'ResponseCode': None,
+                  'MessageText': text, 'Id': None, 'ChangeKey': None};
+        if item is not None:
+            for k in ['ResponseClass', 'ResponseCode', 'MessageText', 'Id', 'ChangeKey']:
+                result[k] = item.get(k);
+        if draft is not None and result['Id'] is None:
+            (result['Id'], result['ChangeKey']) = draft;
+        with self.lock:
+            if result['ResponseClass'] == 'Success':
+                self.stats['saved' if self.drafts else 'sent'] += 1;
+            else:
+                self.stats['failed'] += 1;
+        return result;
+
+
+    def _ews_submit(self, ews_req, ews_stage, retries=None):
+        ''' Submits EWS request, returns EWS Response Object and the error of the failed request, if any
+
+        stats counts every request sent, retries included.
+        '''
+        try:
+            (r, text) = (self.session.submit(ews_req, ews_stage, retries), None);
+        except EWSError as err:
+            (r, text) = (EWSResponse(ews_stage) if err.response is None else err.response, 'EWS request failed: ' + str(err));
+        if r.request_size:
+            with self.lock:
+                self.stats['requests'] += 1 + r.retries;
+        return (r, text);
+
+
+    def _ews_rejected(self, r):
+        ''' Checks whether failed EWS request was rejected as a whole and may be resubmitted, e.g. on SOAP fault '''
+        throttle = self.session.throttle;
+        if isinstance(r.exception, EWSThrottledError) or r.response_code in throttle.transient_codes:
+            return True;
+        cause = getattr(r.exception, '__cause__', None);
+        return cause is not None and throttle.classify_error(cause, r.stage)[1];
+
+
+    def _ews_send_batch(self, batch):
+        ''' Sends emails without attachments in a single CreateItem request
+
+        Emails rejected because the server is busy are resubmitted, while the
+        session throttle holds the requests back for the back-off period. The
+        request itself is submitted without retries, so that only the rejected
+        emails, or all of them when the whole request was rejected, are
+        resubmitted, at most throttle.max_retries times.
+        '''
+        throttle = self.session.throttle;
+        results = [];
+        for attempt in range(throttle.max_retries + 1):
+            r = self.session.create_drafts_request([x[2] for x in batch]);
+            if r is None:
+                return results + [self._ews_result(x[0], x[1], text='Email batch drafting failed') for x in batch];
+            (r, text) = self._ews_submit(r[0], r[1], 0);
+            if len(r.items) != len(batch):
+                if attempt < throttle.max_retries and self._ews_rejected(r):
+                    if not isinstance(r.exception, EWSThrottledError):
+                        time.sleep(throttle.delay(attempt));
+                    continue;
+                return results + [self._ews_result(x[0], x[1], text=text or 'EWS request failed') for x in batch];
+            retry = [];
+            busy = False;
+            for (x, item) in zip(batch, r.items):
+                if item['ResponseCode'] in throttle.throttle_codes + throttle.transient_codes and attempt < throttle.max_retries:
+                    retry.append(x);
+                    busy = busy or item['ResponseCode'] in throttle.throttle_codes;
+                else:
+                    results.append(self._ews_result(x[0], x[1], item));
+            if not retry:
+                break;
+            if not busy:
+                time.sleep(throttle.delay(attempt));
+            batch = retry;
+        return results;
+
+
+    def _ews_send_one(self, index, spec, email):
+        ''' Drafts email, adds its attachments, and sends it
+
+        Once the draft is created, failed outcomes carry its Id and ChangeKey,
+        so that the caller can reconcile the drafts left in the mailbox.
+        '''
+        (r, text) = self._ews_submit(email.xml, 'save_only');
+        if r.error or r.id is None or r.changekey is None:
+            return [self._ews_result(index, spec, r.items[0] if r.items else None, text or 'EWS request failed')];
+
+        draft = (r.id, r.changekey);
+        attachment = EWSAttachment(r.id, r.changekey, self.email_verbose, stream=True);
+        for fp in self._ews_list(spec.get('attach'), ';'):
+            attachment.add(fp);
+        attachment.finalize();
+        if attachment.error:
+            text = '; '.join([entry['text'] for entry in attachment.log.snapshot() if entry['level'] in ['CRIT', 'ERROR']]);
+            return [self._ews_result(index, spec, text='Email attachment processing failed: ' + text, draft=draft)];
+
+        (r, text) = self._ews_submit(attachment.xml, 'attachment');
+        if r.error or r.id is None or r.changekey is None:
+            return [self._ews_result(index, spec, r.items[0] if r.items else None, text or 'EWS request failed', draft)];
+
+        if self.drafts:
+            return [self._ews_result(index, spec, {'ResponseClass': 'Success', 'ResponseCode': 'NoError',
+                                                   'Id': r.id, 'ChangeKey': r.changekey})];
+
+        ids = (r.id, r.changekey);
+        ews_req = self.session.send_drafts_request([ids]);
+        if ews_req is None:
+            return [self._ews_result(index, spec, text='Email draft token is invalid', draft=ids)];
+        (r, text) = self._ews_submit(ews_req, 'send_and_save');
+        if len(r.items) != 1:
+            return [self._ews_result(index, spec, text=text or 'EWS request failed', draft=ids)];
+        item = dict(r.items[0]);
+        (item['Id'], item['ChangeKey']) = ids;
+        return [self._ews_result(index, spec, item)];
+
+
+    def _ews_job(self, func, args):
+        ''' Runs a unit of work, turning unexpected exceptions into per-message outcomes '''
+        try:
+            return func(*args);
+        except Exception as err:
+            self._log(str(err), 'CRIT');
+            self._log(str(traceback.format_exc()), 'CRIT');
+            if func == self._ews_send_batch:
+                return [self._ews_result(x[0], x[1], text=str(err)) for x in args[0]];
+            return [self._ews_result(args[0], args[1], text=str(err))];
+
+
+    def send(self, specs=None):
+        ''' Sends emails for an iterable of message specs
+
+        Yields one dictionary per message with Index (position of the spec),
+        Spec (the spec merged with the template), ResponseClass, ResponseCode,
+        MessageText, Id and ChangeKey keys, in the order of completion. The
+        specs are consumed lazily, so the iterable may be arbitrarily long.
+        Failed messages with attachments carry the Id and ChangeKey of their
+        draft, when it was left in the mailbox.
+        '''
+
+        if specs is None:
+            return;
+
+        disposition = 'SaveOnly' if self.drafts else 'SendAndSaveCopy';
+        pending = set();
+        batch = [];
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+
+            def drain(block):
+                ''' Yields the outcomes of completed jobs, waiting for a job only when block is True or all workers are busy '''
+                while pending:
+                    done = [f for f in pending if f.done()];
+                    if not done:
+                        if not block and len(pending) < self.concurrency:
+                            return;
+                        (done, rest) = wait(pending, return_when=FIRST_COMPLETED);
+                    pending.difference_update(done);
+                    for f in done:
+                        for result in f.result():
+                            yield result;
+
+            for (index, spec) in enumerate(specs):
+                for result in drain(False):
+                    yield result;
+
+                try:
+                    spec = self._ews_spec(spec);
+                except (KeyError, IndexError, ValueError) as err:
+                    yield self._ews_result(index, spec, text='Email template substitution failed: ' + str(err));
+                    continue;
+
+                attachments = self._ews_list(spec.get('attach'), ';');
+                email = self._ews_email(spec, 'SaveOnly' if attachments else disposition);
+                if email.error:
+                    text = '; '.join([entry['text'] for entry in email.log.snapshot() if entry['level'] in ['CRIT', 'ERROR']]);
+                    yield self._ews_result(index, spec, text='Email drafting failed: ' + text);
+                    continue;
+
+                if attachments:
+                    email.finalize();
+                    pending.add(executor.submit(self._ews_job, self._ews_send_one, (index, spec, email)));
+                else:
+                    batch.append((index, spec, email));
+                    if len(batch) >= self.batch_size:
+                        pending.add(executor.submit(self._ews_job, self._ews_send_batch, (batch,)));
+                        batch = [];
+
+            if batch:
+                pending.add(executor.submit(self._ews_job, self._ews_send_batch, (batch,)));
+
+            for result in drain(True):
+                yield result;
+
+        return;
+
+
+    def __init__(self, session=None, template=None, batch_size=50, concurrency=4, drafts=False, verbose=0):
+        ''' Initialize Microsoft Office 365 EWS Bulk Email Sender
+
+        session is EWSSession shared by all requests. When drafts is True, the
+        emails are saved as drafts instead of being sent.
+        '''
+
+        self.verbose = verbose;
+        self.email_verbose = verbose if verbose >= 5 else 0;
+
+        self.log = EWSLogBuffer();
+        self.error = False;
+        self.lock = threading.Lock();
+
+        if session is None:
+            self._log('expects EWS session', 'ERROR');
+            self._exit(1);
+
+        self.session = session;
+        self.template = dict(template or {});
+        self.batch_size = max(1, int(batch_size));
+        self.concurrency = max(1, int(concurrency));
+        self.drafts = drafts;
+
+        self.stats = {'sent': 0, 'saved': 0, 'failed': 0, 'requests': 0};
+
+        if self.verbose > 0:
+            self._log( 'Log Level : ' + str(self.verbose), 'INFO');
+
+        return;
@@ -0,0 +1,870 @@
+#   PyEwsClient - Microsoft Office 365 EWS (Exchange Web Services) Client Library
+#   Copyright (C) 2013 Paul Greenberg <paul@greenberg.pro>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import ssl;
+import time;
+import zlib;
+import threading;
+import http.client;
+import email.utils;
+from urllib.parse import urlparse;
+
+from pyewsclient.ews_exceptions import EWSInputError;
+
+
+def _ews_body_length(body):
+    ''' Returns length of HTTP request body in bytes '''
+    if body is None:
+        return 0;
+    if isinstance(body, str):
+        return len(body.encode('utf-8'));
+    if hasattr(body, '__len__'):
+        return len(body);
+    return 0;
+
+
+def _ews_endpoint_key(url):
+    ''' Returns scheme, host and port of URL, which key connections, throttling and compression state per endpoint '''
+    o = urlparse(url);
+    if o.scheme not in ['http', 'https']:
+        raise ValueError('unsupported URL scheme: ' + str(o.scheme));
+    port = o.port;
+    if port is None:
+        port = 443 if o.scheme == 'https' else 80;
+    return (o.scheme, o.hostname, port);
+
+
+def _ews_decompressor(encoding):
+    ''' Returns zlib decompressor for HTTP Content-Encoding, or None when the body is not compressed '''
+    encoding = (encoding or '').strip().lower();
+    if encoding in ['gzip', 'x-gzip']:
+        return zlib.decompressobj(16 + zlib.MAX_WBITS);
+    if encoding == 'deflate':
+        return _EWSDeflateDecompressor();
+    return None;
+
+
+def _ews_counted(body, timings):
+    ''' Yields chunks of streamed request body, counting them in timings '''
+    timings['bytes_sent'] = 0;
+    for chunk in body:
+        timings['bytes_sent'] += len(chunk);
+        yield chunk;
+
+
+class _EWSDeflateDecompressor:
+    '''Represents decompressor of HTTP deflate content coding, which is zlib format, or raw deflate sent by some servers.'''
+
+    def decompress(self, data):
+        if self.d is None:
+            self.buf += data;
+            if len(self.buf) < 2:
+                return b'';
+            # zlib header is a multiple of 31, with deflate compression method
+            zlib_header = (self.buf[0] & 0x0f) == 8 and ((self.buf[0] << 8) | self.buf[1]) % 31 == 0;
+            self.d = zlib.decompressobj(zlib.MAX_WBITS if zlib_header else -zlib.MAX_WBITS);
+            (data, self.buf) = (self.buf, b'');
+        return self.d.decompress(data);
+
+
+    def flush(self):
+        if self.d is None:
+            return zlib.decompress(self.buf, -zlib.MAX_WBITS) if self.buf else b'';
+        return self.d.flush();
+
+
+    def __init__(self):
+        self.d = None;
+        self.buf = b'';
+        return;
+
+
+class _EWSGzipStream:
+    '''Represents streamed request body compressed with gzip as it is iterated, which may be iterated again on retry.'''
+
+    def __iter__(self):
+        c = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS);
+        for chunk in self.body:
+            out = c.compress(chunk);
+            if out:
+                yield out;
+        yield c.flush();
+
+
+    def __init__(self, body, level):
+        self.body = body;
+        self.level = level;
+        return;
+
+
+class EWSCompressionPolicy:
+    '''Represents HTTP compression policy for EWS requests and responses.
+
+    mode is one of:
+     * none: requests and responses are sent uncompressed
+     * responses: requests advertise Accept-Encoding gzip and deflate, and
+       compressed responses are decompressed as they are read off the
+       connection, before they are parsed
+     * all: additionally, request bodies of at least min_size bytes are
+       compressed with gzip at level, and streamed request bodies, e.g.
+       EWSAttachmentStream, are compressed as they are sent, with chunked
+       transfer encoding
+
+    Exchange accepts compressed requests only when IIS dynamic request
+    decompression is enabled. An endpoint that answers a compressed request
+    with one of the reject_status codes is sent the request again
+    uncompressed, and it is sent uncompressed requests from then on. A policy
+    may be shared by many sessions.
+    '''
+
+    modes = ['none', 'responses', 'all'];
+    reject_status = [415];
+
+    def accept_encoding(self):
+        ''' Returns Accept-Encoding request header value, or None '''
+        if self.mode == 'none':
+            return None;
+        return 'gzip, deflate';
+
+
+    def should_compress(self, url, size=None):
+        ''' Returns True when request body of size bytes, or of unknown size, is to be compressed for URL '''
+        if self.mode != 'all' or (size is not None and size < self.min_size):
+            return False;
+        with self.lock:
+            return _ews_endpoint_key(url) not in self.rejected;
+
+
+    def compress(self, body):
+        ''' Returns gzip-compressed request body, or streamed request body compressed as it is iterated '''
+        with self.lock:
+            self.stats['compressed'] += 1;
+        if isinstance(body, (bytes, bytearray, memoryview)):
+            c = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS);
+            return c.compress(body) + c.flush();
+        return _EWSGzipStream(body, self.level);
+
+
+    def reject(self, url):
+        ''' Records that URL does not accept compressed requests '''
+        with self.lock:
+            self.rejected.add(_ews_endpoint_key(url));
+            self.stats['rejected'] += 1;
+        return;
+
+
+    def __init__(self, mode='responses', level=6, min_size=1024):
+        ''' Initialize EWS Compression Policy '''
+
+        if mode not in self.modes:
+            raise EWSInputError('expects compression mode to be one of ' + ', '.join(self.modes) + ', not ' + str(mode));
+
+        self.mode = mode;
+        self.level = level;
+        self.min_size = min_size;
+
+        self.rejected = set();
+        self.lock = threading.Lock();
+        self.stats = {'compressed': 0, 'rejected': 0};
+
+        return;
+
+
+class EWSCookieJar:
+    '''Represents cookie jar of EWS session.
+
+    Cookies are stored from Set-Cookie response headers and sent back in
+    Cookie request header under the rules of RFC 6265: a cookie is sent to
+    the host, or with Domain attribute to the domain, it was set for, to the
+    requests under its Path, over HTTPS only when it is Secure, and until it
+    expires, i.e. its Max-Age or Expires elapses. This keeps e.g. Exchange
+    backend affinity cookie X-BackEndOverrideCookie, so that consecutive
+    requests of a session, over any pooled connection, are served by the same
+    mailbox server, instead of being proxied.
+
+    The Cookie header is built once per scheme, host and path, and rebuilt
+    only after the cookies change or expire.
+    '''
+
+    def _default_path(self, path):
+        if not path.startswith('/') or path.count('/') == 1:
+            return '/';
+        return path[:path.rindex('/')];
+
+
+    def _domain_match(self, host, domain):
+        return host == domain or (host.endswith('.' + domain) and not host.replace('.', '').isdigit());
+
+
+    def _path_match(self, path, cookie_path):
+        if path == cookie_path:
+            return True;
+        return path.startswith(cookie_path) and (cookie_path.endswith('/') or path[len(cookie_path)] == '/');
+
+
+    def _expire(self, now):
+        ''' Drops expired cookies, the caller holds the lock '''
+        if now < self.next_expiry:
+            return;
+        for k in [k for k in self.cookies if self.cookies[k]['expires'] is not None and self.cookies[k]['expires'] <= now]:
+            del self.cookies[k];
+        self.next_expiry = min([c['expires'] for c in self.cookies.values() if c['expires'] is not None] or [float('inf')]);
+        self.headers.clear();
+        return;
+
+
+    def _store(self, c, now):
+        ''' Stores or deletes cookie, the caller holds the lock '''
+        k = (c['domain'], c['path'], c['name']);
+        if c['expires'] is not None and c['expires'] <= now:
+            if self.cookies.pop(k, None) is not None:
+                self.headers.clear();
+            return;
+        old = self.cookies.get(k);
+        self.cookies[k] = c;
+        if c['expires'] is not None:
+            self.next_expiry = min(self.next_expiry, c['expires']);
+        if old is None or old['value'] != c['value'] or old['secure'] != c['secure'] or old['host_only'] != c['host_only']:
+            self.headers.clear();
+        return;
+
+
+    def parse(self, header, url):
+        ''' Parses Set-Cookie header received from URL, returns cookie, or None when it is invalid or out of scope '''
+        o = urlparse(url);
+        host = (o.hostname or '').lower();
+        parts = header.split(';');
+        if '=' not in parts[0]:
+            return None;
+        (name, value) = [x.strip() for x in parts[0].split('=', 1)];
+        if not name:
+            return None;
+        c = {'name': name, 'value': value, 'domain': host, 'path': self._default_path(o.path or '/'),
+             'host_only': True, 'secure': False, 'expires': None};
+        max_age = None;
+        for attr in parts[1:]:
+            (k, v) = [x.strip() for x in (attr.split('=', 1) + [''])[:2]];
+            k = k.lower();
+            if k == 'domain' and v:
+                domain = v.lstrip('.').lower();
+                if not self._domain_match(host, domain) or '.' not in domain:
+                    return None;
+                c['domain'] = domain;
+                c['host_only'] = (domain == host);
+            elif k == 'path' and v.startswith('/'):
+                c['path'] = v;
+            elif k == 'secure':
+                c['secure'] = True;
+            elif k == 'max-age' and v.lstrip('-').isdigit():
+                max_age = int(v);
+            elif k == 'expires' and c['expires'] is None:
+                t = email.utils.parsedate_tz(v);
+                if t is not None:
+                    c['expires'] = float(email.utils.mktime_tz(t));
+        if max_age is not None:
+            # Max-Age takes precedence over Expires
+            c['expires'] = time.time() + max_age;
+        if c['secure'] and o.scheme != 'https':
+            return None;
+        return c;
+
+
+    def extract(self, url, headers):
+        ''' Stores cookies of Set-Cookie headers, a list of name and value pairs, received from URL '''
+        cs = [self.parse(str(h[1]), url) for h in headers if str(h[0]).lower() == 'set-cookie'];
+        if not cs:
+            return;
+        now = time.time();
+        with self.lock:
+            for c in cs:
+                if c is not None:
+                    self._store(c, now);
+        return;
+
+
+    def header(self, url):
+        ''' Returns Cookie request header value for URL, or None when no cookie is due '''
+        o = urlparse(url);
+        key = (o.scheme, (o.hostname or '').lower(), o.path or '/');
+        with self.lock:
+            self._expire(time.time());
+            if key in self.headers:
+                return self.headers[key];
+            cs = [c for c in self.cookies.values() if (c['domain'] == key[1] if c['host_only'] else self._domain_match(key[1], c['domain']))
+                  and self._path_match(key[2], c['path']) and (key[0] == 'https' or not c['secure'])];
+            # cookies with longer paths are listed first
+            cs.sort(key=lambda c: -len(c['path']));
+            value = '; '.join([c['name'] + '=' + c['value'] for c in cs]) or None;
+            self.headers[key] = value;
+            return value;
+
+
+    def get(self, name, default=None):
+        ''' Returns the value of the cookie named name, of any scope '''
+        with self.lock:
+            self._expire(time.time());
+            for c in self.cookies.values():
+                if c['name'] == name:
+                    return c['value'];
+        return default;
+
+
+    def export(self):
+        ''' Returns the cookies that have not expired, as a list of dictionaries '''
+        with self.lock:
+            self._expire(time.time());
+            return [dict(c) for c in self.cookies.values()];
+
+
+    def load(self, cookies, url=None):
+        ''' Stores cookies exported by export(), keeping the cookies already stored
+
+        A dictionary of cookie names and values, as kept by the previous
+        releases, is stored as host-only cookies of URL.
+        '''
+        if isinstance(cookies, dict):
+            if url is None:
+                return;
+            o = urlparse(url);
+            cookies = [{'name': k, 'value': cookies[k], 'domain': (o.hostname or '').lower(), 'path': '/',
+                        'host_only': True, 'secure': False, 'expires': None} for k in cookies];
+        now = time.time();
+        with self.lock:
+            for c in cookies:
+                if not isinstance(c, dict) or not c.get('name') or not c.get('domain'):
+                    continue;
+                c = {'name': str(c['name']), 'value': str(c.get('value', '')), 'domain': str(c['domain']), 'path': str(c.get('path') or '/'),
+                     'host_only': bool(c.get('host_only', True)), 'secure': bool(c.get('secure')), 'expires': c.get('expires')};
+                if (c['domain'], c['path'], c['name']) not in self.cookies:
+                    self._store(c, now);
+        return;
+
+
+    def clear(self):
+        with self.lock:
+            self.cookies.clear();
+            self.headers.clear();
+            self.next_expiry = float('inf');
+        return;
+
+
+    def __len__(self):
+        with self.lock:
+            self._expire(time.time());
+            return len(self.cookies);
+
+
+    def __repr__(self):
+        return '<EWSCookieJar ' + ', '.join([c['name'] + '@' + c['domain'] + c['path'] for c in self.export()]) + '>';
+
+
+    def __init__(self):
+        ''' Initialize EWS Cookie Jar '''
+
+        self.cookies = {};
+        self.headers = {};
+        self.next_expiry = float('inf');
+        self.lock = threading.Lock();
+
+        return;
+
+
+class EWSConnectionPool:
+    '''Represents a pool of persistent (keep-alive) HTTP(S) connections to EWS endpoints.
+
+    Idle connections are kept per scheme, host and port. A connection is
+    discarded when it has been idle for longer than idle_timeout seconds,
+    when it served max_requests requests, or when the server asks to close it.
+    '''
+
+    chunk_size = 65536;
+
+    def _connect(self, key):
+        ''' Opens new connection '''
+        if key[0] == 'https':
+            conn = http.client.HTTPSConnection(key[1], key[2], timeout=self.timeout);
+        else:
+            conn = http.client.HTTPConnection(key[1], key[2], timeout=self.timeout);
+        if self.debuglevel > 0:
+            conn.set_debuglevel(self.debuglevel);
+        create_connection = conn._create_connection;
+        def _create_connection(*args, **kwargs):
+            ts = time.monotonic();
+            sock = create_connection(*args, **kwargs);
+            conn._ews_connect_time = time.monotonic() - ts;
+            return sock;
+        conn._create_connection = _create_connection;
+        conn._ews_connect_time = None;
+        conn._ews_requests = 0;
+        conn._ews_ts = time.monotonic();
+        with self.lock:
+            self.stats['connects'] += 1;
+        return conn;
+
+
+    def acquire(self, url):
+        ''' Returns idle connection for URL, or opens new one, and a flag whether it was reused '''
+        key = _ews_endpoint_key(url);
+        now = time.monotonic();
+        stale = [];
+        conn = None;
+        with self.lock:
+            idle = self.idle.get(key, []);
+            while idle:
+                c = idle.pop();
+                if now - c._ews_ts > self.idle_timeout:
+                    stale.append(c);
+                    continue;
+                conn = c;
+                self.stats['reuses'] += 1;
+                break;
+        for c in stale:
+            c.close();
+        if conn is not None:
+            return (conn, True);
+        return (self._connect(key), False);
+
+
+    def release(self, url, conn, reuse=True):
+        ''' Returns connection to the pool, or closes it '''
+        if reuse and conn._ews_requests < self.max_requests:
+            key = _ews_endpoint_key(url);
+            conn._ews_ts = time.monotonic();
+            with self.lock:
+                idle = self.idle.setdefault(key, []);
+                if len(idle) < self.size:
+                    idle.append(conn);
+                    return;
+        conn.close();
+        return;
+
+
+    def warmup(self, url, count=1):
+        ''' Opens up to count idle connections to URL ahead of their first use '''
+        key = _ews_endpoint_key(url);
+        with self.lock:
+            n = min(count, self.size) - len(self.idle.get(key, []));
+        for i in range(n):
+            conn = self._connect(key);
+            try:
+                conn.connect();
+            except Exception:
+                conn.close();
+                raise;
+            self.release(url, conn);
+        return;
+
+
+    def request(self, method, url, body=None, headers=None, timings=None, sink=None):
+        ''' Sends HTTP request over pooled connection, returns response and its body
+
+        A request over a reused connection that fails because the server has
+        already closed it is retried once over a fresh connection.
+
+        When timings dictionary is provided, it receives the duration, in
+        seconds, of connect (TCP), tls, write, ttfb (time to the response
+        headers) and read stages, the number of bytes_sent and bytes_received
+        (request and response bodies, as sent over the connection), the
+        response_size (response body after decompression), and sent, which
+        is False when the request failed before any of it was written, e.g.
+        while connecting, i.e. it cannot have reached the server.
+
+        Response bodies with gzip or deflate Content-Encoding are decompressed
+        as they are read. Streamed request bodies without Content-Length
+        header are sent with chunked transfer encoding.
+
+        When sink is provided, e.g. EWSResponseDecoder, the body of HTTP 200
+        response is passed to sink.feed() in chunks, as it is read, and the
+        returned body is None. The request is not retried once sink.size, the
+        number of bytes fed, is non-zero.
+        '''
+        if headers is None:
+            headers = {};
+        if timings is None:
+            timings = {};
+        path = urlparse(url).path or '/';
+        for attempt in [0, 1]:
+            timings['sent'] = False;
+            (conn, reused) = self.acquire(url);
+            try:
+                if conn.sock is None:
+                    ts = time.monotonic();
+                    conn.connect();
+                    timings['connect'] = conn._ews_connect_time;
+                    if url.startswith('https'):
+                        timings['tls'] = time.monotonic() - ts - conn._ews_connect_time;
+                ts = time.monotonic();
+                timings['sent'] = True;
+                if isinstance(body, (str, bytes, bytearray, memoryview)) or body is None:
+                    timings['bytes_sent'] = _ews_body_length(body);
+                    conn.request(method, path, body, headers);
+                else:
+                    # streamed request body, e.g. EWSAttachmentStream, counted as it is sent
+                    conn.request(method, path, _ews_counted(body, timings), headers);
+                ts_write = time.monotonic();
+                resp = conn.getresponse();
+                ts_ttfb = time.monotonic();
+                d = _ews_decompressor(resp.getheader('Content-Encoding'));
+                if sink is not None and resp.status == 200:
+                    resp_body = None;
+                    resp_size = 0;
+                    while True:
+                        chunk = resp.read(self.chunk_size);
+                        if not chunk:
+                            break;
+                        resp_size += len(chunk);
+                        sink.feed(chunk if d is None else d.decompress(chunk));
+                    tail = b'' if d is None else d.flush();
+                    if tail:
+                        sink.feed(tail);
+                    timings['response_size'] = sink.size;
+                else:
+                    resp_body = resp.read();
+                    resp_size = len(resp_body);
+                    if d is not None:
+                        resp_body = d.decompress(resp_body) + d.flush();
+                    timings['response_size'] = len(resp_body);
+                ts_read = time.monotonic();
+            except (http.client.RemoteDisconnected, http.client.BadStatusLine, ConnectionResetError, BrokenPipeError):
+                conn.close();
+                if reused and attempt == 0 and (sink is None or not sink.size):
+                    continue;
+                raise;
+            except Exception:
+                conn.close();
+                raise;
+            conn._ews_requests += 1;
+            self.release(url, conn, not resp.will_close);
+            timings['write'] = ts_write - ts;
+            timings['ttfb'] = ts_ttfb - ts_write;
+            timings['read'] = ts_read - ts_ttfb;
+            timings['bytes_received'] = resp_size;
+            return (resp, resp_body);
+
+
+    def close(self):
+        ''' Closes all idle connections '''
+        with self.lock:
+            conns = [c for k in self.idle for c in self.idle[k]];
+            self.idle.clear();
+        for c in conns:
+            c.close();
+        return;
+
+
+    def __init__(self, size=4, idle_timeout=60, max_requests=100, timeout=None, debuglevel=0):
+        ''' Initialize EWS Connection Pool '''
+
+        self.size = size;
+        self.idle_timeout = idle_timeout;
+        self.max_requests = max_requests;
+        self.timeout = timeout;
+        self.debuglevel = debuglevel;
+
+        self.idle = {};
+        self.lock = threading.Lock();
+        self.stats = {'connects': 0, 'reuses': 0};
+
+        return;
+
+
+class EWSAsyncResponse:
+    '''Represents HTTP response received over asyncio connection.'''
+
+    def getheaders(self):
+        return list(self.headers);
+
+
+    def getheader(self, name, default=None):
+        for h in self.headers:
+            if h[0].lower() == name.lower():
+                return h[1];
+        return default;
+
+
+    def __init__(self, version, status, reason, headers):
+        ''' Initialize HTTP Response '''
+
+        self.version = version;
+        self.status = status;
+        self.reason = reason;
+        self.headers = headers;
+        self.will_close = (version == 'HTTP/1.0');
+        if (self.getheader('Connection') or '').lower() == 'close':
+            self.will_close = True;
+
+        return;
+
+
+class EWSAsyncConnectionPool:
+    '''Represents a pool of persistent (keep-alive) asyncio HTTP(S) connections to EWS endpoints.
+
+    Connections are reused under the same rules as in EWSConnectionPool.
+    Additionally, limit caps the number of requests in flight across all
+    endpoints.
+    '''
+
+    chunk_size = EWSConnectionPool.chunk_size;
+
+
+    async def _connect(self, key):
+        ''' Opens new connection '''
+        import asyncio;
+        if key[0] == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = ssl.create_default_context();
+            (reader, writer) = await asyncio.open_connection(key[1], key[2], ssl=self.ssl_context);
+        else:
+            (reader, writer) = await asyncio.open_connection(key[1], key[2]);
+        conn = _EWSAsyncConnection(reader, writer);
+        self.stats['connects'] += 1;
+        return conn;
+
+
+    async def acquire(self, url):
+        ''' Returns idle connection for URL, or opens new one, and a flag whether it was reused '''
+        key = _ews_endpoint_key(url);
+        now = time.monotonic();
+        idle = self.idle.get(key, []);
+        while idle:
+            c = idle.pop();
+            if now - c.ts > self.idle_timeout or c.reader.at_eof():
+                c.close();
+                continue;
+            self.stats['reuses'] += 1;
+            return (c, True);
+        return (await self._connect(key), False);
+
+
+    def release(self, url, conn, reuse=True):
+        ''' Returns connection to the pool, or closes it '''
+        if reuse and conn.requests < self.max_requests:
+            conn.ts = time.monotonic();
+            idle = self.idle.setdefault(_ews_endpoint_key(url), []);
+            if len(idle) < self.size:
+                idle.append(conn);
+                return;
+        conn.close();
+        return;
+
+
+    async def warmup(self, url, count=1):
+        ''' Opens up to count idle connections to URL ahead of their first use '''
+        key = _ews_endpoint_key(url);
+        n = min(count, self.size) - len(self.idle.get(key, []));
+        for i in range(n):
+            self.release(url, await self._connect(key));
+        return;
+
+
+    async def _exchange(self, conn, method, url, body, headers, timings, sink=None):
+        ''' Writes HTTP/1.1 request and reads its response '''
+        o = urlparse(url);
+        if isinstance(body, str):
+            body = body.encode('utf-8');
+        elif body is None:
+            body = b'';
+        buffered = isinstance(body, (bytes, bytearray, memoryview));
+        chunked = not buffered and not hasattr(body, '__len__');
+        head = [method + ' ' + (o.path or '/') + ' HTTP/1.1', 'Host: ' + o.netloc];
+        for h in headers:
+            if h.lower() not in ['content-length', 'transfer-encoding']:
+                head.append(h + ': ' + str(headers[h]));
+        if chunked:
+            head.append('Transfer-Encoding: chunked');
+        else:
+            head.append('Content-Length: ' + str(len(body)));
+        head = ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1');
+        ts = time.monotonic();
+        timings['sent'] = True;
+        body_size = 0;
+        if buffered and len(body) <= self.chunk_size:
+            conn.writer.write(head + body);
+            body_size = len(body);
+        elif buffered:
+            # large body is written as is, instead of being copied after the head
+            conn.writer.write(head);
+            conn.writer.write(body);
+            body_size = len(body);
+        else:
+            # streamed request body, e.g. EWSAttachmentStream
+            conn.writer.write(head);
+            for chunk in body:
+                if not chunk:
+                    continue;
+                if chunked:
+                    conn.writer.write(('%x' % len(chunk)).encode('ascii') + b'\r\n');
+                conn.writer.write(chunk);
+                if chunked:
+                    conn.writer.write(b'\r\n');
+                body_size += len(chunk);
+                await conn.writer.drain();
+            if chunked:
+                conn.writer.write(b'0\r\n\r\n');
+        await conn.writer.drain();
+        ts_write = time.monotonic();
+
+        line = await conn.reader.readline();
+        if not line:
+            raise ConnectionResetError('connection closed by remote end');
+        status_line = line.decode('latin-1').rstrip('\r\n').split(' ', 2);
+        if len(status_line) < 2 or not status_line[0].startswith('HTTP/'):
+            raise http.client.BadStatusLine(line);
+        resp_headers = [];
+        while True:
+            line = await conn.reader.readline();
+            if line in [b'\r\n', b'\n', b'']:
+                break;
+            (name, value) = line.decode('latin-1').split(':', 1);
+            resp_headers.append((name.strip(), value.strip()));
+        resp = EWSAsyncResponse(status_line[0], int(status_line[1]), status_line[2] if len(status_line) > 2 else '', resp_headers);
+        ts_ttfb = time.monotonic();
+
+        if sink is None or resp.status != 200:
+            chunks = [];
+            feed = chunks.append;
+        else:
+            chunks = None;
+            feed = sink.feed;
+        d = _ews_decompressor(resp.getheader('Content-Encoding'));
+        if d is not None:
+            write = feed;
+            def feed(chunk):
+                write(d.decompress(chunk));
+        resp_size = 0;
+        if method == 'HEAD' or resp.status in [204, 304] or 100 <= resp.status < 200:
+            pass;
+        elif (resp.getheader('Transfer-Encoding') or '').lower() == 'chunked':
+            while True:
+                size = int((await conn.reader.readline()).split(b';', 1)[0].strip(), 16);
+                if size == 0:
+                    while (await conn.reader.readline()) not in [b'\r\n', b'\n', b'']:
+                        pass;
+                    break;
+                chunk = await conn.reader.readexactly(size);
+                resp_size += size;
+                feed(chunk);
+                await conn.reader.readexactly(2);
+        elif resp.getheader('Content-Length') is not None:
+            remaining = int(resp.getheader('Content-Length'));
+            while remaining > 0:
+                chunk = await conn.reader.readexactly(min(remaining, self.chunk_size));
+                remaining -= len(chunk);
+                resp_size += len(chunk);
+                feed(chunk);
+        else:
+            while True:
+                chunk = await conn.reader.read(self.chunk_size);
+                if not chunk:
+                    break;
+                resp_size += len(chunk);
+                feed(chunk);
+            resp.will_close = True;
+        if d is not None:
+            tail = d.flush();
+            if tail:
+                (sink.feed if chunks is None else chunks.append)(tail);
+        resp_body = None if chunks is None else b''.join(chunks);
+        timings['write'] = ts_write - ts;
+        timings['ttfb'] = ts_ttfb - ts_write;
+        timings['read'] = time.monotonic() - ts_ttfb;
+        timings['bytes_sent'] = body_size;
+        timings['bytes_received'] = resp_size;
+        timings['response_size'] = sink.size if resp_body is None else len(resp_body);
+        return (resp, resp_body);
+
+
+    async def request(self, method, url, body=None, headers=None, timings=None, sink=None):
+        ''' Sends HTTP request over pooled connection, returns response and its body
+
+        timings and sink are handled as in EWSConnectionPool.request(), except
+        that connect includes the TLS handshake.
+        '''
+        import asyncio;
+        if headers is None:
+            headers = {};
+        if timings is None:
+            timings = {};
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.limit);
+        async with self.semaphore:
+            for attempt in [0, 1]:
+                timings['sent'] = False;
+                ts = time.monotonic();
+                (conn, reused) = await self.acquire(url);
+                if not reused:
+                    timings['connect'] = time.monotonic() - ts;
+                try:
+                    if self.timeout is None:
+                        (resp, resp_body) = await self._exchange(conn, method, url, body, headers, timings, sink);
+                    else:
+                        (resp, resp_body) = await asyncio.wait_for(self._exchange(conn, method, url, body, headers, timings, sink), self.timeout);
+                except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError):
+                    conn.close();
+                    if reused and attempt == 0 and (sink is None or not sink.size):
+                        continue;
+                    raise;
+                except BaseException:
+                    conn.close();
+                    raise;
+                conn.requests += 1;
+                self.release(url, conn, not resp.will_close);
+                return (resp, resp_body);
+
+
+    def close(self):
+        ''' Closes all idle connections '''
+        for k in self.idle:
+            for c in self.idle[k]:
+                c.close();
+        self.idle.clear();
+        return;
+
+
+    def __init__(self, size=4, idle_timeout=60, max_requests=100, timeout=None, limit=100, ssl_context=None):
+        ''' Initialize EWS asyncio Connection Pool '''
+
+        self.size = size;
+        self.idle_timeout = idle_timeout;
+        self.max_requests = max_requests;
+        self.timeout = timeout;
+        self.limit = limit;
+        self.ssl_context = ssl_context;
+
+        self.idle = {};
+        self.semaphore = None;
+        self.stats = {'connects': 0, 'reuses': 0};
+
+        return;
+
+
+class _EWSAsyncConnection:
+    '''Represents asyncio stream connection with its reuse counters.'''
+
+    def close(self):
+        try:
+            self.writer.close();
+        except Exception:
+            pass;
+        return;
+
+
+    def __init__(self, reader, writer):
+        self.reader = reader;
+        self.writer = writer;
+        self.requests = 0;
+        self.ts = time.monotonic();
+        return;
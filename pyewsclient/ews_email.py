@@ -16,38 +16,46 @@
 
 import os;
 import sys;
+import logging;
 import datetime;
 import traceback;
 from lxml import etree;
-import pprint;
 import re;
-from pyewsclient import EWSXmlSchemaValidator;
+from pyewsclient.ews_helper import EWSXmlSchemaValidator, EWSLogBuffer, _ews_log, _ews_log_format, _ews_last_error;
+from pyewsclient.ews_exceptions import EWSError;
 #from EWSHelper import _ews_xml_schema_checker;
 
+_ews_logger = logging.getLogger(__name__);
+
+
+EWS_CREATE_ITEM_HEAD = ('<?xml version="1.0" encoding="utf-8"?>\n'
+                        '<soap:Envelope xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types" '
+                        'xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/"><soap:Body>'
+                        '<CreateItem xmlns="http://schemas.microsoft.com/exchange/services/2006/messages" '
+                        'MessageDisposition="{disposition}">{folder}<Items>');
+EWS_CREATE_ITEM_TAIL = '</Items></CreateItem></soap:Body></soap:Envelope>\n';
+
+_ews_xml_invalid_chars = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]');
+
+
+def _ews_xml_text(s):
+    ''' Escapes XML text content, drops characters not allowed in XML 1.0 '''
+    s = s.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('\r', '&#13;');
+    return _ews_xml_invalid_chars.sub('', s);
+
+
 class EWSEmail:
     '''Represents Microsoft Office 365 EWS Email Draft Object.'''
 
 
     def _exit(self, lvl=0):
-        if self.log:
-            self.show('log', 'error');
-        if lvl == 1:
-            exit(1);
-        else:
-            exit(0);
+        ''' Raises EWSError with the last error, instead of exiting the process '''
+        raise EWSError(_ews_last_error(self) or type(self).__name__ + ' failed');
 
 
     def _log(self, msg='TEST', lvl='INFO'):
         ''' Logging '''
-        lvls={'DEBUG': 5, 'CRIT': 4, 'ERROR': 3, 'WARN': 2, 'INFO': 1};
-        cls = str(type(self).__name__);
-        func = str(sys._getframe(1).f_code.co_name);
-        ts = str(datetime.datetime.now());
-        for xmsg in msg.split('\n'):
-            if self.error is not True and lvls[lvl] in [3, 4]:
-                self.error = True;
-            self._log_id += 1;
-            self.log[self._log_id] = {'ts': ts, 'function': __file__.split('/')[-1] + '->' + cls + '.' + func + '()', 'level': lvl, 'text': xmsg}
+        _ews_log(self, _ews_logger, msg, lvl);
         return;
 
 
@@ -55,17 +63,15 @@ class EWSEmail:
         ''' Display information '''
         if t == 'log':
             ''' Display log buffer '''
-            for x in self.log:
-                if p == 'error' and self.log[x]['level'] not in ['CRIT', 'ERROR']:
+            for entry in self.log.snapshot():
+                if p == 'error' and entry['level'] not in ['CRIT', 'ERROR']:
                     continue;
-                print("{0:26s} | {1:s} | {2:s} | {3:s}".format(self.log[x]['ts'],
-                                                               self.log[x]['function'],
-                                                               self.log[x]['level'],
-                                                               self.log[x]['text']));
+                print(_ews_log_format(self, entry));
         elif t == 'request':
             ''' Display SOAP XML Request '''
             if self.xml:
-                for x in self.xml.split('\n'):
+                xml = etree.tostring(etree.fromstring(self.xml), pretty_print=True, encoding='unicode');
+                for x in xml.split('\n'):
                     print("{0:26s} | {1:s} | {2:s} | {3:s}".format(str(datetime.datetime.now()),
                         __file__.split('/')[-1] + '->' + str(type(self).__name__) + '.' + str(sys._getframe(1).f_code.co_name) + '()',
                         'INFO', x));
@@ -94,95 +100,116 @@ class EWSEmail:
         return;
 
 
-    def finalize(self):
-        ''' Create SOAP Request Body for Email '''
-
-        NS_SOAP_ENV = "{http://schemas.xmlsoap.org/soap/envelope/}";
-        NS_SOAP_ENV_URI = "http://schemas.xmlsoap.org/soap/envelope/";
-        NS_XSI = "{http://www.w3.org/1999/XMLSchema-instance}";
-        NS_XSI_URI = "http://www.w3.org/1999/XMLSchema-instance";
-        NS_XSD = "{http://www.w3.org/1999/XMLSchema}";
-        NS_XSD_URI = "http://www.w3.org/1999/XMLSchema";
-        NS_WSA = "{http://www.w3.org/2005/08/addressing}";
-        NS_WSA_URI = "http://www.w3.org/2005/08/addressing";
-        NS_EWS_AUTO = "{http://schemas.microsoft.com/exchange/2010/Autodiscover}";
-        NS_EWS_AUTO_URI = "http://schemas.microsoft.com/exchange/2010/Autodiscover";
-        NS_EWS_TYPES = "{http://schemas.microsoft.com/exchange/services/2006/types}";
-        NS_EWS_TYPES_URI = 'http://schemas.microsoft.com/exchange/services/2006/types';
-        NS_EWS_MESSAGES = "{http://schemas.microsoft.com/exchange/services/2006/messages}";
-        NS_EWS_MESSAGES_URI = "http://schemas.microsoft.com/exchange/services/2006/messages";
-
-
-        DRAFT = etree.Element(NS_SOAP_ENV + "Envelope", nsmap={'t': NS_EWS_TYPES_URI, 'soap': NS_SOAP_ENV_URI});
-        DRAFT_B = etree.SubElement(DRAFT, NS_SOAP_ENV + "Body");
-        DRAFT_B_CI = etree.SubElement(DRAFT_B, 'CreateItem');
-        DRAFT_B_CI.attrib['xmlns'] = NS_EWS_MESSAGES_URI;
-
-        DRAFT_B_CI.attrib['MessageDisposition'] = 'SaveOnly';
-        DRAFT_B_CI_SF = etree.SubElement(DRAFT_B_CI, 'SavedItemFolderId');
-        DRAFT_B_CI_DF = etree.SubElement(DRAFT_B_CI_SF, NS_EWS_TYPES + 'DistinguishedFolderId');
-        DRAFT_B_CI_DF.attrib['Id'] = 'drafts';
-
-        DRAFT_B_CI_IT = etree.SubElement(DRAFT_B_CI, 'Items');
-        DRAFT_B_CI_IT_MSG = etree.SubElement(DRAFT_B_CI_IT, NS_EWS_TYPES + 'Message');
+    @staticmethod
+    def _ews_create_item_envelope(disposition='SaveOnly'):
+        ''' Create SOAP Envelope for CreateItem Request, returns the envelope text preceding and following its Items
+
+        SaveOnly saves the item to drafts folder, SendOnly sends it without
+        saving a copy, and SendAndSaveCopy sends it and saves a copy to sent
+        items folder.
+        '''
+
+        if disposition == 'SendOnly':
+            folder = '';
+        elif disposition == 'SendAndSaveCopy':
+            folder = '<SavedItemFolderId><t:DistinguishedFolderId Id="sentitems"/></SavedItemFolderId>';
+        else:
+            folder = '<SavedItemFolderId><t:DistinguishedFolderId Id="drafts"/></SavedItemFolderId>';
+
+        return (EWS_CREATE_ITEM_HEAD.format(disposition=disposition, folder=folder), EWS_CREATE_ITEM_TAIL);
+
+
+    def _ews_message(self):
+        ''' Create SOAP Message Element for Email, to be placed under CreateItem Items element '''
 
         # Reference for ItemClass: http://msdn.microsoft.com/en-us/library/office/ff861573.aspx
-        DRAFT_B_CI_IT_MSG_IC = etree.SubElement(DRAFT_B_CI_IT_MSG, NS_EWS_TYPES + 'ItemClass');
-        DRAFT_B_CI_IT_MSG_IC.text = 'IPM.Note';
+        msg = ['<t:Message><t:ItemClass>IPM.Note</t:ItemClass>'];
 
         if 'subject' in self.skel:
-            DRAFT_B_CI_IT_MSG_SB = etree.SubElement(DRAFT_B_CI_IT_MSG, NS_EWS_TYPES + 'Subject');
-            DRAFT_B_CI_IT_MSG_SB.text = self.skel['subject'];
+            msg.append('<t:Subject>' + _ews_xml_text(self.skel['subject']) + '</t:Subject>');
 
         if 'sensitivity' in self.skel:
-            DRAFT_B_CI_IT_MSG_SENS = etree.SubElement(DRAFT_B_CI_IT_MSG, NS_EWS_TYPES + 'Sensitivity');
-            DRAFT_B_CI_IT_MSG_SENS.text = self.skel['sensitivity'];
+            msg.append('<t:Sensitivity>' + self.skel['sensitivity'] + '</t:Sensitivity>');
 
         if 'body' in self.skel:
-            DRAFT_B_CI_IT_MSG_BD = etree.SubElement(DRAFT_B_CI_IT_MSG, NS_EWS_TYPES + 'Body');
-            DRAFT_B_CI_IT_MSG_BD.attrib['BodyType'] = 'Text';
-            DRAFT_B_CI_IT_MSG_BD.text = self.skel['body'];            
+            msg.append('<t:Body BodyType="Text">' + _ews_xml_text(self.skel['body']) + '</t:Body>');
 
         if 'importance' in self.skel:
-            DRAFT_B_CI_IT_MSG_IMPT = etree.SubElement(DRAFT_B_CI_IT_MSG, NS_EWS_TYPES + 'Importance');
-            DRAFT_B_CI_IT_MSG_IMPT.text = self.skel['importance'];
+            msg.append('<t:Importance>' + self.skel['importance'] + '</t:Importance>');
 
         for i in [('recipients', 'ToRecipients'), ('cc', 'CcRecipients'), ('bcc', 'BccRecipients')]:
             if i[0] not in self.skel:
                 continue;
-            vars()['DRAFT_B_CI_IT_MSG_' + i[0]] = etree.SubElement(DRAFT_B_CI_IT_MSG, NS_EWS_TYPES + i[1]);
-            if isinstance(self.skel[i[0]], (list)) and len(self.skel[i[0]]) > 0:
+            msg.append('<t:' + i[1] + '>');
+            if isinstance(self.skel[i[0]], (list)):
                 for j in self.skel[i[0]]:
-                    vars()['DRAFT_B_CI_IT_MSG_' + i[0] + '_MB_' + str(self.skel[i[0]].index(j))] = etree.SubElement(vars()['DRAFT_B_CI_IT_MSG_' + i[0]], NS_EWS_TYPES + 'Mailbox');                      
-                    vars()['DRAFT_B_CI_IT_MSG_' + i[0] + '_MB_' + str(self.skel[i[0]].index(j)) + '_EXTRA'] = etree.SubElement(vars()['DRAFT_B_CI_IT_MSG_' + i[0] + '_MB_' + 
-                                                                                                 str(self.skel[i[0]].index(j))], NS_EWS_TYPES + 'EmailAddress');
-                    vars()['DRAFT_B_CI_IT_MSG_' + i[0] + '_MB_' + str(self.skel[i[0]].index(j)) + '_EXTRA'].text = j;
+                    msg.append('<t:Mailbox><t:EmailAddress>' + _ews_xml_text(j) + '</t:EmailAddress></t:Mailbox>');
+            msg.append('</t:' + i[1] + '>');
 
-        if 'read_receipt' in self.skel:
-            if self.skel['read_receipt'] == 'Yes':
-                DRAFT_B_CI_IT_MSG_RR = etree.SubElement(DRAFT_B_CI_IT_MSG, NS_EWS_TYPES + 'IsReadReceiptRequested');
-                DRAFT_B_CI_IT_MSG_RR.text = 'true';
+        if self.skel.get('read_receipt') == 'Yes':
+            msg.append('<t:IsReadReceiptRequested>true</t:IsReadReceiptRequested>');
 
-        if 'delivery_receipt' in self.skel:
-            if self.skel['delivery_receipt'] == 'Yes':
-                DRAFT_B_CI_IT_MSG_DR = etree.SubElement(DRAFT_B_CI_IT_MSG, NS_EWS_TYPES + 'IsDeliveryReceiptRequested');
-                DRAFT_B_CI_IT_MSG_DR.text = 'true';
+        if self.skel.get('delivery_receipt') == 'Yes':
+            msg.append('<t:IsDeliveryReceiptRequested>true</t:IsDeliveryReceiptRequested>');
 
         if 'sender' in self.skel:
-            DRAFT_B_CI_IT_MSG_FROM = etree.SubElement(DRAFT_B_CI_IT_MSG, NS_EWS_TYPES + 'From');
-            DRAFT_B_CI_IT_MSG_FROM_MB = etree.SubElement(DRAFT_B_CI_IT_MSG_FROM, NS_EWS_TYPES + 'Mailbox');
-            DRAFT_B_CI_IT_MSG_FROM_MB_EXTRA = etree.SubElement(DRAFT_B_CI_IT_MSG_FROM_MB, NS_EWS_TYPES + 'EmailAddress');
-            DRAFT_B_CI_IT_MSG_FROM_MB_EXTRA.text = self.skel['sender'];            
+            msg.append('<t:From><t:Mailbox><t:EmailAddress>' + _ews_xml_text(self.skel['sender']) + '</t:EmailAddress></t:Mailbox></t:From>');
 
         if 'mark_read' in self.skel:
-            DRAFT_B_CI_IT_MSG_RD = etree.SubElement(DRAFT_B_CI_IT_MSG, NS_EWS_TYPES + 'IsRead');
             if self.skel['mark_read'] == 'Yes':
-                DRAFT_B_CI_IT_MSG_RD.text = 'true';
+                msg.append('<t:IsRead>true</t:IsRead>');
             else:
-                DRAFT_B_CI_IT_MSG_RD.text = 'false';
+                msg.append('<t:IsRead>false</t:IsRead>');
+
+        msg.append('</t:Message>');
+        return ''.join(msg);
+
+
+    def finalize(self):
+        ''' Create SOAP Request Body for Email
+
+        The request is serialized from a precompiled template, without building
+        an XML tree, and without pretty-printing, to UTF-8 encoded bytes, which
+        are sent as they are. Use show('request') to display it in a human
+        readable form.
+        '''
+
+        (head, tail) = self._ews_create_item_envelope(self.skel.get('disposition', 'SaveOnly'));
+        self.xml = (head + self._ews_message() + tail).encode('utf-8');
+        return;
+
+
+    def validate(self):
+        ''' Validates SOAP Request Body against EWS XML schema, returns True when valid
+
+        Meant for debugging, because EWS validates requests on its own.
+        '''
+
+        if self.xml is None:
+            self._log('Email is not finalized', 'ERROR');
+            return False;
+
+        exsv = EWSXmlSchemaValidator(self.xml);
+        for i in exsv.logs:
+            self._log(i[0], i[1]);
+        return exsv.valid;
+
+
+    def disposition(self, i):
+        ''' Defines Email Message Disposition, e.g. SaveOnly, SendOnly, or SendAndSaveCopy '''
+
+        if not isinstance(i, str):
+            self._log('Email message disposition property is invalid', 'CRIT');
+            return;
+
+        if i not in ['SaveOnly', 'SendOnly', 'SendAndSaveCopy']:
+            self._log('Email message disposition property is not SaveOnly, SendOnly, or SendAndSaveCopy', 'WARN');
+            return;
+
+        self.skel['disposition'] = i;
+        if self.verbose >= 4:
+            self._log('Email message disposition property is ' + i, 'INFO');
 
-        xmlb = b'<?xml version="1.0" encoding="utf-8"?>\n' + etree.tostring(DRAFT, pretty_print=True);
-        self.xml =  xmlb.decode("utf-8");
         return;
 
 
@@ -389,8 +416,7 @@ class EWSEmail:
 
         self.verbose = verbose;
 
-        self.log = {};
-        self._log_id = 0;
+        self.log = EWSLogBuffer();
         self.error = False;
 
         self.xml = None;
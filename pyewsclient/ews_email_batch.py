@@ -0,0 +1,123 @@
+#   PyEwsClient - Microsoft Office 365 EWS (Exchange Web Services) Client Library
+#   Copyright (C) 2013 Paul Greenberg <paul@greenberg.pro>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys;
+import logging;
+import datetime;
+from lxml import etree;
+from pyewsclient.ews_helper import EWSLogBuffer, _ews_log, _ews_log_format, _ews_last_error;
+from pyewsclient.ews_exceptions import EWSError;
+from pyewsclient.ews_email import EWSEmail;
+
+_ews_logger = logging.getLogger(__name__);
+
+
+class EWSEmailBatch:
+    '''Represents a batch of Microsoft Office 365 EWS Email Draft Objects.
+
+    All emails in the batch are submitted in a single CreateItem request. EWS
+    responds with one CreateItemResponseMessage per email, in the same order.
+    The emails must share the same message disposition.
+    '''
+
+    def _exit(self, lvl=0):
+        ''' Raises EWSError with the last error, instead of exiting the process '''
+        raise EWSError(_ews_last_error(self) or type(self).__name__ + ' failed');
+
+
+    def _log(self, msg='TEST', lvl='INFO'):
+        ''' Logging '''
+        _ews_log(self, _ews_logger, msg, lvl);
+        return;
+
+
+    def show(self, t=None, p=None):
+        ''' Display information '''
+        if t == 'log':
+            ''' Display log buffer '''
+            for entry in self.log.snapshot():
+                if p == 'error' and entry['level'] not in ['CRIT', 'ERROR']:
+                    continue;
+                print(_ews_log_format(self, entry));
+        elif t == 'request':
+            ''' Display SOAP XML Request '''
+            if self.xml:
+                xml = etree.tostring(etree.fromstring(self.xml), pretty_print=True, encoding='unicode');
+                for x in xml.split('\n'):
+                    print("{0:26s} | {1:s} | {2:s} | {3:s}".format(str(datetime.datetime.now()),
+                        __file__.split('/')[-1] + '->' + str(type(self).__name__) + '.' + str(sys._getframe(1).f_code.co_name) + '()',
+                        'INFO', x));
+        else:
+            pass;
+        return;
+
+
+    def clear(self, t=None, p=None):
+        if t == 'log':
+            self.log.clear();
+        return;
+
+
+    def finalize(self):
+        ''' Create SOAP Request Body for all Emails in the batch, as UTF-8 encoded bytes '''
+
+        if len(self.emails) < 1:
+            self._log('No emails', 'CRIT');
+            return;
+
+        dispositions = set([email.skel.get('disposition', 'SaveOnly') for email in self.emails]);
+        if len(dispositions) > 1:
+            self._log('Emails in the batch have different message dispositions: ' + ', '.join(sorted(dispositions)), 'CRIT');
+            return;
+
+        (head, tail) = EWSEmail._ews_create_item_envelope(dispositions.pop());
+        self.xml = b''.join([head.encode('utf-8')] + [email._ews_message().encode('utf-8') for email in self.emails] + [tail.encode('utf-8')]);
+        return;
+
+
+    def add(self, email=None):
+        ''' Adds Email Draft Object to the batch '''
+
+        if not isinstance(email, EWSEmail):
+            self._log('Email batch item is invalid, because it is not EWSEmail', 'ERROR');
+            return;
+
+        self.emails.append(email);
+        if self.verbose >= 5:
+            self._log('email ' + str(len(self.emails)) + ' was added to the batch', 'INFO');
+        return;
+
+
+    def __init__(self, emails=None, verbose=0):
+        ''' Initialize Microsoft Office 365 EWS Email Batch Object '''
+
+        self.verbose = verbose;
+
+        self.log = EWSLogBuffer();
+        self.error = False;
+
+        self.xml = None;
+
+        self.emails = [];
+
+        if self.verbose > 0:
+            self._log( 'Log Level : ' + str(self.verbose), 'INFO');
+
+        if emails is not None:
+            for email in emails:
+                self.add(email);
+
+        return;
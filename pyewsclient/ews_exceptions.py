@@ -0,0 +1,57 @@
+#   PyEwsClient - Microsoft Office 365 EWS (Exchange Web Services) Client Library
+#   Copyright (C) 2013 Paul Greenberg <paul@greenberg.pro>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+class EWSError(Exception):
+    '''Represents Microsoft Office 365 EWS client error.
+
+    response holds the EWS Response Object of the failed request, if any, and
+    code the EWS response code, or the HTTP status code.
+    '''
+
+    def __init__(self, msg=None, response=None, code=None):
+        Exception.__init__(self, msg);
+        self.response = response;
+        self.code = code;
+        return;
+
+
+class EWSInputError(EWSError, ValueError):
+    '''Represents invalid argument, e.g. non-string username.'''
+
+
+class EWSAutodiscoverError(EWSError):
+    '''Represents failure to discover EWS endpoint.'''
+
+
+class EWSTransportError(EWSError):
+    '''Represents connection failure, timeout, or unexpected HTTP response.'''
+
+
+class EWSAuthError(EWSError):
+    '''Represents authentication or authorization failure, i.e. HTTP 401 or 403.'''
+
+
+class EWSThrottledError(EWSError):
+    '''Represents EWS endpoint throttling that persisted through all retries.'''
+
+
+class EWSSchemaError(EWSError):
+    '''Represents XML document failing XML schema validation.'''
+
+
+class EWSResponseError(EWSError):
+    '''Represents SOAP fault, or EWS response whose response messages all failed.'''
@@ -16,61 +16,511 @@
 
 import os;
 import sys;
-import requests;
 import datetime;
 import traceback;
-import requests;
-from requests.auth import HTTPBasicAuth;
 from lxml import etree;
-import pprint;
-import re;
+import json;
+import time;
+import threading;
+import collections;
+import logging;
 
+from pyewsclient.ews_exceptions import EWSInputError;
 
-class EWSXmlSchemaValidator:
-    '''Represents Microsoft Office 365 EWS XML Schema Validation Funstion.'''
 
-    def __init__(self, xmlreq, xmlsch=None):
-        ''' XML Schema Validation '''
+EWS_LOG_LEVELS = {'DEBUG': logging.DEBUG, 'INFO': logging.INFO, 'WARN': logging.WARNING,
+                  'ERROR': logging.ERROR, 'CRIT': logging.CRITICAL};
 
-        self.valid = False;
-        self.logs = [];
+logging.getLogger('pyewsclient').addHandler(logging.NullHandler());
+
+
+class EWSLogBuffer(collections.deque):
+    '''Represents bounded log buffer of EWS objects.
+
+    Only the most recent size entries are kept, 1000 by default or the value
+    of PYEWSCLIENT_LOG_BUFFER environment variable. The buffer is updated
+    under its own lock, and readers iterate over snapshot() of the buffer.
+    '''
+
+    default_size = int(os.environ.get('PYEWSCLIENT_LOG_BUFFER', '1000'));
+
+    def append(self, entry):
+        with self.lock:
+            collections.deque.append(self, entry);
+        return;
+
+
+    def extend(self, entries):
+        with self.lock:
+            collections.deque.extend(self, entries);
+        return;
+
+
+    def clear(self):
+        with self.lock:
+            collections.deque.clear(self);
+        return;
+
+
+    def snapshot(self):
+        ''' Returns the list of the log buffer entries '''
+        with self.lock:
+            return list(self);
+
+
+    def __init__(self, size=None):
+        collections.deque.__init__(self, maxlen=size if size is not None else self.default_size);
+        self.size = self.maxlen;
+        self.lock = threading.Lock();
+        return;
+
+
+def _ews_log(obj, logger, msg, lvl):
+    ''' Shared logging path of EWS objects, called from their _log() method
+
+    CRIT and ERROR entries flag the object as failed. The entry is kept in the
+    log buffer of the object when it is WARN or above, or when the object is
+    verbose, and it is passed to the stdlib logger when the logger is enabled
+    for its level. Otherwise, the entry is dropped without any formatting.
+    Entries keep the time.time() timestamp only, and they are formatted by
+    _ews_log_format().
+    '''
+    level = EWS_LOG_LEVELS[lvl];
+    if level >= logging.ERROR:
+        obj.error = True;
+    keep = level >= logging.WARNING or (obj.verbose or 0) > 0;
+    forward = logger.isEnabledFor(level);
+    if not keep and not forward:
+        return;
+    if forward:
+        # the logger resolves the caller of _log() only when the record is emitted
+        logger.log(level, '%s %s', type(obj).__name__, msg, stacklevel=3);
+    if keep:
+        ts = time.time();
+        obj.log.extend([{'ts': ts, 'level': lvl, 'text': xmsg} for xmsg in msg.split('\n')]);
+    return;
+
+
+def _ews_log_format(obj, entry):
+    ''' Formats log buffer entry of an EWS object for show() '''
+    return "{0:26s} | {1:s} | {2:s} | {3:s}".format(str(datetime.datetime.fromtimestamp(entry['ts'])),
+                                                   type(obj).__module__.split('.')[-1] + '.py->' + type(obj).__name__,
+                                                   entry['level'], entry['text']);
+
+
+def _ews_last_error(obj):
+    ''' Returns the text of the last CRIT or ERROR entry in the log buffer of an EWS object '''
+    for entry in reversed(obj.log.snapshot()):
+        if entry['level'] in ['CRIT', 'ERROR'] and entry['text'].strip():
+            return entry['text'];
+    return None;
 
+
+class EWSXmlSchemaCache:
+    '''Represents Microsoft Office 365 EWS XML Schema Cache.
+
+    Schema documents are keyed by schema file name, e.g. messages.xsd, and
+    they are parsed only once per process. Each thread validates against its
+    own compiled XML schema, so that validation runs concurrently and the lock
+    is held only while a schema is parsed or compiled. Setting
+    PYEWSCLIENT_SCHEMA_PREWARM environment variable to 1, or to a comma
+    separated list of schema file names, compiles the schemas at import time.
+    '''
+
+    default = 'messages.xsd';
+    prewarm_default = ['messages.xsd', 'autodiscover.response.xsd'];
+    docs = {};
+    generation = 0;
+    local = threading.local();
+    lock = threading.Lock();
+
+    @classmethod
+    def get(cls, xmlsch=None):
+        ''' Returns compiled XML schema of the current thread, compiling it on first use '''
         if xmlsch is None:
-            xmlsch = 'xml/messages.xsd';
-        else:
-            xmlsch = 'xml/' + xmlsch;
+            xmlsch = cls.default;
+        if getattr(cls.local, 'generation', None) != cls.generation:
+            cls.local.schemas = {};
+            cls.local.generation = cls.generation;
+        msg_schema = cls.local.schemas.get(xmlsch);
+        if msg_schema is not None:
+            return msg_schema;
+        with cls.lock:
+            msg_schema_doc = cls.docs.get(xmlsch);
+            if msg_schema_doc is None:
+                msg_schema_xsd = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xml', xmlsch);
+                msg_schema_doc = etree.parse(msg_schema_xsd);
+                cls.docs[xmlsch] = msg_schema_doc;
+            msg_schema = etree.XMLSchema(msg_schema_doc);
+        cls.local.schemas[xmlsch] = msg_schema;
+        return msg_schema;
+
+
+    @classmethod
+    def validate(cls, doc, xmlsch=None):
+        ''' Validates parsed XML document, returns validity flag and error log '''
+        msg_schema = cls.get(xmlsch);
+        if msg_schema.validate(doc):
+            return (True, None);
+        return (False, str(msg_schema.error_log));
+
+
+    @classmethod
+    def prewarm(cls, xmlschs=None):
+        ''' Parses and compiles XML schemas ahead of their first use '''
+        if xmlschs is None:
+            xmlschs = cls.prewarm_default;
+        for xmlsch in xmlschs:
+            cls.get(xmlsch);
+        return;
+
+
+    @classmethod
+    def clear(cls):
+        ''' Drops all parsed and compiled XML schemas '''
+        with cls.lock:
+            cls.docs.clear();
+            cls.generation += 1;
+        return;
+
+
+class EWSAutodiscoverCache:
+    '''Represents Microsoft Office 365 EWS Autodiscover Result Cache.
 
-        if not isinstance(xmlreq, bytes):
-            xmlreq = bytes(xmlreq, 'utf-8');
+    The discovered EWS endpoint and the cookies set by the autodiscovery
+    service are kept process-wide per autodiscovery service URL and mailbox
+    for ttl seconds, so that e.g. a session pointed at EWSMockServer never
+    hands its endpoint to a production session. When path is
+    set, e.g. via PYEWSCLIENT_AUTODISCOVER_CACHE environment variable, the
+    entries are also persisted in that file, so that short-lived processes
+    skip autodiscovery too. The file holds session cookies and is created
+    readable by its owner only.
+    '''
 
+    ttl = int(os.environ.get('PYEWSCLIENT_AUTODISCOVER_TTL', '3600'));
+    path = os.environ.get('PYEWSCLIENT_AUTODISCOVER_CACHE') or None;
+    entries = {};
+    loaded = None;
+    lock = threading.Lock();
+
+    @classmethod
+    def _key(cls, mailbox, autodiscover_url=None):
+        return str(autodiscover_url or '').strip().lower() + ' ' + str(mailbox).strip().lower();
+
+
+    @classmethod
+    def _read(cls):
+        ''' Returns the entries of cache file, or an empty dictionary '''
         try:
-            msg_schema_xsd = os.path.join('/'.join(os.path.abspath(__file__).split('/')[:-1]), xmlsch);
-            msg_schema = etree.XMLSchema(file=msg_schema_xsd);
-        except Exception as err:
-            self.logs.append((str(err), 'ERROR'));
-            self.logs.append((str(traceback.format_exc()), 'ERROR'));
+            with open(cls.path, 'r') as f:
+                entries = json.load(f);
+        except Exception:
+            return {};
+        if not isinstance(entries, dict):
+            return {};
+        return dict([(k, entries[k]) for k in entries if isinstance(entries[k], dict) and 'server' in entries[k]]);
+
+
+    @classmethod
+    def _load(cls):
+        ''' Reads cache file once per path, the caller holds the lock '''
+        if cls.path is None or cls.loaded == cls.path:
             return;
+        cls.loaded = cls.path;
+        entries = cls._read();
+        for k in entries:
+            if k not in cls.entries:
+                cls.entries[k] = entries[k];
+        return;
 
+
+    @classmethod
+    def _file_lock(cls):
+        ''' Locks cache file against other processes, returns the descriptor to close, or None where flock is unavailable '''
+        try:
+            import fcntl;
+        except ImportError:
+            return None;
+        fd = os.open(cls.path + '.lock', os.O_WRONLY | os.O_CREAT, 0o600);
         try:
-            xmlreq_valid = msg_schema.validate(etree.fromstring(xmlreq));
-            self.valid = True;
+            fcntl.flock(fd, fcntl.LOCK_EX);
+        except Exception:
+            os.close(fd);
+            raise;
+        return fd;
+
+
+    @classmethod
+    def _save(cls, k):
+        ''' Writes the entry for key k, or its removal, to cache file atomically, the caller holds the lock
+
+        The file is re-read under file lock, and only the entry for k is
+        changed, so that entries stored or invalidated by other processes
+        are kept as they are.
+        '''
+        if cls.path is None:
+            return;
+        tmp = cls.path + '.' + str(os.getpid()) + '.tmp';
+        fd = None;
+        try:
+            fd = cls._file_lock();
+            now = time.time();
+            entries = cls._read();
+            entries = dict([(x, entries[x]) for x in entries if now - entries[x].get('ts', 0) < cls.ttl]);
+            if k in cls.entries:
+                entries[k] = cls.entries[k];
+            else:
+                entries.pop(k, None);
+            f = os.fdopen(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w');
+            with f:
+                json.dump(entries, f);
+            os.replace(tmp, cls.path);
+        except Exception:
+            try:
+                os.remove(tmp);
+            except Exception:
+                pass;
+        finally:
+            if fd is not None:
+                os.close(fd);
+        return;
+
+
+    @classmethod
+    def get(cls, mailbox, autodiscover_url=None):
+        ''' Returns cached EWS endpoint server and cookies for mailbox discovered via autodiscover_url, or None '''
+        k = cls._key(mailbox, autodiscover_url);
+        with cls.lock:
+            cls._load();
+            entry = cls.entries.get(k);
+            if entry is None:
+                return None;
+            if time.time() - entry['ts'] >= cls.ttl:
+                del cls.entries[k];
+                return None;
+            cookies = entry.get('cookies') or [];
+            return (entry['server'], [dict(c) for c in cookies] if isinstance(cookies, list) else dict(cookies));
+
+
+    @classmethod
+    def set(cls, mailbox, server, cookies=None, autodiscover_url=None):
+        ''' Stores EWS endpoint server and cookies, see EWSCookieJar.export(), or a dictionary of cookie names and values, for mailbox
+        discovered via autodiscover_url
+        '''
+        k = cls._key(mailbox, autodiscover_url);
+        if isinstance(cookies, dict):
+            cookies = dict(cookies);
+        else:
+            cookies = [dict(c) for c in (cookies or [])];
+        with cls.lock:
+            cls._load();
+            cls.entries[k] = {'server': server, 'cookies': cookies, 'ts': time.time()};
+            cls._save(k);
+        return;
+
+
+    @classmethod
+    def invalidate(cls, mailbox, server=None, autodiscover_url=None):
+        ''' Drops cached entry for mailbox discovered via autodiscover_url, optionally only when it points to server '''
+        k = cls._key(mailbox, autodiscover_url);
+        with cls.lock:
+            cls._load();
+            entry = cls.entries.get(k);
+            if entry is None or (server is not None and entry['server'] != server):
+                return;
+            del cls.entries[k];
+            cls._save(k);
+        return;
+
+
+    @classmethod
+    def clear(cls):
+        ''' Drops all cached entries, including the cache file '''
+        with cls.lock:
+            cls.entries.clear();
+            cls.loaded = cls.path;
+            if cls.path is not None:
+                try:
+                    os.remove(cls.path);
+                except Exception:
+                    pass;
+        return;
+
+
+class EWSXmlSchemaValidator:
+    '''Represents Microsoft Office 365 EWS XML Schema Validation Funstion.'''
+
+    def __init__(self, xmlreq, xmlsch=None):
+        ''' XML Schema Validation
+
+        The document may be a string, bytes, or an already parsed lxml element
+        or element tree. The document is parsed at most once and the parsed
+        root element is kept in self.tree for further processing.
+        '''
+
+        self.valid = False;
+        self.logs = [];
+        self.tree = None;
+
+        try:
+            if isinstance(xmlreq, etree._ElementTree):
+                self.tree = xmlreq.getroot();
+            elif etree.iselement(xmlreq):
+                self.tree = xmlreq;
+            else:
+                if not isinstance(xmlreq, bytes):
+                    xmlreq = bytes(xmlreq, 'utf-8');
+                self.tree = etree.fromstring(xmlreq);
         except Exception as err:
             self.logs.append((str(err), 'ERROR'));
             self.logs.append((str(traceback.format_exc()), 'ERROR'));
-            self.valid = False;
+            self.logs.append(('XML document failed XML schema validation', 'ERROR'));
+            return;
 
         try:
-            msg_schema.assertValid(etree.fromstring(xmlreq));
-            self.valid = True;
+            (self.valid, xmlerr) = EWSXmlSchemaCache.validate(self.tree, xmlsch);
         except Exception as err:
             self.logs.append((str(err), 'ERROR'));
             self.logs.append((str(traceback.format_exc()), 'ERROR'));
             self.valid = False;
+            xmlerr = None;
 
         if self.valid is not True:
+            if xmlerr:
+                self.logs.append((xmlerr, 'ERROR'));
             self.logs.append(('XML document failed XML schema validation', 'ERROR'));
             return;
 
         self.logs.append(('XML document passed XML schema validation', 'INFO'));
-        self.valid = True;
         return;
+
+class EWSValidationPolicy:
+    '''Represents XML schema validation policy for EWS responses.
+
+    mode is one of:
+     * always: every response is validated against messages.xsd
+     * never: no response is validated against messages.xsd
+     * sampled: one in every sample responses is validated
+     * first: responses are validated per operation, e.g. save_only, until
+       one of them passes validation
+
+    Responses that are not validated against the XML schema undergo check(),
+    a structural check of the elements the response parser relies upon. When
+    requests is True, outgoing requests are validated against messages.xsd
+    before they are sent, which is meant for debugging. A policy may be
+    shared by many sessions.
+    '''
+
+    modes = ['always', 'never', 'sampled', 'first'];
+    messages = {'save_only': 'CreateItemResponseMessage', 'send': 'CreateItemResponseMessage',
+                'send_and_save': 'SendItemResponseMessage', 'attachment': 'CreateAttachmentResponseMessage'};
+
+    def should_validate(self, operation):
+        ''' Returns True when the response to an operation is due for XML schema validation '''
+        if self.mode == 'always':
+            return True;
+        if self.mode == 'never':
+            return False;
+        with self.lock:
+            if self.mode == 'sampled':
+                self.count += 1;
+                return (self.count - 1) % self.sample == 0;
+            return operation not in self.passed;
+
+
+    def record(self, operation, valid):
+        ''' Records the outcome of XML schema validation of the response to an operation '''
+        with self.lock:
+            self.stats['validated'] += 1;
+            if valid:
+                self.passed.add(operation);
+            else:
+                self.stats['failed'] += 1;
+        return;
+
+
+    def check_item(self, item, tag, operation):
+        ''' Checks decoded EWS response message, returns None, or the description of its defect '''
+        if item['ResponseClass'] not in ['Success', 'Warning', 'Error']:
+            return tag + ' has invalid ResponseClass: ' + str(item['ResponseClass']);
+        if not item['ResponseCode']:
+            return tag + ' has no ResponseCode';
+        if item['ResponseClass'] != 'Success':
+            return None;
+        if operation == 'save_only' and (item['Id'] is None or item['ChangeKey'] is None):
+            return tag + ' has no ItemId with Id and ChangeKey';
+        if operation == 'attachment' and (item['Id'] is None or item['ChangeKey'] is None):
+            return tag + ' has no AttachmentId with RootItemId and RootItemChangeKey';
+        return None;
+
+
+    def check_message(self, m, operation):
+        ''' Checks the structure of EWS response message, returns None, or the description of its defect '''
+
+        NS_EWS_MESSAGES = "{http://schemas.microsoft.com/exchange/services/2006/messages}";
+        NS_EWS_TYPES = "{http://schemas.microsoft.com/exchange/services/2006/types}";
+
+        item = {'ResponseClass': m.get('ResponseClass'), 'ResponseCode': m.findtext(NS_EWS_MESSAGES + 'ResponseCode'),
+                'Id': None, 'ChangeKey': None};
+        if operation == 'save_only':
+            n = m.find(NS_EWS_MESSAGES + 'Items/' + NS_EWS_TYPES + 'Message/' + NS_EWS_TYPES + 'ItemId');
+            if n is not None:
+                item['Id'] = n.get('Id');
+                item['ChangeKey'] = n.get('ChangeKey');
+        if operation == 'attachment':
+            n = m.find(NS_EWS_MESSAGES + 'Attachments/' + NS_EWS_TYPES + 'FileAttachment/' + NS_EWS_TYPES + 'AttachmentId');
+            if n is not None:
+                item['Id'] = n.get('RootItemId');
+                item['ChangeKey'] = n.get('RootItemChangeKey');
+        return self.check_item(item, m.tag.replace(NS_EWS_MESSAGES, ''), operation);
+
+
+    def check(self, t, operation):
+        ''' Checks the structure of parsed EWS response, returns None, or the description of its first defect '''
+
+        NS_SOAP_ENV = "{http://schemas.xmlsoap.org/soap/envelope/}";
+        NS_EWS_MESSAGES = "{http://schemas.microsoft.com/exchange/services/2006/messages}";
+
+        with self.lock:
+            self.stats['checked'] += 1;
+
+        if t.tag != NS_SOAP_ENV + 'Envelope':
+            return 'root element is ' + str(t.tag) + ', not SOAP Envelope';
+        if t.find(NS_SOAP_ENV + 'Body') is None:
+            return 'SOAP Body is missing';
+
+        tag = self.messages.get(operation);
+        if tag is None:
+            return None;
+        ms = list(t.iter(NS_EWS_MESSAGES + tag));
+        if not ms:
+            return tag + ' is missing';
+        for m in ms:
+            defect = self.check_message(m, operation);
+            if defect is not None:
+                return defect;
+        return None;
+
+
+    def __init__(self, mode='always', sample=100, requests=False):
+        ''' Initialize EWS Validation Policy '''
+
+        if mode not in self.modes:
+            raise EWSInputError('expects validation mode to be one of ' + ', '.join(self.modes) + ', not ' + str(mode));
+
+        self.mode = mode;
+        self.sample = max(1, int(sample));
+        self.requests = requests;
+
+        self.count = 0;
+        self.passed = set();
+        self.lock = threading.Lock();
+        self.stats = {'validated': 0, 'failed': 0, 'checked': 0};
+
+        return;
+
+if os.environ.get('PYEWSCLIENT_SCHEMA_PREWARM', '') not in ['', '0']:
+    if os.environ['PYEWSCLIENT_SCHEMA_PREWARM'] == '1':
+        EWSXmlSchemaCache.prewarm();
+    else:
+        EWSXmlSchemaCache.prewarm([x.strip() for x in os.environ['PYEWSCLIENT_SCHEMA_PREWARM'].split(',') if x.strip()]);
@@ -0,0 +1,219 @@
+#   PyEwsClient - Microsoft Office 365 EWS (Exchange Web Services) Client Library
+#   Copyright (C) 2013 Paul Greenberg <paul@greenberg.pro>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import socket;
+import threading;
+
+
+class EWSMetrics:
+    '''Represents metrics sink for EWS requests.
+
+    The session calls record() with the EWS Response Object of every request.
+    record() translates it into counters and histograms, labelled with the EWS
+    operation, and passes them to increment() and observe(), which this class
+    discards. Subclasses override increment() and observe() to export the
+    metrics, or record() to receive the EWS Response Objects as they are.
+
+    Metrics:
+     * ews_requests_total{operation,status,code}: requests
+     * ews_request_errors_total{operation}: failed requests
+     * ews_retries_total{operation}: request retries
+     * ews_response_messages_total{operation,class,code}: response messages
+     * ews_bytes_sent_total{operation}, ews_bytes_received_total{operation}:
+       request and response body bytes, as sent over the connection
+     * ews_request_size_bytes{operation}, ews_response_size_bytes{operation}:
+       size of request and response bodies before compression
+     * ews_request_duration_seconds{operation,stage}: duration of request
+       stages, i.e. connect, tls, write, ttfb, read, request, validation,
+       parsing and total
+    '''
+
+    operations = {'save_only': 'CreateItem', 'send': 'CreateItem', 'attachment': 'CreateAttachment',
+                  'send_and_save': 'SendItem'};
+
+    def increment(self, name, value=1, labels=None):
+        ''' Increments counter '''
+        return;
+
+
+    def observe(self, name, value, labels=None):
+        ''' Records histogram observation '''
+        return;
+
+
+    def record(self, r):
+        ''' Records metrics of EWS Response Object '''
+        op = self.operations.get(r.stage, str(r.stage));
+        self.increment('ews_requests_total', 1, {'operation': op, 'status': str(r.status), 'code': str(r.response_code)});
+        if r.error:
+            self.increment('ews_request_errors_total', 1, {'operation': op});
+        if r.retries:
+            self.increment('ews_retries_total', r.retries, {'operation': op});
+        for item in r.items:
+            self.increment('ews_response_messages_total', 1, {'operation': op, 'class': str(item.get('ResponseClass')),
+                                                              'code': str(item.get('ResponseCode'))});
+        self.increment('ews_bytes_sent_total', r.bytes_sent, {'operation': op});
+        self.increment('ews_bytes_received_total', r.bytes_received, {'operation': op});
+        self.observe('ews_request_size_bytes', r.request_size, {'operation': op});
+        self.observe('ews_response_size_bytes', r.response_size, {'operation': op});
+        for stage in r.timings:
+            self.observe('ews_request_duration_seconds', r.timings[stage], {'operation': op, 'stage': stage});
+        return;
+
+
+class EWSMetricsRegistry(EWSMetrics):
+    '''Represents in-memory metrics registry.
+
+    Counters and histograms are aggregated per name and label set, and can be
+    read with snapshot() or exported in Prometheus text format with
+    prometheus().
+    '''
+
+    buckets = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0];
+    size_buckets = [1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864];
+
+    def _key(self, name, labels):
+        return (name, tuple(sorted((labels or {}).items())));
+
+
+    def _buckets(self, name):
+        ''' Returns histogram buckets, in bytes for names ending with _bytes, or else in seconds '''
+        return self.size_buckets if name.endswith('_bytes') else self.buckets;
+
+
+    def increment(self, name, value=1, labels=None):
+        ''' Increments counter '''
+        k = self._key(name, labels);
+        with self.lock:
+            self.counters[k] = self.counters.get(k, 0) + value;
+        return;
+
+
+    def observe(self, name, value, labels=None):
+        ''' Records histogram observation '''
+        k = self._key(name, labels);
+        with self.lock:
+            h = self.histograms.get(k);
+            if h is None:
+                h = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(self._buckets(name))};
+                self.histograms[k] = h;
+            h['count'] += 1;
+            h['sum'] += value;
+            for (i, le) in enumerate(self._buckets(name)):
+                if value <= le:
+                    h['buckets'][i] += 1;
+        return;
+
+
+    def snapshot(self):
+        ''' Returns copy of counters and histograms, keyed by name and sorted label pairs '''
+        with self.lock:
+            return {'counters': dict(self.counters),
+                    'histograms': dict([(k, {'count': v['count'], 'sum': v['sum'], 'buckets': list(v['buckets'])})
+                                        for (k, v) in self.histograms.items()])};
+
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear();
+            self.histograms.clear();
+        return;
+
+
+    def prometheus(self):
+        ''' Returns metrics in Prometheus text exposition format '''
+
+        def fmt(name, labels, extra=None):
+            pairs = list(labels) + ([extra] if extra else []);
+            if not pairs:
+                return name;
+            return name + '{' + ','.join([k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for (k, v) in pairs]) + '}';
+
+        snap = self.snapshot();
+        lines = [];
+        seen = set();
+        for (k, v) in sorted(snap['counters'].items()):
+            if k[0] not in seen:
+                seen.add(k[0]);
+                lines.append('# TYPE ' + k[0] + ' counter');
+            lines.append(fmt(k[0], k[1]) + ' ' + str(v));
+        for (k, v) in sorted(snap['histograms'].items()):
+            if k[0] not in seen:
+                seen.add(k[0]);
+                lines.append('# TYPE ' + k[0] + ' histogram');
+            for (i, le) in enumerate(self._buckets(k[0])):
+                lines.append(fmt(k[0] + '_bucket', k[1], ('le', str(le))) + ' ' + str(v['buckets'][i]));
+            lines.append(fmt(k[0] + '_bucket', k[1], ('le', '+Inf')) + ' ' + str(v['count']));
+            lines.append(fmt(k[0] + '_sum', k[1]) + ' ' + repr(v['sum']));
+            lines.append(fmt(k[0] + '_count', k[1]) + ' ' + str(v['count']));
+        return '\n'.join(lines) + '\n';
+
+
+    def __init__(self):
+        ''' Initialize EWS Metrics Registry '''
+
+        self.lock = threading.Lock();
+        self.counters = {};
+        self.histograms = {};
+
+        return;
+
+
+class EWSStatsdMetrics(EWSMetrics):
+    '''Represents StatsD metrics exporter.
+
+    Counters are sent as StatsD counters and histogram observations of
+    durations as timers, in milliseconds, and of sizes as histograms, over
+    UDP. Labels are sent as DogStatsD tags, unless tags
+    is False, in which case they are dropped.
+    '''
+
+    def _send(self, name, value, kind, labels):
+        line = self.prefix + name + ':' + value + '|' + kind;
+        if self.tags and labels:
+            line += '|#' + ','.join([k + ':' + str(labels[k]) for k in sorted(labels)]);
+        try:
+            self.sock.sendto(line.encode('utf-8'), self.addr);
+        except Exception:
+            pass;
+        return;
+
+
+    def increment(self, name, value=1, labels=None):
+        ''' Sends counter '''
+        if value:
+            self._send(name, str(value), 'c', labels);
+        return;
+
+
+    def observe(self, name, value, labels=None):
+        ''' Sends timer, in milliseconds, or histogram '''
+        if name.endswith('_seconds'):
+            self._send(name[:-len('_seconds')] + '_ms', '{0:.3f}'.format(value * 1000), 'ms', labels);
+        else:
+            self._send(name, str(value), 'h', labels);
+        return;
+
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='pyewsclient.', tags=True):
+        ''' Initialize EWS StatsD Metrics Exporter '''
+
+        self.addr = (host, port);
+        self.prefix = prefix;
+        self.tags = tags;
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM);
+
+        return;
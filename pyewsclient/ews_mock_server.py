@@ -0,0 +1,324 @@
+#   PyEwsClient - Microsoft Office 365 EWS (Exchange Web Services) Client Library
+#   Copyright (C) 2013 Paul Greenberg <paul@greenberg.pro>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time;
+import zlib;
+import base64;
+import random;
+import threading;
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer;
+from lxml import etree;
+
+
+_ews_mock_envelope = '<?xml version="1.0" encoding="utf-8"?>' \
+                     '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body>' \
+                     '<m:{0}Response xmlns:m="http://schemas.microsoft.com/exchange/services/2006/messages" ' \
+                     'xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types">' \
+                     '<m:ResponseMessages>{1}</m:ResponseMessages></m:{0}Response></s:Body></s:Envelope>';
+
+_ews_mock_fault = '<?xml version="1.0" encoding="utf-8"?>' \
+                  '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/"><s:Body><s:Fault>' \
+                  '<faultcode xmlns:a="http://schemas.microsoft.com/exchange/services/2006/types">a:ErrorServerBusy</faultcode>' \
+                  '<faultstring xml:lang="en-US">The server cannot service this request right now. Try again later.</faultstring>' \
+                  '<detail><e:ResponseCode xmlns:e="http://schemas.microsoft.com/exchange/services/2006/errors">ErrorServerBusy</e:ResponseCode>' \
+                  '<e:Message xmlns:e="http://schemas.microsoft.com/exchange/services/2006/errors">The server cannot service this request right now. Try again later.</e:Message>' \
+                  '<t:MessageXml xmlns:t="http://schemas.microsoft.com/exchange/services/2006/types">' \
+                  '<t:Value Name="BackOffMilliseconds">{0}</t:Value></t:MessageXml></detail></s:Fault></s:Body></s:Envelope>';
+
+_ews_mock_busy = '<m:{0}ResponseMessage ResponseClass="Error"><m:MessageText>The server cannot service this request right now. Try again later.</m:MessageText>' \
+                 '<m:ResponseCode>ErrorServerBusy</m:ResponseCode><m:DescriptiveLinkKey>0</m:DescriptiveLinkKey>' \
+                 '<m:MessageXml><t:Value Name="BackOffMilliseconds">{1}</t:Value></m:MessageXml>{2}</m:{0}ResponseMessage>';
+
+_ews_mock_autodiscover = '<?xml version="1.0" encoding="utf-8"?>' \
+                         '<Autodiscover xmlns="http://schemas.microsoft.com/exchange/autodiscover/responseschema/2006">' \
+                         '<Response xmlns="http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006a">' \
+                         '<User><DisplayName>{0}</DisplayName><LegacyDN>/o=ExchangeLabs/ou=Exchange Administrative Group/cn=Recipients/cn={0}</LegacyDN>' \
+                         '<AutoDiscoverSMTPAddress>{0}</AutoDiscoverSMTPAddress><DeploymentId>00000000-0000-0000-0000-000000000000</DeploymentId></User>' \
+                         '<Account><AccountType>email</AccountType><Action>settings</Action><MicrosoftOnline>True</MicrosoftOnline>' \
+                         '<Protocol><Type>EXPR</Type><Server>{1}</Server><EwsUrl>{2}</EwsUrl></Protocol></Account>' \
+                         '</Response></Autodiscover>';
+
+
+class _EWSMockRequestHandler(BaseHTTPRequestHandler):
+    '''Represents HTTP request handler of EWSMockServer.'''
+
+    protocol_version = 'HTTP/1.1';
+    disable_nagle_algorithm = True;
+
+    def log_message(self, *args):
+        return;
+
+
+    def _reply(self, status, body, headers=None):
+        body = body.encode('utf-8');
+        self.send_response(status);
+        self.send_header('Content-Type', 'text/xml; charset=utf-8');
+        if body and self.server.mock.compression and 'gzip' in str(self.headers.get('Accept-Encoding')).lower():
+            c = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS);
+            body = c.compress(body) + c.flush();
+            self.send_header('Content-Encoding', 'gzip');
+        self.send_header('Content-Length', str(len(body)));
+        for h in (headers or []):
+            self.send_header(h[0], h[1]);
+        self.end_headers();
+        self.wfile.write(body);
+        self.server.mock._count('bytes_sent', len(body));
+        return;
+
+
+    def _read(self):
+        ''' Reads request body, sent with Content-Length or chunked transfer encoding '''
+        if str(self.headers.get('Transfer-Encoding')).lower() != 'chunked':
+            return self.rfile.read(int(self.headers.get('Content-Length', 0)));
+        chunks = [];
+        while True:
+            size = int(self.rfile.readline().split(b';', 1)[0].strip(), 16);
+            if size == 0:
+                while self.rfile.readline() not in [b'\r\n', b'\n', b'']:
+                    pass;
+                return b''.join(chunks);
+            chunks.append(self.rfile.read(size));
+            self.rfile.readline();
+
+
+    def do_POST(self):
+        mock = self.server.mock;
+        body = self._read();
+        mock._count('bytes_received', len(body));
+        mock._delay();
+
+        encoding = str(self.headers.get('Content-Encoding', '')).lower();
+        if encoding in ['gzip', 'deflate']:
+            if not mock.compressed_requests:
+                mock._count('rejected');
+                return self._reply(415, '');
+            mock._count('compressed');
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS);
+
+        if not mock._authorized(self.headers.get('Authorization')):
+            mock._count('unauthorized');
+            return self._reply(401, '', [('WWW-Authenticate', 'Basic realm="' + mock.host + '"')]);
+
+        if self.path.lower().startswith(mock.autodiscover_path):
+            return self._autodiscover(mock, body);
+        if self.path.lower().startswith(mock.ews_path):
+            return self._ews(mock, body);
+        return self._reply(404, '');
+
+
+    def _autodiscover(self, mock, body):
+        ''' Answers urlencoded probe with HTTP 302 Found, and Autodiscover request with settings '''
+        mock._count('Autodiscover');
+        if not body.lstrip().startswith(b'<'):
+            return self._reply(302, '', [('Location', mock.autodiscover_url)]);
+        try:
+            email = etree.fromstring(body).findtext('.//{*}EMailAddress') or '';
+        except Exception:
+            return self._reply(400, '');
+        return self._reply(200, _ews_mock_autodiscover.format(email, mock.host, mock.url),
+                           [('Set-Cookie', 'exchangecookie=' + mock._id('ec') + '; path=/')]);
+
+
+    def _ews(self, mock, body):
+        ''' Answers CreateItem, CreateAttachment and SendItem requests '''
+        try:
+            req = etree.fromstring(body).find('{*}Body')[0];
+        except Exception:
+            return self._reply(400, '');
+        op = etree.QName(req).localname;
+        mock._count(op);
+        if mock.proxy_latency and 'X-BackEndOverrideCookie=' not in str(self.headers.get('Cookie')):
+            # without backend affinity, the request is proxied to the mailbox server
+            time.sleep(mock.proxy_latency);
+
+        if mock._roll(mock.throttle):
+            mock._count('throttled');
+            return self._reply(500, _ews_mock_fault.format(mock.backoff_ms));
+
+        if op == 'CreateItem':
+            items = req.find('{*}Items');
+            n = 0 if items is None else len(items);
+            ids = req.get('MessageDisposition') != 'SendOnly';
+            msgs = [mock._message(op, '<m:Items>' + ('<t:Message><t:ItemId Id="' + mock._id('AAMkA') + '" ChangeKey="' + mock._id('CQAAA') + '"/></t:Message>'
+                                                     if ids else '') + '</m:Items>', '<m:Items/>') for i in range(n)];
+        elif op == 'CreateAttachment':
+            parent = req.find('{*}ParentItemId');
+            attachments = req.find('{*}Attachments');
+            pid = '' if parent is None else parent.get('Id', '');
+            ack = mock._id('CQAAA');
+            out = '<m:Attachments>';
+            for a in ([] if attachments is None else attachments):
+                out += '<t:FileAttachment><t:AttachmentId Id="' + mock._id('AAMkA') + '" RootItemId="' + pid + '" RootItemChangeKey="' + ack + '"/></t:FileAttachment>';
+            out += '</m:Attachments>';
+            msgs = [mock._message(op, out, '<m:Attachments/>')];
+        elif op == 'SendItem':
+            ids = req.find('{*}ItemIds');
+            msgs = [mock._message(op, '', '') for i in range(0 if ids is None else len(ids))];
+        else:
+            return self._reply(400, '');
+
+        out = ''.join(msgs);
+        if mock.padding:
+            out += '<!--' + 'x' * mock.padding + '-->';
+        headers = [];
+        if 'X-BackEndOverrideCookie=' in str(self.headers.get('Cookie')):
+            mock._count('affinity');
+        else:
+            headers.append(('Set-Cookie', 'X-BackEndOverrideCookie=' + mock.host + '~' + mock._id('') + '; path=/EWS; HttpOnly'));
+        return self._reply(200, _ews_mock_envelope.format(op, out), headers);
+
+
+class _EWSMockHTTPServer(ThreadingHTTPServer):
+    '''Represents threading HTTP server of EWSMockServer.'''
+
+    daemon_threads = True;
+    request_queue_size = 128;
+
+
+class EWSMockServer:
+    '''Represents local stand-in for Microsoft Office 365 Autodiscover and EWS endpoints.
+
+    The server speaks the autodiscovery HTTP 302 Found and POST flow, and the
+    CreateItem, CreateAttachment and SendItem operations, with schema-valid
+    responses, so that sessions, emails and attachments can be exercised
+    and benchmarked offline, e.g. by scripts/ews-benchmark.py:
+
+        mock = EWSMockServer(latency=0.01).start();
+        ews = EWSSession(u, p, autodiscover_url=mock.autodiscover_url);
+
+    latency and jitter delay each response, in seconds. throttle is the
+    fraction of EWS requests answered with ErrorServerBusy SOAP fault, and
+    busy the fraction of response messages failing with ErrorServerBusy, both
+    with backoff_ms BackOffMilliseconds. padding adds that many bytes to each
+    EWS response. When password is set, requests without matching basic
+    authorization are answered with HTTP 401. When compression is True,
+    responses are compressed with gzip for requests accepting it. Requests
+    compressed with gzip or deflate are accepted when compressed_requests is
+    True, or else answered with HTTP 415. stats counts requests per
+    operation, response messages, throttled, compressed and rejected
+    requests, and body bytes, as sent over the connection.
+
+    EWS responses set X-BackEndOverrideCookie backend affinity cookie, unless
+    the request carries it, and stats counts such requests as affinity. The
+    other requests are delayed by proxy_latency seconds, as if they were
+    proxied to the mailbox server.
+    '''
+
+    autodiscover_path = '/autodiscover/autodiscover.xml';
+    ews_path = '/ews/exchange.asmx';
+
+    def _authorized(self, auth):
+        ''' Checks basic authorization password, any username is accepted '''
+        if self.password is None:
+            return True;
+        try:
+            return base64.b64decode(str(auth).split(' ', 1)[1].replace('-', '+').replace('_', '/')).decode('utf-8').split(':', 1)[1] == self.password;
+        except Exception:
+            return False;
+
+
+    def _count(self, key, value=1):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + value;
+        return;
+
+
+    def _delay(self):
+        if self.latency or self.jitter:
+            with self.lock:
+                d = self.latency + self.random.uniform(0, self.jitter);
+            time.sleep(d);
+        return;
+
+
+    def _roll(self, p):
+        if not p:
+            return False;
+        with self.lock:
+            return self.random.random() < p;
+
+
+    def _id(self, prefix):
+        with self.lock:
+            self.seq += 1;
+            return prefix + base64.b64encode(self.seq.to_bytes(8, 'big')).decode('ascii');
+
+
+    def _message(self, op, out, failed):
+        ''' Returns response message, which fails with ErrorServerBusy at busy rate '''
+        if self._roll(self.busy):
+            self._count('busy');
+            return _ews_mock_busy.format(op, self.backoff_ms, failed);
+        self._count('messages');
+        return '<m:' + op + 'ResponseMessage ResponseClass="Success"><m:ResponseCode>NoError</m:ResponseCode>' + out + '</m:' + op + 'ResponseMessage>';
+
+
+    def start(self):
+        ''' Starts serving in a daemon thread, returns the server '''
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.httpd.serve_forever, name='EWSMockServer', daemon=True);
+            self.thread.start();
+        return self;
+
+
+    def stop(self):
+        ''' Stops serving and closes the listening socket '''
+        if self.thread is not None:
+            self.httpd.shutdown();
+            self.thread.join();
+            self.thread = None;
+        self.httpd.server_close();
+        return;
+
+
+    def __enter__(self):
+        return self.start();
+
+
+    def __exit__(self, *args):
+        self.stop();
+        return False;
+
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, throttle=0.0, busy=0.0, backoff_ms=100,
+                 padding=0, password=None, seed=None, compression=True, compressed_requests=True, proxy_latency=0.0):
+        ''' Initialize EWS Mock Server, port 0 picks a free port '''
+
+        self.latency = float(latency);
+        self.jitter = float(jitter);
+        self.throttle = float(throttle);
+        self.busy = float(busy);
+        self.backoff_ms = int(backoff_ms);
+        self.padding = int(padding);
+        self.password = password;
+        self.compression = compression;
+        self.compressed_requests = compressed_requests;
+        self.proxy_latency = float(proxy_latency);
+        self.random = random.Random(seed);
+        self.lock = threading.Lock();
+        self.seq = 0;
+        self.stats = {};
+        self.thread = None;
+
+        self.httpd = _EWSMockHTTPServer((host, port), _EWSMockRequestHandler);
+        self.httpd.mock = self;
+
+        self.host = host;
+        base = 'http://' + host + ':' + str(self.httpd.server_address[1]);
+        self.url = base + '/EWS/Exchange.asmx';
+        self.autodiscover_url = base + self.autodiscover_path;
+
+        return;
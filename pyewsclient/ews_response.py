@@ -0,0 +1,201 @@
+#   PyEwsClient - Microsoft Office 365 EWS (Exchange Web Services) Client Library
+#   Copyright (C) 2013 Paul Greenberg <paul@greenberg.pro>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import time;
+from lxml import etree;
+
+
+class EWSResponse:
+    '''Represents the outcome of a single EWS request.
+
+    id and changekey hold the ItemId of the email draft the request created or
+    updated. response_class, response_code and message_text are taken from the
+    first response message, while items holds the outcome of every response
+    message. timings holds the duration of request stages, in seconds, see
+    EWSConnectionPool.request(), and retries the number of times the request
+    was retried. bytes_sent and bytes_received count request and response
+    body bytes across all attempts, as sent over the connection, while
+    request_size and response_size hold the size of the request and the last
+    response body before compression. exception holds the EWSError describing
+    the failure of the request, which submit() raises.
+    '''
+
+    def __repr__(self):
+        return '<EWSResponse stage=' + str(self.stage) + ' status=' + str(self.status) + \
+               ' class=' + str(self.response_class) + ' code=' + str(self.response_code) + \
+               ' id=' + str(self.id) + ' error=' + str(self.error) + '>';
+
+
+    def __init__(self, stage=None):
+        ''' Initialize EWS Response Object '''
+
+        self.stage = stage;
+        self.status = None;
+        self.reason = None;
+        self.error = False;
+        self.exception = None;
+
+        self.id = None;
+        self.changekey = None;
+        self.response_class = None;
+        self.response_code = None;
+        self.message_text = None;
+        self.items = [];
+
+        self.timings = {};
+        self.retries = 0;
+        self.bytes_sent = 0;
+        self.bytes_received = 0;
+        self.request_size = 0;
+        self.response_size = 0;
+
+        return;
+
+
+class EWSResponseDecoder:
+    '''Represents incremental decoder of EWS response body.
+
+    The response body is fed in chunks, as it is read off the connection, into
+    lxml pull parser. Every response message of the expected type is decoded
+    into items as soon as it is complete, and then dropped from the tree, so
+    that memory usage does not depend on the size of the response.
+
+    Parse errors are kept in self.error, instead of being raised, so that the
+    rest of the response is still read off the connection. Structural defects,
+    see EWSValidationPolicy.check(), are kept in self.defect. backoff holds
+    the largest BackOffMilliseconds of the response messages, in seconds, and
+    elapsed the time spent decoding.
+    '''
+
+    NS_SOAP_ENV = "{http://schemas.xmlsoap.org/soap/envelope/}";
+    NS_EWS_MESSAGES = "{http://schemas.microsoft.com/exchange/services/2006/messages}";
+    NS_EWS_TYPES = "{http://schemas.microsoft.com/exchange/services/2006/types}";
+
+    TAG_BODY = NS_SOAP_ENV + 'Body';
+    TAG_RESPONSE_CODE = NS_EWS_MESSAGES + 'ResponseCode';
+    TAG_MESSAGE_TEXT = NS_EWS_MESSAGES + 'MessageText';
+    TAG_ITEMS = NS_EWS_MESSAGES + 'Items';
+    TAG_ATTACHMENTS = NS_EWS_MESSAGES + 'Attachments';
+    TAG_MESSAGE_XML = NS_EWS_MESSAGES + 'MessageXml';
+    TAG_ITEM_ID = NS_EWS_TYPES + 'ItemId';
+    TAG_ATTACHMENT_ID = NS_EWS_TYPES + 'AttachmentId';
+
+    def _ews_message(self, m):
+        ''' Decodes response message, see EWSSession._ews_response_messages() '''
+        item = {'ResponseClass': m.get('ResponseClass'),
+                'ResponseCode': None,
+                'MessageText': None,
+                'Id': None,
+                'ChangeKey': None};
+        if self.attachments:
+            item['AttachmentIds'] = [];
+        for c in m:
+            if c.tag == self.TAG_RESPONSE_CODE:
+                item['ResponseCode'] = c.text or '';
+            elif c.tag == self.TAG_MESSAGE_TEXT:
+                item['MessageText'] = c.text or '';
+            elif c.tag == self.TAG_ITEMS:
+                for x in c:
+                    for n in x:
+                        if n.tag == self.TAG_ITEM_ID and item['Id'] is None:
+                            item['Id'] = n.get('Id');
+                            item['ChangeKey'] = n.get('ChangeKey');
+            elif c.tag == self.TAG_ATTACHMENTS and self.attachments:
+                for x in c:
+                    for n in x:
+                        if n.tag == self.TAG_ATTACHMENT_ID:
+                            item['AttachmentIds'].append(n.get('Id'));
+                            item['Id'] = n.get('RootItemId');
+                            item['ChangeKey'] = n.get('RootItemChangeKey');
+            elif c.tag == self.TAG_MESSAGE_XML:
+                for v in c:
+                    if v.get('Name') == 'BackOffMilliseconds' and (v.text or '').strip().isdigit():
+                        self.backoff = max(self.backoff or 0, int(v.text) / 1000.0);
+        return item;
+
+
+    def _ews_drain(self):
+        ''' Decodes complete response messages, and drops them from the tree '''
+        for (event, elem) in self.parser.read_events():
+            if elem.tag == self.TAG_BODY:
+                self.body = True;
+                continue;
+            item = self._ews_message(elem);
+            self.items.append(item);
+            if self.policy is not None and self.defect is None:
+                self.defect = self.policy.check_item(item, self.tag, self.operation);
+            elem.clear();
+            while elem.getprevious() is not None:
+                del elem.getparent()[0];
+        return;
+
+
+    def feed(self, data):
+        ''' Decodes a chunk of response body '''
+        self.size += len(data);
+        if self.error is not None:
+            return;
+        ts = time.monotonic();
+        try:
+            self.parser.feed(data);
+            self._ews_drain();
+        except Exception as err:
+            self.error = str(err);
+        self.elapsed += time.monotonic() - ts;
+        return;
+
+
+    def close(self):
+        ''' Completes decoding, returns the outcomes of response messages '''
+        if self.error is not None or self.closed:
+            return self.items;
+        self.closed = True;
+        ts = time.monotonic();
+        try:
+            root = self.parser.close();
+            self._ews_drain();
+            if root.tag != self.NS_SOAP_ENV + 'Envelope':
+                self.defect = 'root element is ' + str(root.tag) + ', not SOAP Envelope';
+            elif not self.body:
+                self.defect = 'SOAP Body is missing';
+            elif not self.items:
+                self.defect = self.tag + ' is missing';
+        except Exception as err:
+            self.error = str(err);
+        self.elapsed += time.monotonic() - ts;
+        return self.items;
+
+
+    def __init__(self, tag, operation=None, policy=None):
+        ''' Initialize EWS Response Decoder for response messages of a given type, e.g. CreateItemResponseMessage '''
+
+        self.tag = tag;
+        self.operation = operation;
+        self.policy = policy;
+        self.attachments = tag == 'CreateAttachmentResponseMessage';
+        self.parser = etree.XMLPullParser(events=('end',), tag=[self.NS_EWS_MESSAGES + tag, self.NS_SOAP_ENV + 'Body'],
+                                          resolve_entities=False);
+
+        self.items = [];
+        self.body = False;
+        self.closed = False;
+        self.error = None;
+        self.defect = None;
+        self.backoff = None;
+        self.size = 0;
+        self.elapsed = 0.0;
+
+        return;
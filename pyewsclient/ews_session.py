@@ -16,19 +16,36 @@
 
 import os;
 import sys;
+import logging;
 import datetime;
 import traceback;
-import requests;
-from requests.auth import HTTPBasicAuth;
 from lxml import etree;
-import pprint;
-import re;
 
+import time;
 import base64;
-import http.client, urllib.parse;
+import threading;
+import urllib.parse;
 from urllib.parse import urlparse;
 
-from pyewsclient import EWSXmlSchemaValidator;
+from pyewsclient.ews_helper import EWSXmlSchemaValidator, EWSAutodiscoverCache, EWSValidationPolicy, EWSLogBuffer, _ews_log, _ews_log_format, _ews_last_error;
+from pyewsclient.ews_connection import EWSConnectionPool, EWSCompressionPolicy, EWSCookieJar, _ews_body_length;
+from pyewsclient.ews_email_batch import EWSEmailBatch;
+from pyewsclient.ews_response import EWSResponse, EWSResponseDecoder;
+from pyewsclient.ews_throttle import EWSThrottle;
+from pyewsclient.ews_exceptions import EWSError, EWSInputError, EWSAutodiscoverError, EWSTransportError, EWSAuthError, \
+                                       EWSThrottledError, EWSSchemaError, EWSResponseError;
+
+_ews_logger = logging.getLogger(__name__);
+
+_ews_xpath_ns = {'soap': 'http://schemas.xmlsoap.org/soap/envelope/',
+                 'm': 'http://schemas.microsoft.com/exchange/services/2006/messages',
+                 't': 'http://schemas.microsoft.com/exchange/services/2006/types'};
+_ews_xpath_response_messages = etree.XPath('/soap:Envelope/soap:Body/*/m:ResponseMessages/*', namespaces=_ews_xpath_ns);
+_ews_xpath_response_codes = etree.XPath('/soap:Envelope/soap:Body/*/m:ResponseMessages/*/m:ResponseCode', namespaces=_ews_xpath_ns);
+_ews_xpath_message_texts = etree.XPath('/soap:Envelope/soap:Body/*/m:ResponseMessages/*/m:MessageText', namespaces=_ews_xpath_ns);
+_ews_xpath_item_ids = etree.XPath('/soap:Envelope/soap:Body/*/m:ResponseMessages/*/m:Items/*/t:ItemId', namespaces=_ews_xpath_ns);
+_ews_xpath_attachment_ids = etree.XPath('/soap:Envelope/soap:Body/*/m:ResponseMessages/*/m:Attachments/*/t:AttachmentId',
+                                        namespaces=_ews_xpath_ns);
 
 #sys.path.append(os.path.join('/'.join(os.path.abspath(__file__).split('/')[:-2])));
 #from pyewsclient.ews_helper import EWSHelper;
@@ -36,29 +53,19 @@ from pyewsclient import EWSXmlSchemaValidator;
 class EWSSession:
     '''Represents Microsoft Office 365 EWS Session.'''
 
+    response_messages = {'save_only': 'CreateItemResponseMessage', 'send': 'CreateItemResponseMessage',
+                         'send_and_save': 'SendItemResponseMessage', 'attachment': 'CreateAttachmentResponseMessage'};
+    autodiscover_url = os.environ.get('PYEWSCLIENT_AUTODISCOVER_URL') or 'https://autodiscover-s.outlook.com/autodiscover/autodiscover.xml';
+
 
     def _exit(self, lvl=0):
-        if self.log:
-            self.show('log', 'error');
-        if lvl == 1:
-            exit(1);
-        else:
-            exit(0);
+        ''' Raises EWSError with the last error, instead of exiting the process '''
+        raise EWSError(self._ews_last_error() or type(self).__name__ + ' failed');
 
 
     def _log(self, msg='TEST', lvl='INFO'):
         ''' Logging '''
-        if self.verbose < 1 and lvl == 'INFO':
-            return;
-        lvls={'DEBUG': 5, 'CRIT': 4, 'ERROR': 3, 'WARN': 2, 'INFO': 1};
-        cls = str(type(self).__name__);
-        func = str(sys._getframe(1).f_code.co_name);
-        ts = str(datetime.datetime.now());
-        for xmsg in msg.split('\n'):
-            if self.error is not True and lvls[lvl] in [3, 4]:
-                self.error = True;
-            self._log_id += 1;
-            self.log[self._log_id] = {'ts': ts, 'function': __file__.split('/')[-1] + '->' + cls + '.' + func + '()', 'level': lvl, 'text': xmsg}
+        _ews_log(self, _ews_logger, msg, lvl);
         return;
 
 
@@ -66,13 +73,10 @@ class EWSSession:
         ''' Display information '''
         if t == 'log':
             ''' Display log buffer '''
-            for x in self.log:
-                if p == 'error' and self.log[x]['level'] not in ['CRIT', 'ERROR']:
+            for entry in self.log.snapshot():
+                if p == 'error' and entry['level'] not in ['CRIT', 'ERROR']:
                     continue;
-                print("{0:26s} | {1:s} | {2:s} | {3:s}".format(self.log[x]['ts'],
-                                                               self.log[x]['function'],
-                                                               self.log[x]['level'],
-                                                               self.log[x]['text']));
+                print(_ews_log_format(self, entry));
         else:
             pass;
         return;
@@ -84,21 +88,25 @@ class EWSSession:
         return;
 
 
-    def _ews_add_cookies(self, c):
-        cs = c.split(';');
-        if len(cs) > 1:
-            m = re.match('([A-Za-z0-9-]+)\=(.*)', cs[0]);
-            if m:
-                self.cookies[m.group(1)] = m.group(2);
+    def _ews_last_error(self):
+        ''' Returns the text of the last CRIT or ERROR log entry '''
+        return _ews_last_error(self);
+
+
+    def _ews_add_cookies(self, url, headers):
+        ''' Stores cookies of response headers received from URL, see EWSCookieJar '''
+        if isinstance(headers, list):
+            self.cookies.extract(url, headers);
         return;
 
 
-    def _ews_inject_cookies(self, h):
-        if len(self.cookies) > 0:
-            cs = [];
-            for c in self.cookies:
-                cs.append(c + '=' + self.cookies[c]);
-            h['Cookie'] = '; '.join(cs);
+    def _ews_inject_cookies(self, h, url):
+        ''' Sets Cookie request header for URL, see EWSCookieJar '''
+        c = self.cookies.header(url);
+        if c is not None:
+            h['Cookie'] = c;
+        else:
+            h.pop('Cookie', None);
         return h;
 
 
@@ -114,12 +122,16 @@ class EWSSession:
         return None;
 
 
-    def _ews_remove_xml_header(self, s):
-        s = s.replace('<?xml version="1.0" encoding="utf-8"?>\r\n', '');
-        s = s.replace('<?xml version="1.0" encoding="utf-8"?>', '');
-        s = s.replace('<Response xmlns="http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006a">', 
-                      '<Response xmlns="http://schemas.microsoft.com/exchange/autodiscover/responseschema/2006">');
-        return(s);
+    def _ews_autodiscover_response_tree(self, body):
+        ''' Parses autodiscovery response bytes, returns its root element
+
+        The elements of Outlook response schema (2006a) are moved to the
+        namespace of autodiscover.response.xsd (2006), in the parsed tree.
+        '''
+        t = etree.fromstring(body);
+        for e in t.iter('{http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006a}*'):
+            e.tag = '{http://schemas.microsoft.com/exchange/autodiscover/responseschema/2006}' + etree.QName(e).localname;
+        return t;
 
 
     def _ews_autod_request_builder(self):
@@ -132,13 +144,17 @@ class EWSSession:
         SDIS_REQ_EMAIL.text = self.username;
         SDIS_REQ_ARS = etree.SubElement(SDIS_REQ, 'AcceptableResponseSchema');
         SDIS_REQ_ARS.text = 'http://schemas.microsoft.com/exchange/autodiscover/outlook/responseschema/2006a';
-        reqb = b'<?xml version="1.0" encoding="utf-8"?>\n' + etree.tostring(SDIS, pretty_print=True);
-        req = reqb.decode("utf-8");
-        return req;
+        return etree.tostring(SDIS, xml_declaration=True, encoding='utf-8', pretty_print=True);
 
 
-    def _ews_send_and_save_request_builder(self):
-        ''' SOAP Request Builder '''
+    def _ews_send_and_save_request_builder(self, ids=None):
+        ''' SOAP Request Builder
+
+        Sends a list of (Id, ChangeKey) email drafts, by default the last one.
+        '''
+
+        if ids is None:
+            ids = [(self.id, self.changekey)];
 
         NS_SOAP_ENV = "{http://schemas.xmlsoap.org/soap/envelope/}";
         NS_SOAP_ENV_URI = "http://schemas.xmlsoap.org/soap/envelope/";
@@ -166,129 +182,164 @@ class EWSSession:
         EMAIL_B_SI.attrib['SaveItemToFolder'] = 'true';
 
         EMAIL_B_SI_IDS = etree.SubElement(EMAIL_B_SI, NS_EWS_MESSAGES + 'ItemIds');
-        EMAIL_B_SI_ID = etree.SubElement(EMAIL_B_SI_IDS, NS_EWS_TYPES + 'ItemId');
-        EMAIL_B_SI_ID.attrib['Id'] = self.id;
-        EMAIL_B_SI_ID.attrib['ChangeKey'] = self.changekey;
+        for i in ids:
+            EMAIL_B_SI_ID = etree.SubElement(EMAIL_B_SI_IDS, NS_EWS_TYPES + 'ItemId');
+            EMAIL_B_SI_ID.attrib['Id'] = i[0];
+            EMAIL_B_SI_ID.attrib['ChangeKey'] = i[1];
 
         EMAIL_B_SI_FI = etree.SubElement(EMAIL_B_SI, NS_EWS_MESSAGES + 'SavedItemFolderId');
         EMAIL_B_SI_DF = etree.SubElement(EMAIL_B_SI_FI, NS_EWS_TYPES + 'DistinguishedFolderId');
         EMAIL_B_SI_DF.attrib['Id'] = 'sentitems';
 
-        reqb = b'<?xml version="1.0" encoding="utf-8"?>\n' + etree.tostring(EMAIL, pretty_print=True);
-        req = reqb.decode("utf-8");
-        return req;
+        return etree.tostring(EMAIL, xml_declaration=True, encoding='utf-8', pretty_print=True);
+
+
+    def _ews_response_messages(self, t, tag):
+        ''' Returns outcomes of every response message of a given type, in document order
+
+        Each field is collected for all response messages with a single
+        precompiled XPath expression, and matched with its response message
+        by parent element. Attachment response messages carry the ids of the
+        attachments in AttachmentIds, and the Id and ChangeKey of the item
+        they were attached to, after the last attachment, in Id and ChangeKey.
+        '''
+
+        NS_EWS_MESSAGES = "{http://schemas.microsoft.com/exchange/services/2006/messages}";
+
+        items = [];
+        index = {};
+        for j in _ews_xpath_response_messages(t):
+            if j.tag != NS_EWS_MESSAGES + tag:
+                continue;
+            item = {'ResponseClass': j.get('ResponseClass'),
+                    'ResponseCode': None,
+                    'MessageText': None,
+                    'Id': None,
+                    'ChangeKey': None};
+            if tag == 'CreateAttachmentResponseMessage':
+                item['AttachmentIds'] = [];
+            index[j] = item;
+            items.append(item);
+        if not items:
+            return items;
+
+        for (xpath, k) in [(_ews_xpath_response_codes, 'ResponseCode'), (_ews_xpath_message_texts, 'MessageText')]:
+            for n in xpath(t):
+                item = index.get(n.getparent());
+                if item is not None:
+                    item[k] = n.text or '';
+
+        if tag == 'CreateAttachmentResponseMessage':
+            for n in _ews_xpath_attachment_ids(t):
+                item = index.get(n.getparent().getparent().getparent());
+                if item is not None:
+                    item['AttachmentIds'].append(n.get('Id'));
+                    item['Id'] = n.get('RootItemId');
+                    item['ChangeKey'] = n.get('RootItemChangeKey');
+            return items;
+
+        for n in _ews_xpath_item_ids(t):
+            item = index.get(n.getparent().getparent().getparent());
+            if item is not None and item['Id'] is None:
+                item['Id'] = n.get('Id');
+                item['ChangeKey'] = n.get('ChangeKey');
+        return items;
+
+
+    def _ews_soap_fault(self, body):
+        ''' Returns response code, fault string and BackOffMilliseconds, in seconds, of SOAP fault response, or None '''
+
+        NS_SOAP_ENV = "{http://schemas.xmlsoap.org/soap/envelope/}";
+
+        try:
+            t = etree.fromstring(body);
+        except Exception:
+            return None;
+
+        f = t.find('.//' + NS_SOAP_ENV + 'Fault');
+        if f is None:
+            return None;
+
+        code = t.xpath('string(//*[local-name()="ResponseCode"])') or f.findtext('faultcode');
+        backoff = t.xpath('string(//*[local-name()="Value"][@Name="BackOffMilliseconds"])').strip();
+        return (code, f.findtext('faultstring'), int(backoff) / 1000.0 if backoff.isdigit() else None);
+
 
+    def _ews_xml_response_parser(self, stage, url, status, reason, body, r=None):
+        ''' EWS XML Response Parsing, returns EWS Response Object
 
-    def _ews_xml_response_parser(self, stage, url, status, reason, body):
-        ''' EWS XML Response Parsing '''
+        Response messages are located with precompiled XPath expressions, and
+        only the elements the client relies upon are read.
+        '''
+        if r is None:
+            r = EWSResponse(stage);
         if stage is None:
             stage = 'non-draft';
 
-        body = self._ews_remove_xml_header(body);
-        t = etree.fromstring(body);
-        body = etree.tostring(t, pretty_print=True).decode("utf-8");
+        if etree.iselement(body):
+            t = body;
+        else:
+            if not isinstance(body, bytes):
+                body = body.encode('utf-8');
+            t = etree.fromstring(body);
 
         if self.verbose >= 4:
-            self._log(body, 'INFO');
-
-        NS_EWS_MESSAGES = "{http://schemas.microsoft.com/exchange/services/2006/messages}";
-        NS_EWS_MESSAGES_URI = "http://schemas.microsoft.com/exchange/services/2006/messages";
-        NS_EWS_TYPES = "{http://schemas.microsoft.com/exchange/services/2006/types}";
-        NS_EWS_TYPES_URI = 'ewhttp://schemas.microsoft.com/exchange/services/2006/types';
-
-        NSD = {'m':NS_EWS_MESSAGES_URI, 
-               't':NS_EWS_TYPES_URI};
-        NSDR = {NS_EWS_MESSAGES:'m',
-                   NS_EWS_TYPES:'t'};
+            self._log(etree.tostring(t, pretty_print=True).decode("utf-8"), 'INFO');
 
         try:
-            mResponseMessages = t.xpath('//m:ResponseMessages', namespaces = NSD);
-            hc = 0;
-            for i in mResponseMessages:
-                h = str(hc);
-                if self.verbose >= 4:
-                    self._log('mResponseMessages[' + h + ']           ' + str(i.tag) + ' / ' + str(i.text))
-                for j in list(i):
-                    h = str(hc);
-                    if self.verbose >= 4:
-                        self._log('mResponseMessages[' + h + '] LVL 1 (j) ' + str(j.tag) + ' / ' + str(j.text));
-                    for k in list(j):
-                        if self.verbose >= 4:
-                            self._log('mResponseMessages[' + h + '] LVL 2 (k) -- ' + str(k.tag) + ' / ' + str(k.text));
-
-                        if stage == 'send_and_save' and j.tag == NS_EWS_MESSAGES + 'SendItemResponseMessage':
-                            if 'ResponseClass' in j.attrib:
-                                if j.attrib['ResponseClass'] == 'Success':
-                                    if k.tag == NS_EWS_MESSAGES + 'ResponseCode':
-                                        self._log('email was sent successfully. ' + str(k.text));
-
-                        for m in list(k):
-                            if self.verbose >= 4:
-                                self._log('mResponseMessages[' + h + '] LVL 3 (m) ---- ' + str(m.tag) + ' / ' + str(m.text));
-                            for n in list(m):
-                                if self.verbose >= 4:
-                                    self._log('mResponseMessages[' + h + '] LVL 4 (n) ------ ' + str(n.tag) + ' / ' + str(n.text));
-                                
-                                if stage == 'save_only' and j.tag == NS_EWS_MESSAGES + 'CreateItemResponseMessage':
-                                    if 'ResponseClass' in j.attrib:
-                                        if j.attrib['ResponseClass'] == 'Success':
-                                            if k.tag == NS_EWS_MESSAGES + 'Items':
-                                                if m.tag == NS_EWS_TYPES + 'Message' and n.tag == NS_EWS_TYPES + 'ItemId' and 'ChangeKey' in n.attrib and 'Id' in n.attrib:
-                                                    elmN = str(n.tag).replace(NS_EWS_TYPES, NSDR[NS_EWS_TYPES] + ':');
-                                                    if self.verbose >= 4:
-                                                        self._log('mResponseMessages[' + h + '] LVL 4 (n) ------ ' + elmN + ' has Id (' + n.attrib['Id'] + ') and ChangeKey (' + n.attrib['ChangeKey'] + ') attributes.');
-                                                    self.id = str(n.attrib['Id']);
-                                                    self.changekey = str(n.attrib['ChangeKey']);
-
-                                if stage == 'attachment' and j.tag == NS_EWS_MESSAGES + 'CreateAttachmentResponseMessage':
-                                    if 'ResponseClass' in j.attrib:
-                                        if j.attrib['ResponseClass'] == 'Success':
-                                            if k.tag == NS_EWS_MESSAGES + 'Attachments':
-                                                if m.tag == NS_EWS_TYPES + 'FileAttachment' and n.tag == NS_EWS_TYPES + 'AttachmentId' and 'Id' in n.attrib:
-                                                    elmN = str(n.tag).replace(NS_EWS_TYPES, NSDR[NS_EWS_TYPES] + ':');
-                                                    if self.verbose >= 4:
-                                                        self._log('mResponseMessages[' + h + '] LVL 4 (n) ------ ' + elmN + ' has Id (' + n.attrib['Id'] + ') attribute.');
-                                                    if 'RootItemId' in n.attrib:
-                                                        if n.attrib['RootItemId'] != self.id:
-                                                            self.id = str(n.attrib['RootItemId']);  
-                                                    if 'RootItemChangeKey' in n.attrib:
-                                                        if n.attrib['RootItemChangeKey'] != self.changekey:
-                                                            self.changekey = str(n.attrib['RootItemChangeKey']);  
-
-                    hc += 1;
-                hc += 1;
+            tag = self.response_messages.get(stage);
+            if tag is not None:
+                r.items = self._ews_response_messages(t, tag);
         except Exception as err:
-            self._log(str(err), 'ERROR');
             self._log(str(traceback.format_exc()), 'ERROR');
-            return;
-                                             
-        return;
+            self._ews_submit_fail(r, EWSResponseError, 'failed to parse ews response: ' + str(err));
+            return r;
 
+        return self._ews_response_outcome(stage, r);
 
-    def _ews_autodiscover(self):
-        ''' EWS Autodiscovery 
-        URL: autodiscover.outlook.com
 
-        The Autodiscover service may respond with one of two redirection responses: 
-         * an HTTP 302 redirect, or
-         * a SOAP redirection response. 
-        If the response from the Exchange server is an HTTP 302 redirect, 
-        the client application should validate that the redirection address 
-        is acceptable and then follow the redirection response.
+    def _ews_response_outcome(self, stage, r):
+        ''' Derives the outcome of EWS request from its response messages, returns EWS Response Object '''
 
-        Microsoft Remote Connectivity Analyzer
-          Microsoft Office Outlook Connectivity Tests 
-            Outlook Autodiscover 
-              https://testconnectivity.microsoft.com/
+        tag = self.response_messages.get(stage);
+        try:
+            if len(r.items) > 0:
+                r.response_class = r.items[0]['ResponseClass'];
+                r.response_code = r.items[0]['ResponseCode'];
+                r.message_text = r.items[0]['MessageText'];
+            retry_codes = self.throttle.throttle_codes + self.throttle.transient_codes;
+            for item in r.items:
+                if item['ResponseClass'] == 'Error' and item['ResponseCode'] in retry_codes:
+                    # the message may be resubmitted, see EWSThrottle
+                    self._log('EWS response message error: ' + str(item['ResponseCode']) + ': ' + str(item['MessageText']), 'WARN');
+                elif item['ResponseClass'] == 'Error':
+                    self._log('EWS response message error: ' + str(item['ResponseCode']) + ': ' + str(item['MessageText']), 'ERROR');
+                elif item['ResponseClass'] == 'Warning':
+                    self._log('EWS response message warning: ' + str(item['ResponseCode']) + ': ' + str(item['MessageText']), 'WARN');
+                elif stage in ['send', 'send_and_save']:
+                    self._log('email was sent successfully. ' + str(item['ResponseCode']));
+                elif stage in ['save_only', 'attachment'] and item['Id'] is not None and item['ChangeKey'] is not None:
+                    if self.verbose >= 4:
+                        self._log(str(tag) + ' has Id (' + item['Id'] + ') and ChangeKey (' + item['ChangeKey'] + ')');
+                    r.id = str(item['Id']);
+                    r.changekey = str(item['ChangeKey']);
+            if len(r.items) > 0 and len([x for x in r.items if x['ResponseClass'] == 'Error']) == len(r.items):
+                msg = 'EWS response messages failed: ' + str(r.response_code) + ': ' + str(r.message_text);
+                if len([x for x in r.items if x['ResponseCode'] in self.throttle.throttle_codes]) == len(r.items):
+                    r.exception = EWSThrottledError(msg, r, r.response_code);
+                else:
+                    r.exception = EWSResponseError(msg, r, r.response_code);
+                r.error = True;
+        except Exception as err:
+            self._log(str(traceback.format_exc()), 'ERROR');
+            self._ews_submit_fail(r, EWSResponseError, 'failed to parse ews response: ' + str(err));
+            return r;
 
-        [MS-OXDSCLI]: Autodiscover Publishing and Lookup Protocol
-          http://download.microsoft.com/download/5/D/D/5DD33FDF-91F5-496D-9884-0A0B0EE698BB/%5BMS-OXDSCLI%5D.pdf
+        return r;
 
-        Importantly, HTTP Location header in HTTP 302 Redirect points to EWS Endpoint!
-        '''
 
-        if self.verbose >= 4:
-            self._log( 'Autodiscovery On', 'INFO');
+    def _ews_autodiscover_request_builder(self):
+        ''' Prepares autodiscovery requests, returns URL, POST parameters, SOAP request and headers '''
 
         autod_req = self._ews_autod_request_builder();
 
@@ -299,37 +350,55 @@ class EWSSession:
 
         if exsv.valid == False:
             self._log('failed ews xml schema validation for autodiscovery', 'ERROR');
-            self._exit(1);
+            raise EWSSchemaError('failed ews xml schema validation for autodiscovery');
 
-        autod_url = 'https://autodiscover-s.outlook.com/autodiscover/autodiscover.xml';
-        autod_params = urllib.parse.urlencode({'test1': 123456, '@test2': 'test2', '@test3': 'test3'});
+        autod_url = self.autodiscover_url;
+        autod_params = urllib.parse.urlencode({'test1': 123456, '@test2': 'test2', '@test3': 'test3'}).encode('ascii');
         autod_headers = {'User-Agent': str(self.user_agent),
                          'X-MapiHttpCapability': '1',
                          'Authorization': self.basic_auth,
                          'Content-Type': 'text/xml; charset=utf-8'};
-        autod_headers = self._ews_inject_cookies(autod_headers);
+        autod_headers = self._ews_inject_cookies(autod_headers, autod_url);
 
         if self.verbose > 4:
             self._log('HTTP REQUEST URL: ' + str(autod_url), 'INFO');
 
-        try:
-            if self._ews_urlsplit('prefix', autod_url) == 'https':
-                autod_conn = http.client.HTTPSConnection(self._ews_urlsplit('host', autod_url));
-            elif self._ews_urlsplit('prefix', autod_url) == 'http':
-                autod_conn = http.client.HTTPConnection(self._ews_urlsplit('host', autod_url));
-            else:
-                return
-            if self.verbose >= 5:
-                autod_conn.set_debuglevel(self.verbose);
-            autod_conn.request("POST", self._ews_urlsplit('path', autod_url), autod_params, autod_headers);
-            autod_resp = autod_conn.getresponse();
-            autod_resp_headers = autod_resp.getheaders();
-            autod_resp_body = self._ews_remove_xml_header(autod_resp.read().decode("utf-8"));
-            autod_conn.close();
-        except Exception as err:
-            self._log(str(err), 'CRIT');
-            self._log(str(traceback.format_exc()), 'CRIT');
-            return;
+        return (autod_url, autod_params, autod_req, autod_headers);
+
+
+    def _ews_autodiscover_authorized(self, autod_url, autod_resp):
+        ''' Checks autodiscovery response for HTTP 401 or 403, returns False when credentials were rejected '''
+
+        if autod_resp.status not in [401, 403]:
+            return True;
+
+        self.autodiscover_status = autod_resp.status;
+        self._log(autod_url + ' responds with HTTP ' + str(autod_resp.status) + ' ' + str(autod_resp.reason) + \
+                  ', check username and password', 'ERROR');
+        return False;
+
+
+    def _ews_autodiscover_failed(self):
+        ''' Logs autodiscovery failure along with its cause '''
+        cause = self._ews_last_error();
+        if cause is None or not cause.startswith('EWS Endpoint Autodiscovery Failed'):
+            self._log('EWS Endpoint Autodiscovery Failed' + ('' if cause is None else ': ' + cause), 'ERROR');
+        return;
+
+
+    def _ews_autodiscover_error(self):
+        ''' Returns exception type and code for autodiscovery failure, i.e. EWSAuthError and HTTP status when the
+        credentials were rejected, or else EWSAutodiscoverError
+        '''
+        if self.autodiscover_status in [401, 403]:
+            return (EWSAuthError, self.autodiscover_status);
+        return (EWSAutodiscoverError, self.autodiscover_status);
+
+
+    def _ews_autodiscover_redirect_handler(self, autod_url, autod_resp):
+        ''' Handles autodiscovery HTTP 302 redirect, returns candidate EWS endpoint URL '''
+
+        autod_resp_headers = autod_resp.getheaders();
 
         if self.verbose >= 4:
             self._log('HTTP RESPONSE STATUS/REASON: ' + str(autod_resp.status) + '/' + str(autod_resp.reason), 'INFO');
@@ -338,9 +407,13 @@ class EWSSession:
             for h in autod_resp_headers:
                 if self.verbose >= 4:
                     self._log('HTTP RESPONSE HEADER: ' + str(h[0]) + ':   ' + str(h[1]), 'INFO');
+            self._ews_add_cookies(autod_url, autod_resp_headers);
         else:
             self._log(autod_url + ' does not respond with headers', 'CRIT');
-            return;
+            return None;
+
+        if not self._ews_autodiscover_authorized(autod_url, autod_resp):
+            return None;
  
         if str(autod_resp.status) == '302' and str(autod_resp.reason) == 'Found':
             if autod_resp.getheader('Location') is not None:
@@ -349,35 +422,18 @@ class EWSSession:
                     self._log('Candidate EWS Endpoint: ' + self._ews_urlsplit('host', autod_url), 'INFO');
             else:
                 self._log(autod_url + ' does not respond with Location header redirect', 'CRIT');
-                return;
+                return None;
         else:
             self._log(autod_url + ' does not respond with HTTP 302 Found', 'CRIT');
-            return;
+            return None;
 
+        return autod_url;
 
-        if self.verbose >= 4:
-            self._log('HTTP REQUEST URL: ' + str(autod_url), 'INFO');
-            self._log('HTTP REQUEST BODY:\n' + str(autod_req), 'INFO');
 
-        try:
-            if self._ews_urlsplit('prefix', autod_url) == 'https':
-                autod_conn = http.client.HTTPSConnection(self._ews_urlsplit('host', autod_url));
-            elif self._ews_urlsplit('prefix', autod_url) == 'http':
-                autod_conn = http.client.HTTPConnection(self._ews_urlsplit('host', autod_url));
-            else:
-                return;
-            if self.verbose >= 5:
-                autod_conn.set_debuglevel(self.verbose);
-            autod_headers = self._ews_inject_cookies(autod_headers);
-            autod_conn.request("POST", self._ews_urlsplit('path', autod_url), autod_req, autod_headers);
-            autod_resp = autod_conn.getresponse();
-            autod_resp_headers = autod_resp.getheaders();
-            autod_resp_body = self._ews_remove_xml_header(autod_resp.read().decode("utf-8"));
-            autod_conn.close();
-        except Exception as err:
-            self._log(str(err), 'CRIT');
-            self._log(str(traceback.format_exc()), 'CRIT');
-            return;
+    def _ews_autodiscover_response_handler(self, autod_url, autod_resp, autod_resp_body):
+        ''' Handles autodiscovery response, sets EWS endpoint server '''
+
+        autod_resp_headers = autod_resp.getheaders();
 
         if self.verbose >= 4:
             self._log('HTTP RESPONSE STATUS/REASON: ' + str(autod_resp.status) + '/' + str(autod_resp.reason), 'INFO');
@@ -386,23 +442,30 @@ class EWSSession:
             for h in autod_resp_headers:
                 if self.verbose >=4 :
                     self._log('HTTP RESPONSE HEADER: ' + str(h[0]) + ':   ' + str(h[1]), 'INFO');
-                if str(h[0]) == 'Set-Cookie':
-                    self._ews_add_cookies(str(h[1]));
+            self._ews_add_cookies(autod_url, autod_resp_headers);
         else:
             self._log(autod_url + ' does not respond with headers', 'CRIT');
             return;
 
-        if isinstance(autod_resp_body, str):
+        if not self._ews_autodiscover_authorized(autod_url, autod_resp):
+            return;
+
+        if isinstance(autod_resp_body, bytes):
             if len(autod_resp_body) > 20:
                 if self.verbose >= 4:
-                    self._log('HTTP RESPONSE BODY:\n' + autod_resp_body, 'INFO');
+                    self._log('HTTP RESPONSE BODY:\n' + autod_resp_body.decode('utf-8', 'replace'), 'INFO');
         else:
             self._log(autod_url + ' does not respond with headers', 'CRIT');
             return;
 
-        autod_headers = self._ews_inject_cookies(autod_headers);
+        try:
+            autod_resp_tree = self._ews_autodiscover_response_tree(autod_resp_body);
+        except Exception as err:
+            self._log('failed to parse autodiscovery response: ' + str(err), 'ERROR');
+            self.server = None;
+            return;
 
-        exsv = EWSXmlSchemaValidator(autod_resp_body, 'autodiscover.response.xsd');
+        exsv = EWSXmlSchemaValidator(autod_resp_tree, 'autodiscover.response.xsd');
 
         for i in exsv.logs:
             self._log(i[0], i[1]);
@@ -410,53 +473,315 @@ class EWSSession:
         if exsv.valid == True:
             # EwsUrl point to 'https://outlook.office365.com/EWS/Exchange.asmx'
             # However, it should point to 'https://podXXXXX.outlook.com/EWS/Exchange.asmx'
-            self.server = 'https://' + self._ews_urlsplit('host', autod_url) + '/EWS/Exchange.asmx';
+            o = urlparse(autod_url);
+            self.server = str(o.scheme or 'https') + '://' + str(o.netloc) + '/EWS/Exchange.asmx';
             return;
         else:
             self.server = None;
             return;
 
 
-    def submit(self, ews_req=None, ews_stage=None):
+    def _ews_autodiscover_cache_get(self):
+        ''' Restores EWS endpoint server and cookies from autodiscover cache, returns True on hit '''
 
-        if (ews_stage == 'attachment' or ews_stage == 'send_and_save') and (self.id is None or self.changekey is None):
-            self._log('Office 365 email draft token is missing', 'ERROR');
+        if not self.autodiscover_cache:
+            return False;
+
+        entry = EWSAutodiscoverCache.get(self.username, self.autodiscover_url);
+        if entry is None:
+            return False;
+
+        with self.lock:
+            self.server = entry[0];
+            self.cookies.load(entry[1], self.server);
+            self.autodiscovered = True;
+
+        if self.verbose >= 4:
+            self._log('Autodiscovery Cache Hit: ' + self._ews_urlsplit('host', self.server), 'INFO');
+        return True;
+
+
+    def _ews_autodiscover_cache_set(self):
+        ''' Stores discovered EWS endpoint server and cookies in autodiscover cache '''
+
+        if self.server is None:
             return;
 
-        if ews_stage == 'send_and_save':
+        self.autodiscovered = True;
+        if not self.autodiscover_cache:
+            return;
+
+        EWSAutodiscoverCache.set(self.username, self.server, self.cookies.export(), self.autodiscover_url);
+        return;
+
+
+    def _ews_autodiscover_cache_invalidate(self):
+        ''' Drops autodiscover cache entry after the EWS endpoint failed '''
+
+        if not self.autodiscover_cache or not self.autodiscovered:
+            return;
+
+        EWSAutodiscoverCache.invalidate(self.username, self.server, self.autodiscover_url);
+        if self.verbose >= 4:
+            self._log('Autodiscovery Cache Entry Invalidated: ' + self._ews_urlsplit('host', self.server), 'INFO');
+        return;
+
+
+    def _ews_autodiscover(self):
+        ''' EWS Autodiscovery 
+        URL: autodiscover.outlook.com
+
+        The Autodiscover service may respond with one of two redirection responses: 
+         * an HTTP 302 redirect, or
+         * a SOAP redirection response. 
+        If the response from the Exchange server is an HTTP 302 redirect, 
+        the client application should validate that the redirection address 
+        is acceptable and then follow the redirection response.
+
+        Microsoft Remote Connectivity Analyzer
+          Microsoft Office Outlook Connectivity Tests 
+            Outlook Autodiscover 
+              https://testconnectivity.microsoft.com/
+
+        [MS-OXDSCLI]: Autodiscover Publishing and Lookup Protocol
+          http://download.microsoft.com/download/5/D/D/5DD33FDF-91F5-496D-9884-0A0B0EE698BB/%5BMS-OXDSCLI%5D.pdf
+
+        Importantly, HTTP Location header in HTTP 302 Redirect points to EWS Endpoint!
+
+        The outcome is kept in EWSAutodiscoverCache, unless the session was
+        created with autodiscover_cache=False.
+        '''
+
+        if self._ews_autodiscover_cache_get():
+            return;
+
+        self.autodiscover_status = None;
+        if self.verbose >= 4:
+            self._log( 'Autodiscovery On', 'INFO');
+
+        (autod_url, autod_params, autod_req, autod_headers) = self._ews_autodiscover_request_builder();
+
+        try:
+            (autod_resp, autod_resp_body) = self.pool.request("POST", autod_url, autod_params, autod_headers);
+        except Exception as err:
+            self._log(str(err), 'CRIT');
+            self._log(str(traceback.format_exc()), 'CRIT');
+            return;
+
+        autod_url = self._ews_autodiscover_redirect_handler(autod_url, autod_resp);
+        if autod_url is None:
+            return;
+
+        if self.verbose >= 4:
+            self._log('HTTP REQUEST URL: ' + str(autod_url), 'INFO');
+            self._log('HTTP REQUEST BODY:\n' + autod_req.decode('utf-8'), 'INFO');
+
+        try:
+            autod_headers = self._ews_inject_cookies(autod_headers, autod_url);
+            (autod_resp, autod_resp_body) = self.pool.request("POST", autod_url, autod_req, autod_headers);
+        except Exception as err:
+            self._log(str(err), 'CRIT');
+            self._log(str(traceback.format_exc()), 'CRIT');
+            return;
+
+        self._ews_autodiscover_response_handler(autod_url, autod_resp, autod_resp_body);
+        self._ews_autodiscover_cache_set();
+        return;
+
+
+    def create_drafts_request(self, emails=None):
+        ''' Prepares CreateItem request for a list of EWSEmail objects, returns request and stage for submit(), or None
+        when the emails are invalid, see create_drafts()
+        '''
+
+        batch = EWSEmailBatch(emails, self.verbose);
+        batch.finalize();
+        for entry in batch.log.snapshot():
+            self._log(entry['text'], entry['level']);
+        if batch.error:
+            return None;
+
+        if batch.emails[0].skel.get('disposition', 'SaveOnly') == 'SaveOnly':
+            return (batch.xml, 'save_only');
+        return (batch.xml, 'send');
+
+
+    def create_drafts(self, emails=None):
+        ''' Creates email drafts for a list of EWSEmail objects in a single CreateItem request
+
+        Returns a list of dictionaries with ResponseClass, ResponseCode, MessageText,
+        Id and ChangeKey keys, one per email and in the same order as the emails.
+        Emails with SendOnly or SendAndSaveCopy message disposition are sent
+        right away instead of being saved as drafts.
+        '''
+
+        r = self.create_drafts_request(emails);
+        if r is None:
+            return [];
+
+        try:
+            return self.submit(r[0], r[1]).items;
+        except EWSError as err:
+            return self._ews_response_items(err);
+
+
+    def send_drafts_request(self, ids=None):
+        ''' Prepares SendItem request for a list of (Id, ChangeKey) email drafts, returns request for submit() with
+        send_and_save stage, or None when the tokens are invalid, see send_drafts()
+        '''
+
+        if not isinstance(ids, list) or len(ids) < 1:
+            self._log('expects a non-empty list of (Id, ChangeKey) email draft tokens', 'ERROR');
+            return None;
+
+        for i in ids:
+            if not isinstance(i, (list, tuple)) or len(i) != 2 or i[0] is None or i[1] is None:
+                self._log('Office 365 email draft token is invalid: ' + str(i), 'ERROR');
+                return None;
+
+        return self._ews_send_and_save_request_builder(ids);
+
+
+    def _ews_response_items(self, err):
+        ''' Returns the response messages of a request whose messages all failed, or re-raises its exception '''
+        if err.response is None or not err.response.items:
+            raise err;
+        return err.response.items;
+
+
+    def _ews_send_drafts_response_handler(self, items, ids):
+        ''' Correlates SendItem outcomes with email drafts '''
+        if len(items) == len(ids):
+            for (item, i) in zip(items, ids):
+                item['Id'] = i[0];
+                item['ChangeKey'] = i[1];
+        return items;
+
+
+    def send_drafts(self, ids=None):
+        ''' Sends a list of (Id, ChangeKey) email drafts in a single SendItem request
+
+        Returns a list of dictionaries with ResponseClass, ResponseCode, MessageText,
+        Id and ChangeKey keys, one per draft and in the same order as the drafts.
+        '''
+
+        ews_req = self.send_drafts_request(ids);
+        if ews_req is None:
+            return [];
+
+        try:
+            items = self.submit(ews_req, 'send_and_save').items;
+        except EWSError as err:
+            items = self._ews_response_items(err);
+        return self._ews_send_drafts_response_handler(items, ids);
+
+
+    def _ews_submit_request_builder(self, ews_req, ews_stage, r=None):
+        ''' Prepares EWS request, returns request and headers, or None
+
+        When the request fails XML schema validation, EWS Response Object r,
+        if any, is marked as failed with EWSSchemaError.
+        '''
+
+        if ews_stage == 'send_and_save' and ews_req is None and (self.id is None or self.changekey is None):
+            self._log('Office 365 email draft token is missing', 'ERROR');
+            return None;
+
+        if ews_stage == 'send_and_save' and ews_req is None:
             ews_req = self._ews_send_and_save_request_builder();
 
+        # X-AnchorMailbox routes the request to the mailbox server, as does X-BackEndOverrideCookie
         ews_headers = {'User-Agent': str(self.user_agent),
                        'X-MapiHttpCapability': '1',
+                       'X-AnchorMailbox': self.username,
                        'Authorization': self.basic_auth,
                        'Content-Type': 'text/xml; charset=utf-8'};
 
-        ews_headers = self._ews_inject_cookies(ews_headers);
+        if self.compression.accept_encoding() is not None:
+            ews_headers['Accept-Encoding'] = self.compression.accept_encoding();
+
+        ews_headers = self._ews_inject_cookies(ews_headers, self.server);
+
+        if isinstance(ews_req, str):
+            # http.client would encode str request body as ISO-8859-1
+            ews_req = ews_req.encode('utf-8');
+        elif not isinstance(ews_req, bytes) and hasattr(ews_req, '__len__'):
+            # streamed request body, e.g. EWSAttachmentStream
+            ews_headers['Content-Length'] = str(len(ews_req));
+
+        if self.validation.requests and isinstance(ews_req, bytes):
+            exsv = EWSXmlSchemaValidator(ews_req);
+            for i in exsv.logs:
+                self._log(i[0], i[1]);
+            if exsv.valid == False:
+                if r is None:
+                    self._log('failed ews xml schema validation for ews request', 'ERROR');
+                else:
+                    self._ews_submit_fail(r, EWSSchemaError, 'failed ews xml schema validation for ews request');
+                return None;
 
         if self.verbose >= 4:
             self._log('HTTP REQUEST URL: ' + self.server, 'INFO');
             for h in ews_headers:
                 self._log('HTTP REQUEST HEADER: ' + h + ':   ' + ews_headers[h], 'INFO');
-            self._log('HTTP REQUEST BODY:\n' + str(ews_req), 'INFO');
-                        
-        try:
-            if self._ews_urlsplit('prefix', self.server) == 'https':
-                ews_conn = http.client.HTTPSConnection(self._ews_urlsplit('host', self.server));
-            elif self._ews_urlsplit('prefix', self.server) == 'http':
-                ews_conn = http.client.HTTPConnection(self._ews_urlsplit('host', self.server));
+            if isinstance(ews_req, bytes):
+                self._log('HTTP REQUEST BODY:\n' + ews_req.decode('utf-8'), 'INFO');
             else:
-                return;
-            #if self.verbose >= 5:
-            #    ews_conn.set_debuglevel(self.verbose);
-            ews_conn.request("POST", self._ews_urlsplit('path', self.server), ews_req, ews_headers);
-            ews_resp = ews_conn.getresponse();
-            ews_resp_headers = ews_resp.getheaders();
-            ews_resp_body = self._ews_remove_xml_header(ews_resp.read().decode("utf-8"));
-            ews_conn.close();
-        except Exception as err:
-            self._log(str(err), 'CRIT');
-            self._log(str(traceback.format_exc()), 'CRIT');
-            return;
+                self._log('HTTP REQUEST BODY:\n' + str(ews_req), 'INFO');
+
+        return (ews_req, ews_headers);
+
+
+    def _ews_submit_compress(self, ews_req, ews_headers):
+        ''' Compresses EWS request when it is due, see EWSCompressionPolicy, returns request and headers '''
+
+        size = len(ews_req) if hasattr(ews_req, '__len__') else None;
+        if ews_req is None or not self.compression.should_compress(self.server, size):
+            return (ews_req, ews_headers);
+
+        ews_headers = dict(ews_headers);
+        ews_headers['Content-Encoding'] = 'gzip';
+        # compressed size of streamed request is not known until it is sent
+        ews_headers.pop('Content-Length', None);
+        return (self.compression.compress(ews_req), ews_headers);
+
+
+    def _ews_submit_rejected(self, ews_stage, ews_resp):
+        ''' Returns True when EWS endpoint rejected compressed request, which is then to be sent uncompressed '''
+
+        if ews_resp.status not in self.compression.reject_status:
+            return False;
+        self.compression.reject(self.server);
+        self._log(self._ews_urlsplit('host', self.server) + ' rejected compressed ' + str(ews_stage) + ' request with HTTP ' + \
+                  str(ews_resp.status) + ', sending requests uncompressed', 'WARN');
+        return True;
+
+
+    def _ews_submit_decoder(self, ews_stage, validate):
+        ''' Returns EWSResponseDecoder for streamed EWS response, or None when the response must be parsed as a whole
+
+        The response is parsed as a whole when it is due for XML schema
+        validation, or when it is logged.
+        '''
+        if validate or self.verbose >= 4 or ews_stage not in self.response_messages:
+            return None;
+        return EWSResponseDecoder(self.response_messages[ews_stage], ews_stage, self.validation);
+
+
+    def _ews_submit_response_handler(self, ews_stage, ews_resp, ews_resp_body, r, validate=True, decoder=None):
+        ''' Handles EWS response, fills in EWS Response Object
+
+        The body of streamed response is None, and its response messages are
+        taken from decoder, see EWSResponseDecoder.
+        '''
+
+        r.status = ews_resp.status;
+        r.reason = ews_resp.reason;
+        ews_resp_headers = ews_resp.getheaders();
+
+        if 300 <= ews_resp.status < 400 or ews_resp.status == 421:
+            # the mailbox has moved, the EWS endpoint must be discovered again
+            self._ews_autodiscover_cache_invalidate();
 
         if self.verbose >= 4:
             self._log('HTTP RESPONSE STATUS/REASON: ' + str(ews_resp.status) + '/' + str(ews_resp.reason), 'INFO');
@@ -465,77 +790,485 @@ class EWSSession:
             for h in ews_resp_headers:
                 if self.verbose >= 4:
                     self._log('HTTP RESPONSE HEADER: ' + str(h[0]) + ':   ' + str(h[1]), 'INFO');
-                if str(h[0]) == 'Set-Cookie':
-                    self._ews_add_cookies(str(h[1]));
         else:
-            self._log(ews_url + ' does not respond with headers', 'CRIT');
-            return;
-
-        if isinstance(ews_resp_body, str):
+            return self._ews_submit_fail(r, EWSTransportError, self.server + ' does not respond with headers', lvl='CRIT');
+
+        if ews_resp.status != 200:
+            fault = self._ews_soap_fault(ews_resp_body) if isinstance(ews_resp_body, bytes) else None;
+            if ews_resp.status in [401, 403]:
+                return self._ews_submit_fail(r, EWSAuthError, self.server + ' responds with HTTP ' + str(ews_resp.status) + ' ' + str(ews_resp.reason),
+                                             ews_resp.status);
+            if fault is not None:
+                (r.response_code, r.message_text) = fault[:2];
+                msg = self.server + ' responds with SOAP fault: ' + str(fault[0]) + ': ' + str(fault[1]);
+                if fault[0] in self.throttle.throttle_codes:
+                    return self._ews_submit_fail(r, EWSThrottledError, msg, fault[0]);
+                return self._ews_submit_fail(r, EWSResponseError, msg, fault[0]);
+            msg = self.server + ' responds with HTTP ' + str(ews_resp.status) + ' ' + str(ews_resp.reason);
+            if ews_resp.status in [429, 503]:
+                return self._ews_submit_fail(r, EWSThrottledError, msg, ews_resp.status);
+            return self._ews_submit_fail(r, EWSTransportError, msg, ews_resp.status);
+
+        if ews_resp_body is None and decoder is not None:
+            return self._ews_submit_decoded(ews_stage, decoder, r);
+
+        if isinstance(ews_resp_body, bytes):
             if len(ews_resp_body) < 20:
-                self._log(ews_url + ' text-based output is too short', 'ERROR');
-                return;
+                return self._ews_submit_fail(r, EWSTransportError, self.server + ' text-based output is too short');
         else:
-            self._log(ews_url + ' does not respond with text-based output', 'ERROR');
-            return;
+            return self._ews_submit_fail(r, EWSTransportError, self.server + ' does not respond with text-based output');
+
+        ts = time.monotonic();
+        if validate:
+            exsv = EWSXmlSchemaValidator(ews_resp_body);
+            self.validation.record(ews_stage, exsv.valid);
+            r.timings['validation'] = time.monotonic() - ts;
+            for i in exsv.logs:
+                self._log(i[0], i[1]);
+            if exsv.valid == False:
+                return self._ews_submit_fail(r, EWSSchemaError, 'failed ews xml schema validation for ews response');
+            t = exsv.tree;
+        else:
+            try:
+                t = etree.fromstring(ews_resp_body);
+            except Exception as err:
+                return self._ews_submit_fail(r, EWSResponseError, 'failed to parse ews response: ' + str(err));
+            defect = self.validation.check(t, ews_stage);
+            r.timings['validation'] = time.monotonic() - ts;
+            if defect is not None:
+                return self._ews_submit_fail(r, EWSSchemaError, 'failed structural check of ews response: ' + defect);
+
+        ts = time.monotonic();
+        self._ews_xml_response_parser(ews_stage, self.server, str(ews_resp.status), str(ews_resp.reason), t, r);
+        r.timings['parsing'] = time.monotonic() - ts;
+        return self._ews_submit_outcome(r);
+
+
+    def _ews_submit_decoded(self, ews_stage, decoder, r):
+        ''' Handles streamed EWS response, fills in EWS Response Object '''
+
+        if decoder.size < 20:
+            return self._ews_submit_fail(r, EWSTransportError, self.server + ' text-based output is too short');
+
+        r.items = decoder.close();
+        r.timings['parsing'] = decoder.elapsed;
+        with self.validation.lock:
+            self.validation.stats['checked'] += 1;
+
+        if decoder.error is not None:
+            return self._ews_submit_fail(r, EWSResponseError, 'failed to parse ews response: ' + decoder.error);
+        if decoder.defect is not None:
+            return self._ews_submit_fail(r, EWSSchemaError, 'failed structural check of ews response: ' + decoder.defect);
+
+        self._ews_response_outcome(ews_stage, r);
+        return self._ews_submit_outcome(r);
+
+
+    def _ews_submit_outcome(self, r):
+        ''' Keeps the outcome of EWS request in the session, for backward compatibility '''
+
+        with self.lock:
+            self.items = r.items;
+            if r.id is not None and r.changekey is not None:
+                self.id = r.id;
+                self.changekey = r.changekey;
+        return r;
+
+
+    def _ews_submit_classify(self, ews_stage, ews_resp, ews_resp_body, decoder=None):
+        ''' Classifies EWS response by its SOAP fault or response messages, see EWSThrottle.classify_response() '''
+
+        retry_after = ews_resp.getheader('Retry-After');
+        if ews_resp_body is None and decoder is not None:
+            return self.throttle.classify_response(ews_resp.status, retry_after, items=decoder.close(), backoff=decoder.backoff);
+        if not isinstance(ews_resp_body, bytes):
+            return self.throttle.classify_response(ews_resp.status, retry_after);
+        if ews_resp.status != 200:
+            fault = self._ews_soap_fault(ews_resp_body);
+            if fault is None:
+                return self.throttle.classify_response(ews_resp.status, retry_after);
+            return self.throttle.classify_response(ews_resp.status, retry_after, fault=fault[0], backoff=fault[2]);
+        if ews_stage not in self.response_messages:
+            return self.throttle.classify_response(ews_resp.status, retry_after);
+        # the response is parsed as a whole later on, e.g. for XML schema validation
+        decoder = EWSResponseDecoder(self.response_messages[ews_stage], ews_stage);
+        decoder.feed(ews_resp_body);
+        return self.throttle.classify_response(ews_resp.status, retry_after, items=decoder.close(), backoff=decoder.backoff);
+
+
+    def _ews_submit_release(self, x, outcome='cancelled', backoff=None):
+        ''' Releases the throttle slot held by EWS request attempt, at most once
+
+        The cancelled outcome leaves the congestion window as it is, e.g. when
+        the attempt was interrupted by KeyboardInterrupt or asyncio cancellation.
+        '''
+        if x['held'] is not None:
+            (url, x['held']) = (x['held'], None);
+            self.throttle.release(url, outcome, backoff);
+        return;
 
-        exsv = EWSXmlSchemaValidator(ews_resp_body);
 
-        for i in exsv.logs:
-            self._log(i[0], i[1]);
+    def _ews_submit_retry(self, x, attempt, err=None, ews_resp=None, ews_resp_body=None):
+        ''' Records the outcome of EWS request attempt, returns delay before retry in seconds, or None
+
+        The number of retries is capped by the retries of submit(), by default throttle.max_retries.
+        '''
+
+        ews_stage = x['stage'];
+        if err is not None:
+            (outcome, retryable) = self.throttle.classify_error(err, ews_stage, x['timings'].get('sent', True));
+            backoff = None;
+        else:
+            (outcome, backoff, retryable) = self._ews_submit_classify(ews_stage, ews_resp, ews_resp_body, x['decoder']);
+
+        if outcome == 'throttled' and backoff is None:
+            backoff = self.throttle.delay(attempt);
+
+        self._ews_submit_release(x, outcome, backoff);
+
+        if not retryable or attempt >= x['retries']:
+            return None;
+
+        with self.throttle.cond:
+            self.throttle.stats['retries'] += 1;
+
+        if outcome == 'throttled':
+            # the throttle holds back requests to the endpoint for the back-off period
+            delay = 0;
+            reason = 'is busy';
+        else:
+            delay = self.throttle.delay(attempt);
+            reason = 'failed transiently';
+        if err is not None:
+            reason += ' (' + type(err).__name__ + ': ' + str(err) + ')';
+        self._log(self._ews_urlsplit('host', self.server) + ' ' + reason + ', retrying ' + str(ews_stage) + ' request in ' + \
+                  '{0:.3f}'.format(backoff if outcome == 'throttled' else delay) + ' seconds, attempt ' + str(attempt + 2), 'WARN');
+        return delay;
+
+
+    def _ews_submit_begin(self, r, ews_req, ews_stage, retries=None):
+        ''' Builds EWS request for submit(), returns its submission state, or None when it cannot be built
+
+        The state is shared by the attempts of the request, see _ews_submit_attempt().
+        '''
+        req = self._ews_submit_request_builder(ews_req, ews_stage, r);
+        if req is None:
+            if r.exception is None:
+                self._ews_submit_fail(r, EWSInputError, str(self._ews_last_error()));
+            return None;
+        (ews_req, ews_headers) = req;
+        r.request_size = _ews_body_length(ews_req);
+        (body, headers) = self._ews_submit_compress(ews_req, ews_headers);
+        return {'stage': ews_stage, 'request': ews_req, 'request_headers': ews_headers, 'body': body, 'headers': headers,
+                'validate': self.validation.should_validate(ews_stage), 'timings': {}, 'decoder': None,
+                'retries': self.throttle.max_retries if retries is None else retries, 'held': None};
+
+
+    def _ews_submit_attempt(self, x):
+        ''' Prepares EWS request attempt admitted by the throttle, returns request body, headers, timings and response decoder
+
+        The throttle slot is released by _ews_submit_error(), _ews_submit_reply(),
+        or, when the attempt is interrupted, by _ews_submit_release().
+        '''
+        x['held'] = self.server;
+        x['timings'] = {};
+        x['decoder'] = self._ews_submit_decoder(x['stage'], x['validate']);
+        x['headers'] = self._ews_inject_cookies(x['headers'], self.server);
+        return (x['body'], x['headers'], x['timings'], x['decoder']);
+
+
+    def _ews_submit_error(self, r, x, err):
+        ''' Handles failed EWS request attempt, returns delay before retry in seconds, or None when the request failed
+
+        Must be called from the except block handling err.
+        '''
+        self._ews_submit_timings(r, x['timings']);
+        delay = self._ews_submit_retry(x, r.retries, err=err);
+        if delay is None:
+            self._log(str(traceback.format_exc()), 'CRIT');
+            self._ews_autodiscover_cache_invalidate();
+            self._ews_submit_fail(r, EWSTransportError, self.server + ' request failed: ' + type(err).__name__ + ': ' + str(err), lvl='CRIT');
+            r.exception.__cause__ = err;
+        return delay;
+
+
+    def _ews_submit_reply(self, r, x, ews_resp, ews_resp_body):
+        ''' Handles EWS response of request attempt, returns delay before retry in seconds, or None when the response is final '''
+        self._ews_add_cookies(self.server, ews_resp.getheaders());
+        self._ews_submit_timings(r, x['timings']);
+        if x['body'] is not x['request'] and self._ews_submit_rejected(x['stage'], ews_resp):
+            self._ews_submit_release(x, 'ok');
+            (x['body'], x['headers']) = (x['request'], x['request_headers']);
+            return 0;
+        return self._ews_submit_retry(x, r.retries, ews_resp=ews_resp, ews_resp_body=ews_resp_body);
+
+
+    def _ews_submit_timings(self, r, timings):
+        ''' Adds stage durations and byte counts of EWS request attempt to EWS Response Object '''
+        for k in timings:
+            if k == 'sent':
+                continue;
+            elif k in ['bytes_sent', 'bytes_received']:
+                setattr(r, k, getattr(r, k) + timings[k]);
+            elif k == 'response_size':
+                r.response_size = timings[k];
+            elif timings[k] is not None:
+                r.timings[k] = r.timings.get(k, 0) + timings[k];
+        return;
+
+
+    def _ews_submit_fail(self, r, exc, msg, code=None, lvl='ERROR'):
+        ''' Marks EWS Response Object as failed with exception of a given type, returns it '''
+        self._log(msg, lvl);
+        r.error = True;
+        if r.exception is None:
+            r.exception = exc(msg, r, code);
+        return r;
+
+
+    def _ews_submit_done(self, r, ts):
+        ''' Completes EWS Response Object, passes it to metrics sink, and raises its exception '''
+        r.timings['total'] = time.monotonic() - ts;
+        if self.metrics is not None:
+            try:
+                self.metrics.record(r);
+            except Exception as err:
+                self._log('metrics sink failed: ' + str(err), 'WARN');
+        if r.error and r.exception is None:
+            r.exception = EWSResponseError(self._ews_last_error() or 'EWS request failed', r, r.response_code);
+        if r.exception is not None:
+            raise r.exception;
+        return r;
+
+
+    def submit(self, ews_req=None, ews_stage=None, retries=None):
+        ''' Submits EWS request, returns EWS Response Object
+
+        The EWS Response Object carries the outcome of this request only, which
+        makes it safe to share the session between threads. For backward
+        compatibility, the session also keeps the last email draft token in
+        self.id and self.changekey, and the last per-message outcomes in
+        self.items.
+
+        Stages:
+         * save_only: CreateItem request saving email drafts
+         * send: CreateItem request with SendOnly or SendAndSaveCopy message
+           disposition, i.e. email is sent without a draft round trip
+         * attachment: CreateAttachment request for email draft
+         * send_and_save: SendItem request for email drafts; when the request
+           is not provided, it is built for the last email draft
+
+        Requests are admitted and retried by self.throttle, see EWSThrottle.
+        retries caps the retries of this request, by default
+        self.throttle.max_retries, e.g. 0 when the caller retries by itself.
+        Requests and responses are compressed as self.compression decides,
+        see EWSCompressionPolicy.
+        The EWS Response Object is passed to self.metrics, see EWSMetrics.
+        Responses that are not due for XML schema validation, see
+        EWSValidationPolicy, are decoded as they are read off the connection,
+        see EWSResponseDecoder.
+
+        Raises EWSError, e.g. EWSTransportError, EWSAuthError,
+        EWSThrottledError, EWSSchemaError, or EWSResponseError, when the
+        request fails, or when all of its response messages failed. The
+        EWS Response Object is available as the response attribute of the
+        exception. Failures of some of the messages of a request are reported
+        in its items only.
+        '''
+
+        r = EWSResponse(ews_stage);
+        ts = time.monotonic();
+
+        if not self._ews_endpoint_ready():
+            (exc, code) = self._ews_autodiscover_error();
+            self._ews_submit_fail(r, exc, 'EWS endpoint is unknown: ' + str(self._ews_last_error()), code);
+            return self._ews_submit_done(r, ts);
+
+        x = self._ews_submit_begin(r, ews_req, ews_stage, retries);
+        if x is None:
+            return self._ews_submit_done(r, ts);
+
+        while True:
+            self.throttle.acquire(self.server);
+            try:
+                (body, headers, timings, decoder) = self._ews_submit_attempt(x);
+                (ews_resp, ews_resp_body) = self.pool.request("POST", self.server, body, headers, timings, decoder);
+            except Exception as err:
+                delay = self._ews_submit_error(r, x, err);
+                if delay is None:
+                    return self._ews_submit_done(r, ts);
+            else:
+                delay = self._ews_submit_reply(r, x, ews_resp, ews_resp_body);
+                if delay is None:
+                    break;
+            finally:
+                self._ews_submit_release(x);
+            time.sleep(delay);
+            r.retries += 1;
+        r.timings['request'] = time.monotonic() - ts;
+
+        self._ews_submit_response_handler(ews_stage, ews_resp, ews_resp_body, r, x['validate'], decoder);
+        return self._ews_submit_done(r, ts);
 
-        if exsv.valid == False:
-            self._log('failed ews xml schema validation for ews response', 'ERROR');
-            self._exit(1);
 
-        self._ews_xml_response_parser(ews_stage, self.server, str(ews_resp.status), str(ews_resp.reason), ews_resp_body);
-        
+    def _ews_pool_init(self, pool_size, pool_idle_timeout, pool_max_requests):
+        ''' Initializes connection pool '''
+        return EWSConnectionPool(pool_size, pool_idle_timeout, pool_max_requests,
+                                 debuglevel=(self.verbose if self.verbose >= 5 else 0));
+
+
+    def close(self):
+        ''' Closes persistent connections to EWS endpoints '''
+        self.pool.close();
         return;
 
 
-    def __init__(self, u=None, p=None, s=None, verbose=0):
-        ''' Initialize Microsoft Office 365 Session via SOAP '''
+    def _ews_endpoint_ready(self):
+        ''' Discovers EWS endpoint server on first use, returns True when it is known '''
+
+        if self.server is not None:
+            return True;
+
+        with self.endpoint_lock:
+            if self.server is not None:
+                return True;
+
+            self._ews_autodiscover();
+
+            if self.server is None:
+                self._ews_autodiscover_failed();
+                return False;
+
+        if self.verbose > 0:
+            self._log( 'EWS Endpoint Server: ' + self._ews_urlsplit('host', self.server), 'INFO');
+
+        return True;
+
+
+    def _ews_endpoint_init(self):
+        ''' Discovers EWS endpoint server, unless it was provided '''
+
+        if self.server is not None:
+            if self.verbose > 0:
+                self._log( 'EWS Endpoint Server: ' + self._ews_urlsplit('host', self.server), 'INFO');
+            return;
+
+        if not self._ews_endpoint_ready():
+            (exc, code) = self._ews_autodiscover_error();
+            raise exc(str(self._ews_last_error()), None, code);
+
+        return;
+
+
+    def warmup(self, connections=1, background=False):
+        ''' Discovers EWS endpoint server and opens connections to it ahead of the first submit()
+
+        Returns True when the session is ready. With background=True, the work
+        is done in a daemon thread, which is returned to the caller.
+        '''
+
+        if background:
+            t = threading.Thread(target=self.warmup, args=(connections,), daemon=True);
+            t.start();
+            return t;
+
+        if not self._ews_endpoint_ready():
+            return False;
+
+        try:
+            self.pool.warmup(self.server, connections);
+        except Exception as err:
+            self._log('EWS Endpoint Warmup Failed: ' + str(err), 'WARN');
+            self._ews_autodiscover_cache_invalidate();
+            return False;
+
+        return True;
+
+
+    def __init__(self, u=None, p=None, s=None, verbose=0, pool_size=4, pool_idle_timeout=60, pool_max_requests=100,
+                 autodiscover_cache=True, lazy=False, throttle=None, metrics=None, validation=None, autodiscover_url=None,
+                 compression=None):
+        ''' Initialize Microsoft Office 365 Session via SOAP
+
+        Connections to the autodiscovery and EWS endpoints are kept alive and
+        reused across submit() calls. pool_size limits the number of idle
+        connections kept per endpoint, pool_idle_timeout (seconds) and
+        pool_max_requests limit how long a single connection is reused.
+        Cookies set by the autodiscovery and EWS endpoints, e.g. backend
+        affinity cookie, are kept in self.cookies, see EWSCookieJar.
+        When autodiscover_cache is True, the EWS endpoint discovered for the
+        mailbox via the same autodiscovery service is reused, see
+        EWSAutodiscoverCache.
+
+        When lazy is True, the constructor performs no network I/O and does not
+        raise EWSAutodiscoverError when autodiscovery fails. The EWS endpoint
+        is discovered by warmup(), or on the first submit(), which then raises
+        EWSAutodiscoverError if the endpoint cannot be discovered, or
+        EWSAuthError if the autodiscovery service rejects the credentials.
+
+        throttle is EWSThrottle, possibly shared with other sessions, which
+        adapts request concurrency and retries throttled requests.
+
+        metrics is EWSMetrics sink, e.g. EWSMetricsRegistry, which receives
+        per-request latencies, byte counts, retries and response codes.
+
+        validation is EWSValidationPolicy, or its mode, e.g. sampled, which
+        decides which EWS responses are validated against the XML schema. By
+        default, every response is validated.
+
+        compression is EWSCompressionPolicy, or its mode, e.g. responses,
+        which decides whether EWS responses and requests are compressed. True
+        stands for responses. By default, nothing is compressed.
+
+        autodiscover_url overrides the autodiscovery service URL, e.g. that of
+        EWSMockServer, see also PYEWSCLIENT_AUTODISCOVER_URL environment
+        variable.
+        '''
 
-        self.s = requests.Session();
         self.verbose = verbose;
+        self.pool = self._ews_pool_init(pool_size, pool_idle_timeout, pool_max_requests);
+        self.lock = threading.RLock();
+        self.endpoint_lock = threading.Lock();
+        self.throttle = throttle if throttle is not None else EWSThrottle();
+        self.metrics = metrics;
+        self.validation = validation if isinstance(validation, EWSValidationPolicy) else EWSValidationPolicy(validation or 'always');
+        if isinstance(compression, EWSCompressionPolicy):
+            self.compression = compression;
+        else:
+            self.compression = EWSCompressionPolicy('responses' if compression is True else (compression or 'none'));
 
-        self.log = {};
-        self._log_id = 0;
+        self.log = EWSLogBuffer();
         self.error = False;
 
         if isinstance(u, str):
             self.username = u;
         else:
             self._log('expects username parameter to be a string', 'ERROR');
-            self._exit(1);
+            raise EWSInputError('expects username parameter to be a string');
 
         if isinstance(p, str):
             self.password = p;
         else:
             self._log('expects password parameter to be a string', 'ERROR');
-            self._exit(1);
+            raise EWSInputError('expects password parameter to be a string');
 
         self.basic_auth = 'Basic ' + base64.urlsafe_b64encode(bytes(self.username + ':' + self.password, 'utf-8')).decode('utf-8');
         self.user_agent = 'Mozilla/5.0 (Windows NT 5.1; rv:31.1) Gecko/20100101 Firefox/31.0';
 
         self.server = s;
+        self.autodiscover_url = autodiscover_url or self.autodiscover_url;
+        self.autodiscover_cache = autodiscover_cache;
+        self.autodiscovered = False;
+        self.autodiscover_status = None;
         self.id = None;
         self.changekey = None;
-        self.cookies = {};
+        self.items = [];
+        self.cookies = EWSCookieJar();
 
         if self.verbose > 0:
             self._log( 'Log Level : ' + str(self.verbose), 'INFO');
 
-        if self.server is None:
-            self._ews_autodiscover();
-
-        if self.server is None:
-            self._log('EWS Endpoint Autodiscovery Failed', 'ERROR');
-            self._exit(1);
-        
-        if self.verbose > 0:
-            self._log( 'EWS Endpoint Server: ' + self._ews_urlsplit('host', self.server), 'INFO');
-
+        if not lazy:
+            self._ews_endpoint_init();
 
         return;
-
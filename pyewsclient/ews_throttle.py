@@ -0,0 +1,254 @@
+#   PyEwsClient - Microsoft Office 365 EWS (Exchange Web Services) Client Library
+#   Copyright (C) 2013 Paul Greenberg <paul@greenberg.pro>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys;
+import time;
+import random;
+import threading;
+import http.client;
+
+from pyewsclient.ews_connection import _ews_endpoint_key;
+
+
+def _ews_wake(waiter):
+    ''' Wakes coroutine waiting in EWSThrottle.acquire_async() '''
+    if not waiter.done():
+        waiter.set_result(None);
+    return;
+
+
+def _ews_async_errors():
+    ''' Returns asyncio timeout and incomplete read exceptions, or none when asyncio was never imported '''
+    asyncio = sys.modules.get('asyncio');
+    if asyncio is None:
+        return ((), ());
+    return ((asyncio.TimeoutError,), (asyncio.IncompleteReadError,));
+
+
+class EWSThrottle:
+    '''Represents adaptive throttling and retry policy for EWS requests.
+
+    Requests to each EWS endpoint are admitted through a congestion window.
+    The window grows by about one request per window of successful requests,
+    and it is halved when the endpoint throttles, i.e. responds with
+    ErrorServerBusy, HTTP 503 or 429, or times out (AIMD). No requests are
+    admitted to a throttled endpoint until the back-off period requested by
+    the server, e.g. BackOffMilliseconds, elapses.
+
+    Failed requests are retried up to max_retries times, with exponential
+    back-off and jitter, but only when the retry cannot duplicate an email,
+    i.e. the request was refused, or failed before it was written, or the
+    server answered that it was not processed. A request that may have
+    reached the server, e.g. it timed out, is retried only for the stages in
+    idempotent_stages, none by default: even a save_only or attachment retry
+    could leave a duplicate draft or attach a file twice. A throttle may be
+    shared by many sessions.
+    '''
+
+    throttle_codes = ['ErrorServerBusy', 'ErrorTooManyObjectsOpened'];
+    transient_codes = ['ErrorInternalServerTransientError', 'ErrorMailboxStoreUnavailable', 'ErrorTimeoutExpired'];
+    idempotent_stages = [];
+
+    def _state(self, key):
+        s = self.endpoints.get(key);
+        if s is None:
+            s = {'limit': float(self.initial_limit), 'inflight': 0, 'until': 0.0, 'decreased': 0.0};
+            self.endpoints[key] = s;
+        return s;
+
+
+    def _try_acquire(self, key):
+        ''' Admits request, returns 0, or the time to wait in seconds, or None to wait for a release '''
+        s = self._state(key);
+        now = time.monotonic();
+        if now < s['until']:
+            return s['until'] - now;
+        if s['inflight'] >= int(s['limit']):
+            return None;
+        s['inflight'] += 1;
+        return 0;
+
+
+    def acquire(self, url):
+        ''' Waits until a request to URL is admitted '''
+        key = _ews_endpoint_key(url);
+        with self.cond:
+            while True:
+                w = self._try_acquire(key);
+                if w == 0:
+                    return;
+                self.cond.wait(w);
+
+
+    async def acquire_async(self, url):
+        ''' Waits until a request to URL is admitted, without blocking the event loop
+
+        While the window is full, the coroutine waits until release() wakes it.
+        '''
+        import asyncio;
+        key = _ews_endpoint_key(url);
+        loop = asyncio.get_running_loop();
+        while True:
+            waiter = None;
+            with self.cond:
+                w = self._try_acquire(key);
+                if w is None:
+                    waiter = loop.create_future();
+                    self.waiters.append((loop, waiter));
+            if w == 0:
+                return;
+            if waiter is None:
+                await asyncio.sleep(w);
+            else:
+                await waiter;
+
+
+    def release(self, url, outcome='ok', backoff=None):
+        ''' Records the outcome of an admitted request: ok, throttled, transient, or cancelled
+
+        cancelled frees the slot of an interrupted request, without changing the window.
+        '''
+        key = _ews_endpoint_key(url);
+        now = time.monotonic();
+        with self.cond:
+            s = self._state(key);
+            s['inflight'] = max(0, s['inflight'] - 1);
+            if outcome == 'ok':
+                s['limit'] = min(float(self.max_limit), s['limit'] + 1.0 / s['limit']);
+            elif outcome == 'throttled':
+                if now - s['decreased'] >= self.cooldown:
+                    s['limit'] = max(float(self.min_limit), s['limit'] * self.decrease);
+                    s['decreased'] = now;
+                if backoff is not None:
+                    s['until'] = max(s['until'], now + backoff);
+            self.stats[outcome] += 1;
+            self.cond.notify_all();
+            (waiters, self.waiters) = (self.waiters, []);
+        for (loop, waiter) in waiters:
+            try:
+                loop.call_soon_threadsafe(_ews_wake, waiter);
+            except RuntimeError:
+                # the event loop of the waiter is closed
+                pass;
+        return;
+
+
+    def limit(self, url):
+        ''' Returns current congestion window for URL '''
+        with self.cond:
+            return int(self._state(_ews_endpoint_key(url))['limit']);
+
+
+    def inflight(self, url):
+        ''' Returns the number of admitted requests to URL, which were not released yet '''
+        with self.cond:
+            return self._state(_ews_endpoint_key(url))['inflight'];
+
+
+    def delay(self, attempt):
+        ''' Returns exponential back-off with full jitter for retry attempt, in seconds '''
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)));
+
+
+    def classify_error(self, err, stage=None, sent=True):
+        ''' Classifies request exception, returns outcome and whether the request may be retried
+
+        sent is False when the request failed before any of it was written,
+        see EWSConnectionPool.request().
+        '''
+        (timeouts, incomplete) = _ews_async_errors();
+        if isinstance(err, ConnectionRefusedError) or not sent:
+            # the request never reached the server
+            return ('throttled' if isinstance(err, (TimeoutError,) + timeouts) else 'transient', True);
+        if isinstance(err, (TimeoutError,) + timeouts):
+            return ('throttled', stage in self.idempotent_stages);
+        if isinstance(err, (ConnectionError, http.client.RemoteDisconnected, http.client.IncompleteRead,
+                            http.client.BadStatusLine) + incomplete):
+            return ('transient', stage in self.idempotent_stages);
+        return ('transient', False);
+
+
+    def classify_response(self, status, retry_after=None, fault=None, items=None, backoff=None):
+        ''' Classifies EWS response, returns outcome, back-off in seconds, and whether the request may be retried
+
+        fault is the response code of SOAP fault response, and items the
+        decoded response messages of HTTP 200 response, see classify_messages().
+        backoff is the BackOffMilliseconds of the response, in seconds. The
+        request is retried only when none of its response messages succeeded,
+        so that a partially processed batch is never resubmitted.
+        '''
+        if status in [429, 503]:
+            backoff = None;
+            if retry_after is not None and str(retry_after).strip().isdigit():
+                backoff = min(float(retry_after), self.max_backoff);
+            return ('throttled', backoff, True);
+
+        if fault is not None:
+            # SOAP fault means that the request was not processed
+            if fault in self.throttle_codes:
+                return ('throttled', None if backoff is None else min(backoff, self.max_backoff), True);
+            if fault in self.transient_codes:
+                return ('transient', None, True);
+            return ('ok', None, False);
+
+        if items:
+            return self.classify_messages(items, backoff);
+        return ('ok', None, False);
+
+
+    def classify_messages(self, items, backoff=None):
+        ''' Classifies response messages of HTTP 200 response, see classify_response()
+
+        backoff is the largest BackOffMilliseconds of the response messages, in seconds.
+        '''
+        codes = [x['ResponseCode'] for x in items if x['ResponseCode'] in self.throttle_codes + self.transient_codes];
+        if not codes:
+            return ('ok', None, False);
+
+        retryable = len([x for x in items if x['ResponseClass'] in ['Success', 'Warning']]) == 0;
+        if len([c for c in codes if c in self.throttle_codes]) == 0:
+            return ('transient', None, retryable);
+
+        if backoff is not None:
+            backoff = min(backoff, self.max_backoff);
+        return ('throttled', backoff, retryable);
+
+
+    def __init__(self, max_retries=4, backoff=0.5, max_backoff=300, initial_limit=4, min_limit=1, max_limit=64,
+                 decrease=0.5, cooldown=1.0):
+        ''' Initialize EWS Throttle
+
+        backoff and max_backoff are the base and the cap of retry back-off, in
+        seconds. initial_limit, min_limit and max_limit bound the number of
+        requests in flight per endpoint. On throttling, the limit is multiplied
+        by decrease, at most once per cooldown seconds.
+        '''
+
+        self.max_retries = max_retries;
+        self.backoff = backoff;
+        self.max_backoff = max_backoff;
+        self.initial_limit = max(min_limit, min(initial_limit, max_limit));
+        self.min_limit = min_limit;
+        self.max_limit = max_limit;
+        self.decrease = decrease;
+        self.cooldown = cooldown;
+
+        self.endpoints = {};
+        self.cond = threading.Condition();
+        self.waiters = [];
+        self.stats = {'ok': 0, 'throttled': 0, 'transient': 0, 'cancelled': 0, 'retries': 0};
+
+        return;
@@ -0,0 +1,315 @@
+#!/usr/bin/env python
+
+#------------------------------------------------------------------------------------------#
+# File:      ews-benchmark.py                                                              #
+# Purpose:   PyEwsClient - Microsoft Office 365 Client Library Benchmark Tool              #
+# Author:    Paul Greenberg                                                                #
+# Version:   1.0                                                                           #
+# Copyright: (c) 2013 Paul Greenberg <paul@greenberg.pro>                                  #
+# -----------------------------------------------------------------------------------------#
+
+import os;
+import sys;
+if sys.version_info[0] < 3:
+    sys.stderr.write(os.path.basename(__file__) + ' requires Python 3 or higher.\n');
+    sys.stderr.write("python3 " + __file__ + '\n');
+    exit(1);
+sys.path.append(os.path.join('/'.join(os.path.abspath(__file__).split('/')[:-2])));
+import argparse;
+import datetime;
+import traceback;
+import json;
+import time;
+import resource;
+import tempfile;
+import threading;
+import subprocess;
+import concurrent.futures;
+
+try:
+    from pyewsclient import EWSSession, EWSEmail, EWSEmailBatch, EWSAttachment, EWSBulkSender, EWSMetrics, EWSMockServer, EWSError;
+except Exception as err:
+    for e in err.args:
+        print('%-26s | %s | %s | %s' % (str(datetime.datetime.now()), __file__.split('/')[-1] + '->global()', str(type(err).__name__), str(e)));
+    sys.exit(1);
+
+SCENARIOS = ['session', 'email', 'attachment', 'bulk'];
+IMPORTS = ['EWSError', 'EWSEmail', 'EWSSession', 'AsyncEWSSession'];
+
+
+class EWSLatencyMetrics(EWSMetrics):
+    '''Represents metrics sink keeping the total duration and the body bytes of every EWS request.'''
+
+    def record(self, r):
+        with self.lock:
+            self.latencies.append(r.timings.get('total', 0.0));
+            self.bytes_sent += r.bytes_sent;
+            self.bytes_received += r.bytes_received;
+        return;
+
+
+    def __init__(self):
+        self.lock = threading.Lock();
+        self.latencies = [];
+        self.bytes_sent = 0;
+        self.bytes_received = 0;
+        return;
+
+
+def percentile(values, p):
+    ''' Returns p-th percentile of values, nearest rank '''
+    if not values:
+        return 0.0;
+    values = sorted(values);
+    return values[min(len(values) - 1, max(0, int(round(p / 100.0 * len(values) + 0.5)) - 1))];
+
+
+def peak_rss():
+    ''' Returns peak resident set size of this process, in MiB '''
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss;
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0;
+
+
+def draft(args, i):
+    ''' Returns finalized EWSEmail '''
+    email = EWSEmail(0);
+    email.recipients(['user' + str(i) + '@example.com']);
+    email.subject('Benchmark ' + str(i));
+    email.body('x' * args.ibdy);
+    email.finalize();
+    return email;
+
+
+def run_session(ews, args):
+    ''' Submits pre-built CreateItem requests, returns the number of messages created '''
+    batch = EWSEmailBatch([draft(args, i) for i in range(args.ibsz)]);
+    batch.finalize();
+    requests = (args.imsg + args.ibsz - 1) // args.ibsz;
+
+    def job(i):
+        r = ews.submit(batch.xml, 'save_only');
+        return len([x for x in r.items if x['ResponseClass'] == 'Success']);
+
+    return run_jobs(args, job, requests, args.ibsz);
+
+
+def run_email(ews, args):
+    ''' Drafts, saves and sends emails one by one, returns the number of messages sent '''
+
+    def job(i):
+        r = ews.submit(draft(args, i).xml, 'save_only');
+        items = ews.send_drafts([(r.items[0]['Id'], r.items[0]['ChangeKey'])]);
+        return len([x for x in items if x['ResponseClass'] == 'Success']);
+
+    return run_jobs(args, job, args.imsg, 1);
+
+
+def run_attachment(ews, args):
+    ''' Drafts emails, attaches a file of --attachment-size bytes to each one and sends them, returns the number of messages sent '''
+    fd, fp = tempfile.mkstemp(prefix='ews-benchmark-', suffix='.bin');
+    with os.fdopen(fd, 'wb') as f:
+        f.write(os.urandom(args.iasz));
+
+    def job(i):
+        r = ews.submit(draft(args, i).xml, 'save_only');
+        attachment = EWSAttachment(r.items[0]['Id'], r.items[0]['ChangeKey'], 0, stream=True);
+        attachment.add(fp);
+        attachment.finalize();
+        r = ews.submit(attachment.xml, 'attachment');
+        items = ews.send_drafts([(r.items[0]['Id'], r.items[0]['ChangeKey'])]);
+        return len([x for x in items if x['ResponseClass'] == 'Success']);
+
+    try:
+        return run_jobs(args, job, args.imsg, 1);
+    finally:
+        os.remove(fp);
+
+
+def run_bulk(ews, args):
+    ''' Sends emails with EWSBulkSender, returns the number of messages sent '''
+    sender = EWSBulkSender(ews, {'to': '{to}', 'subject': 'Benchmark {i}', 'body': 'x' * args.ibdy}, args.ibsz, args.icon);
+    specs = ({'to': 'user' + str(i) + '@example.com', 'i': str(i)} for i in range(args.imsg));
+    return (len([r for r in sender.send(specs) if r['ResponseClass'] == 'Success']), sender.stats.get('failed', 0));
+
+
+def run_jobs(args, job, n, size):
+    ''' Runs n jobs of size messages each on --concurrency threads, returns the number of messages done and failed
+
+    A job returns the number of its messages that succeeded, and the rest of
+    them, e.g. Error or Warning response messages, count as failed, as do all
+    of the messages of a job that raised EWSError.
+    '''
+    done = 0;
+    failed = 0;
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.icon) as executor:
+        for f in concurrent.futures.as_completed([executor.submit(job, i) for i in range(n)]):
+            try:
+                ok = f.result();
+            except EWSError:
+                ok = 0;
+            done += ok;
+            failed += size - ok;
+    return (done, failed);
+
+
+def worker(args):
+    ''' Runs a single scenario against the mock server, prints its results as JSON '''
+    metrics = EWSLatencyMetrics();
+    ews = EWSSession('benchmark@example.com', 'benchmark', None, args.ilog, pool_size=args.icon, autodiscover_cache=False,
+                     metrics=metrics, validation=args.ival, autodiscover_url=args.iurl, compression=args.icmp);
+    ews.warmup(args.icon);
+    metrics.latencies = [];
+    metrics.bytes_sent = 0;
+    metrics.bytes_received = 0;
+
+    func = {'session': run_session, 'email': run_email, 'attachment': run_attachment, 'bulk': run_bulk}[args.iwrk];
+    ts = time.perf_counter();
+    (messages, failed) = func(ews, args);
+    elapsed = time.perf_counter() - ts;
+    ews.close();
+
+    print(json.dumps({'scenario': args.iwrk, 'messages': messages, 'failed': failed, 'requests': len(metrics.latencies),
+                      'elapsed': round(elapsed, 3), 'msgs_per_sec': round(messages / elapsed if elapsed else 0.0, 1),
+                      'p50_ms': round(percentile(metrics.latencies, 50) * 1000, 2),
+                      'p99_ms': round(percentile(metrics.latencies, 99) * 1000, 2),
+                      'sent_kb': round(metrics.bytes_sent / 1024.0, 1), 'received_kb': round(metrics.bytes_received / 1024.0, 1),
+                      'peak_rss_mb': round(peak_rss(), 1)}));
+    return;
+
+
+def import_time(name, runs=5):
+    ''' Returns the best time to import a class from pyewsclient in a fresh interpreter, in milliseconds '''
+    code = 'import sys, time; sys.path.insert(0, ' + repr(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) + '); ' + \
+           't = time.perf_counter(); from pyewsclient import ' + name + '; print(time.perf_counter() - t)';
+    best = None;
+    for i in range(runs):
+        p = subprocess.run([sys.executable, '-c', code], stdout=subprocess.PIPE, universal_newlines=True, check=True);
+        t = float(p.stdout.strip().splitlines()[-1]) * 1000;
+        best = t if best is None else min(best, t);
+    return round(best, 2);
+
+
+def regressions(results, baseline, tolerance):
+    ''' Compares results with baseline, returns a list of regressions '''
+    found = [];
+    for r in results:
+        b = baseline.get(r['scenario']);
+        if not isinstance(b, dict):
+            continue;
+        if b.get('msgs_per_sec') and r.get('msgs_per_sec', 0) < b['msgs_per_sec'] * (1 - tolerance):
+            found.append(r['scenario'] + ': msgs/sec ' + str(r['msgs_per_sec']) + ' < ' + str(b['msgs_per_sec']));
+        for k in ['p99_ms', 'peak_rss_mb', 'import_ms']:
+            if b.get(k) and r.get(k, 0) > b[k] * (1 + tolerance):
+                found.append(r['scenario'] + ': ' + k + ' ' + str(r[k]) + ' > ' + str(b[k]));
+    return found;
+
+
+def main():
+    func = 'main()';
+    descr = 'PyEwsClient - Microsoft Office 365 Client Library Benchmark Tool\n\n';
+    descr += 'Runs the session, email, attachment and bulk scenarios against a local EWSMockServer, each one\n';
+    descr += 'in its own process, and reports messages per second, p50/p99 request latency and peak RSS.\n\n';
+    descr += 'examples: \n \n';
+    descr += ' python3 ' + str(__file__) + ' --messages 1000 --latency 0.02 --throttle 0.05 --json results.json \n \n';
+    descr += ' python3 ' + str(__file__) + ' --baseline results.json --tolerance 0.2 \n \n';
+    descr += ' python3 ' + str(__file__) + ' --help';
+    epil = 'documentation:\n https://github.com/greenpau/PyEwsClient\n\n';
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,description=descr, epilog=epil);
+    bench_group = parser.add_argument_group('benchmark arguments');
+    bench_group.add_argument('--scenario', dest='iscn', metavar='NAME', action='append', choices=SCENARIOS,
+                             help='Scenario: session, email, attachment, or bulk (default: all)');
+    bench_group.add_argument('--messages', dest='imsg', metavar='N', type=int, default=500, help='Emails per scenario (default: 500)');
+    bench_group.add_argument('--batch-size', dest='ibsz', metavar='N', type=int, default=50, help='Emails per CreateItem request, session and bulk scenarios (default: 50)');
+    bench_group.add_argument('--concurrency', dest='icon', metavar='N', type=int, default=4, help='EWS requests in flight (default: 4)');
+    bench_group.add_argument('--body-size', dest='ibdy', metavar='BYTES', type=int, default=1024, help='Email body size (default: 1024)');
+    bench_group.add_argument('--attachment-size', dest='iasz', metavar='BYTES', type=int, default=262144, help='Attachment size (default: 262144)');
+    bench_group.add_argument('--import-budget', dest='iimp', metavar='MS', type=float,
+                             help='Exit with status 2 when importing any of ' + ', '.join(IMPORTS) + ' takes longer');
+    bench_group.add_argument('--validation', dest='ival', metavar='MODE', type=str, default='always', choices=['always', 'never', 'sampled', 'first'],
+                             help='EWS response XML schema validation: always, never, sampled, or first (default: always)');
+    bench_group.add_argument('--compression', dest='icmp', metavar='MODE', type=str, default='none', choices=['none', 'responses', 'all'],
+                             help='HTTP compression: none, responses, or all, i.e. requests too (default: none)');
+    mock_group = parser.add_argument_group('mock server arguments');
+    mock_group.add_argument('--latency', dest='ilat', metavar='SECONDS', type=float, default=0.0, help='Response latency (default: 0)');
+    mock_group.add_argument('--jitter', dest='ijit', metavar='SECONDS', type=float, default=0.0, help='Random extra response latency (default: 0)');
+    mock_group.add_argument('--throttle', dest='ithr', metavar='RATE', type=float, default=0.0, help='Fraction of requests failing with ErrorServerBusy (default: 0)');
+    mock_group.add_argument('--busy', dest='ibsy', metavar='RATE', type=float, default=0.0, help='Fraction of response messages failing with ErrorServerBusy (default: 0)');
+    mock_group.add_argument('--backoff', dest='ibof', metavar='MS', type=int, default=100, help='BackOffMilliseconds of throttled responses (default: 100)');
+    mock_group.add_argument('--padding', dest='ipad', metavar='BYTES', type=int, default=0, help='Extra bytes per EWS response (default: 0)');
+    mock_group.add_argument('--proxy-latency', dest='iprx', metavar='SECONDS', type=float, default=0.0,
+                            help='Extra latency of EWS requests without backend affinity cookie (default: 0)');
+    mock_group.add_argument('--seed', dest='iseed', metavar='N', type=int, help='Random seed');
+    out_group = parser.add_argument_group('output arguments');
+    out_group.add_argument('--json', dest='ijsn', metavar='FILE', type=str, help='Write results to JSON file, e.g. to be used as baseline');
+    out_group.add_argument('--baseline', dest='ibsl', metavar='FILE', type=str, help='Exit with status 2 when results regress from JSON baseline');
+    out_group.add_argument('--tolerance', dest='itol', metavar='RATE', type=float, default=0.2, help='Regression tolerance (default: 0.2)');
+    parser.add_argument('--worker', dest='iwrk', choices=SCENARIOS, help=argparse.SUPPRESS);
+    parser.add_argument('--autodiscover-url', dest='iurl', help=argparse.SUPPRESS);
+    parser.add_argument('-l', '--log-level', dest='ilog', metavar='LEVEL', type=int, default=0, choices=range(1, 6), help='log level (default: 0, max: 5)');
+
+    args = parser.parse_args();
+
+    if args.iwrk is not None:
+        worker(args);
+        return;
+
+    try:
+        ''' Step 1: Start mock Autodiscover and EWS server '''
+        mock = EWSMockServer(latency=args.ilat, jitter=args.ijit, throttle=args.ithr, busy=args.ibsy, backoff_ms=args.ibof,
+                             padding=args.ipad, seed=args.iseed, proxy_latency=args.iprx).start();
+
+        ''' Step 2: Run each scenario in its own process, so that its peak RSS is its own '''
+        results = [];
+        for s in (args.iscn or SCENARIOS):
+            p = subprocess.run([sys.executable, os.path.abspath(__file__)] + sys.argv[1:] + ['--worker', s, '--autodiscover-url', mock.autodiscover_url],
+                               stdout=subprocess.PIPE, universal_newlines=True);
+            lines = p.stdout.strip().splitlines();
+            if p.returncode != 0 or not lines:
+                raise RuntimeError('Scenario ' + s + ' failed with exit status ' + str(p.returncode) + '\n' + p.stdout);
+            for i in lines[:-1]:
+                print(i);
+            results.append(json.loads(lines[-1]));
+        mock.stop();
+
+        ''' Step 3: Report results '''
+        print('%-12s %10s %8s %10s %12s %10s %10s %12s %10s %10s' % ('scenario', 'messages', 'failed', 'requests', 'msgs/sec', 'p50 ms', 'p99 ms',
+                                                                     'peak rss mb', 'sent kb', 'recv kb'));
+        for r in results:
+            print('%-12s %10d %8d %10d %12.1f %10.2f %10.2f %12.1f %10.1f %10.1f' % (r['scenario'], r['messages'], r['failed'], r['requests'],
+                                                                                   r['msgs_per_sec'], r['p50_ms'], r['p99_ms'], r['peak_rss_mb'],
+                                                                                   r['sent_kb'], r['received_kb']));
+        print('mock server: ' + json.dumps(mock.stats, sort_keys=True));
+
+        ''' Step 4: Measure import time of the library, as seen by short-lived processes '''
+        imports = [{'scenario': 'import:' + i, 'import_ms': import_time(i)} for i in IMPORTS];
+        print('%-28s %10s' % ('import', 'ms'));
+        for r in imports:
+            print('%-28s %10.2f' % (r['scenario'], r['import_ms']));
+        results.extend(imports);
+        found = [];
+        if args.iimp is not None:
+            found.extend([r['scenario'] + ': ' + str(r['import_ms']) + ' ms > ' + str(args.iimp) + ' ms budget' for r in imports if r['import_ms'] > args.iimp]);
+
+        if args.ijsn is not None:
+            with open(args.ijsn, 'w') as f:
+                json.dump(dict([(r['scenario'], r) for r in results]), f, indent=2, sort_keys=True);
+
+        if args.ibsl is not None:
+            with open(args.ibsl, 'r') as f:
+                found.extend(regressions(results, json.load(f), args.itol));
+        for i in found:
+            print('regression: ' + i);
+        if found:
+            sys.exit(2);
+
+    except Exception as err:
+        for e in err.args:
+            print('%-26s | %s | %s | %s' % (str(datetime.datetime.now()), __file__.split('/')[-1] + '->' + func, str(type(err).__name__), str(e)));
+        if args.ilog == 5:
+            for i in str(traceback.format_exc()).splitlines():
+                print('%-26s | %s | %s ' % (str(datetime.datetime.now()), __file__.split('/')[-1] + '->' + func, i));
+        sys.exit(1);
+
+
+if __name__ == '__main__':
+    main();
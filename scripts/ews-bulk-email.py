@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+#------------------------------------------------------------------------------------------#
+# File:      ews-bulk-email.py                                                             #
+# Purpose:   PyEwsClient - Microsoft Office 365 Bulk Email (Mail Merge) Tool               #
+# Author:    Paul Greenberg                                                                #
+# Version:   1.0                                                                           #
+# Copyright: (c) 2013 Paul Greenberg <paul@greenberg.pro>                                  #
+# -----------------------------------------------------------------------------------------#
+
+import os;
+import sys;
+if sys.version_info[0] < 3:
+    sys.stderr.write(os.path.basename(__file__) + ' requires Python 3 or higher.\n');
+    sys.stderr.write("python3 " + __file__ + '\n');
+    exit(1);
+sys.path.append(os.path.join('/'.join(os.path.abspath(__file__).split('/')[:-2])));
+import argparse;
+import datetime;
+import traceback;
+
+try:
+    from pyewsclient import EWSSession, EWSBulkSender;
+except Exception as err:
+    for e in err.args:
+        print('%-26s | %s | %s | %s' % (str(datetime.datetime.now()), __file__.split('/')[-1] + '->global()', str(type(err).__name__), str(e)));
+    sys.exit(1);
+
+def main():
+    func = 'main()';
+    descr = 'PyEwsClient - Microsoft Office 365 Bulk Email (Mail Merge) Tool\n\n';
+    descr += 'Each row of the CSV (with a header row) or JSONL input is a message spec. Its columns,\n';
+    descr += 'e.g. to, cc, bcc, subject, body, attach, are used as is, or substituted into --to,\n';
+    descr += '--subject and --body templates, e.g. --subject "Hello {name}".\n\n';
+    descr += 'examples: \n \n';
+    descr += ' python3 ' + str(__file__) + ' -u email@office365.com -p password --autodiscover \\ \n';
+    descr += '  --input recipients.csv --to "{email}" --subject "Hello {name}" --body "Dear {name}, ..." \n \n';
+    descr += ' python3 ' + str(__file__) + ' --help';
+    epil = 'documentation:\n https://github.com/greenpau/PyEwsClient\n\n';
+    parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,description=descr, epilog=epil);
+    conn_group = parser.add_argument_group('network connectivity arguments');
+    conn_group_sub = conn_group.add_mutually_exclusive_group(required=True);
+    conn_group_sub.add_argument('-s', '--server', dest='isrv', metavar='SERVER', type=str, help='Office 365 Server');
+    conn_group_sub.add_argument('--autodiscover', dest='iauto', action='store_true', help='Office 365 Autodiscovery On');
+    auth_group = parser.add_argument_group('authentication arguments')
+    auth_group.add_argument('-u', '--user', dest='iuser', metavar='USERNAME', type=str, required=True, help='Office 365 Username');
+    auth_group.add_argument('-p', '--password', dest='ipass', metavar='PASSWORD', type=str, required=True, help='Office 365 Password');
+    mail_group = parser.add_argument_group('email arguments');
+    mail_group.add_argument('--input', dest='iinp', metavar='FILE', type=str, required=True, help='Message specs, CSV or JSONL (.jsonl) file');
+    mail_group.add_argument('--to', dest='ito', metavar='TEMPLATE', type=str, help='Email Receipient(s) To: template');
+    mail_group.add_argument('--subject', dest='isub', metavar='TEMPLATE', type=str, help='Email Subject template');
+    mail_group.add_argument('--body', dest='ibdy', metavar='TEMPLATE', type=str, help='Email Body template');
+    mail_group.add_argument('--format', dest='ifmt', metavar='FORMAT', type=str, choices=['plain', 'html'], help='Email Format (plain or html)');
+    mail_group.add_argument('--drafts', dest='idft', action='store_true', help='Save Drafts instead of sending Emails');
+    perf_group = parser.add_argument_group('performance arguments');
+    perf_group.add_argument('--batch-size', dest='ibsz', metavar='N', type=int, default=50, help='Emails per CreateItem request (default: 50)');
+    perf_group.add_argument('--concurrency', dest='icon', metavar='N', type=int, default=4, help='EWS requests in flight (default: 4)');
+    perf_group.add_argument('--validation', dest='ival', metavar='MODE', type=str, default='always', choices=['always', 'never', 'sampled', 'first'],
+                            help='EWS response XML schema validation: always, never, sampled, or first (default: always)');
+    perf_group.add_argument('--compression', dest='icmp', metavar='MODE', type=str, default='none', choices=['none', 'responses', 'all'],
+                            help='HTTP compression: none, responses, or all, i.e. requests too (default: none)');
+    parser.add_argument('-l', '--log-level', dest='ilog', metavar='LEVEL', type=int, default=0, choices=range(1, 6), help='log level (default: 0, max: 5)');
+
+    args = parser.parse_args();
+
+    try:
+        ''' Step 1: Initialize Office 365 Session '''
+        ews = EWSSession(args.iuser, args.ipass, args.isrv, args.ilog, pool_size=args.icon, validation=args.ival, compression=args.icmp);
+        if ews.log:
+            ews.show('log');
+            ews.clear('log');
+        if ews.error:
+            raise RuntimeError('EWS Connectivity Issues');
+
+        ''' Step 2: Read message specs '''
+        if args.iinp.endswith('.jsonl'):
+            specs = EWSBulkSender.read_jsonl(args.iinp);
+        else:
+            specs = EWSBulkSender.read_csv(args.iinp);
+
+        template = {};
+        for (k, v) in [('to', args.ito), ('subject', args.isub), ('body', args.ibdy), ('format', args.ifmt)]:
+            if v is not None:
+                template[k] = v;
+
+        ''' Step 3: Send emails, and report the outcome of each one '''
+        sender = EWSBulkSender(ews, template, args.ibsz, args.icon, args.idft, args.ilog);
+        for r in sender.send(specs):
+            print('%-26s | %s | %s | %s' % (str(datetime.datetime.now()), str(r['Index']), str(r['ResponseClass']),
+                                            str(r['ResponseCode']) + ('' if r['MessageText'] is None else ': ' + str(r['MessageText']))));
+        if ews.log:
+            ews.show('log');
+            ews.clear('log');
+        if sender.log:
+            sender.show('log');
+            sender.clear('log');
+        sender.show('stats');
+        ews.close();
+
+    except Exception as err:
+        for e in err.args:
+            print('%-26s | %s | %s | %s' % (str(datetime.datetime.now()), __file__.split('/')[-1] + '->' + func, str(type(err).__name__), str(e)));
+        if args.ilog == 5:
+            for i in str(traceback.format_exc()).splitlines():
+                print('%-26s | %s | %s ' % (str(datetime.datetime.now()), __file__.split('/')[-1] + '->' + func, i));
+        return;
+
+
+if __name__ == '__main__':
+    main();
@@ -40,6 +40,8 @@ def main():
     descr += '  --format plain --sensitivity "Confidential" \ \n';
     descr += '  --importance "High" --delivery-receipt --read-receipt --mark-read \ \n';
     descr += '  --attach scripts/attach1.txt --attach scripts/attach2.txt -l 1 \n \n';
+    descr += ' python3 ' + str(__file__) + ' -u email@office365.com -p password --autodiscover \\ \n';
+    descr += '  --to "to1@microsoft.com" --subject "Sample Subject" --body "Sample Body" --send \n \n';
     descr += ' python3 ' + str(__file__) + ' --help';
     epil = 'documentation:\n https://github.com/greenpau/PyEwsClient\n\n';
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter,description=descr, epilog=epil);
@@ -67,6 +69,7 @@ def main():
     mail_group.add_argument('--delivery-receipt', dest='irqd', action='store_true', help='Request Delivery Receipt');
     mail_group.add_argument('--read-receipt', dest='irqr', action='store_true', help='Request Read Receipt');
     mail_group.add_argument('--mark-read', dest='imrd', action='store_true', help='Mark Read');
+    mail_group.add_argument('--send', dest='isnd', action='store_true', help='Send Email instead of saving Draft');
 
     parser.add_argument('-l', '--log-level', dest='ilog', metavar='LEVEL', type=int, default=0, choices=range(1, 6), help='log level (default: 0, max: 5)');
     args = parser.parse_args();
@@ -111,6 +114,8 @@ def main():
             email.read_receipt('Yes');
         if args.imrd:
             email.mark_read('No');
+        if args.isnd and args.iatt is None:
+            email.disposition('SendAndSaveCopy');
         email.finalize();
         if args.ilog > 0: 
             email.show('request');
@@ -121,7 +126,17 @@ def main():
         if email.error:
             raise RuntimeError('Local Email Drafting Issues');
 
-        ''' Step 3: Submit email draft to Office 365 '''
+        ''' Step 3: Submit email draft to Office 365, or send email without attachments right away '''
+        if args.isnd and args.iatt is None:
+            ews.submit(email.xml, 'send');
+            if ews.log:
+                ews.show('log');
+                ews.clear('log');
+            if ews.error:
+                raise RuntimeError('EWS Endpoint Email Submission Issues');
+            print('email was sent successfully');
+            return;
+
         ews.submit(email.xml, 'save_only');
         if ews.log:
             ews.show('log');
@@ -133,7 +148,7 @@ def main():
 
         ''' Step 4: Add file attachments to the draft '''
         if args.iatt is not None:
-            attachment = EWSAttachment(ews.id, ews.changekey, args.ilog);
+            attachment = EWSAttachment(ews.id, ews.changekey, args.ilog, stream=True);
             for a in args.iatt:
                 attachment.add(a);
             attachment.finalize();
@@ -148,14 +163,25 @@ def main():
 
         ''' Step 5: Submit attachment(s) to the email draft '''
         if args.iatt is not None:
-            ews.submit(attachment.xml);
+            ews.submit(attachment.xml, 'attachment');
             if ews.log:
                 ews.show('log');
                 ews.clear('log');
             if ews.error:
                 raise RuntimeError('EWS Endpoint Attachment Submission Issues');
 
-        print('email was sent successfully');
+        ''' Step 6: Send the email draft '''
+        if args.isnd:
+            ews.submit(None, 'send_and_save');
+            if ews.log:
+                ews.show('log');
+                ews.clear('log');
+            if ews.error:
+                raise RuntimeError('EWS Endpoint Email Sending Issues');
+            print('email was sent successfully');
+            return;
+
+        print('email draft was saved successfully');
 
     except Exception as err:
         for e in err.args:
@@ -27,7 +27,7 @@ pkg_download_url = 'http://pypi.python.org/packages/source/' + pkg_name[0] + '/'
 pkg_author = 'Paul Greenberg';
 pkg_author_email = 'paul@greenberg.pro';
 pkg_packages = [pkg_name.lower()];
-pkg_requires = ['lxml', 'requests'];
+pkg_requires = ['lxml'];
 pkg_data=['xml/*.xsd','xml/*.wsdl'];
 
 with open(path.join(pkg_dir, 'README.rst'), encoding='utf-8') as f:
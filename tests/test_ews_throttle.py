@@ -0,0 +1,85 @@
+#   PyEwsClient - Microsoft Office 365 EWS (Exchange Web Services) Client Library
+#   Copyright (C) 2013 Paul Greenberg <paul@greenberg.pro>
+#
+#   This program is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   This program is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio;
+import unittest;
+
+from pyewsclient import EWSSession, AsyncEWSSession, EWSThrottle, EWSEmail;
+from pyewsclient.ews_mock_server import EWSMockServer;
+
+
+def _ews_email():
+    email = EWSEmail(0);
+    email.recipients(['user@example.com']);
+    email.subject('Throttle');
+    email.body('Throttle');
+    email.finalize();
+    return email;
+
+
+class EWSThrottleReleaseTest(unittest.TestCase):
+    '''Checks that interrupted EWS request attempts give their throttle slot back.'''
+
+    def setUp(self):
+        self.mock = EWSMockServer(latency=0.2).start();
+        self.email = _ews_email();
+
+
+    def tearDown(self):
+        self.mock.stop();
+
+
+    def test_interrupted_attempt(self):
+        throttle = EWSThrottle(initial_limit=2);
+        ews = EWSSession('user@example.com', 'password', autodiscover_url=self.mock.autodiscover_url,
+                         autodiscover_cache=False, throttle=throttle, validation='never');
+
+        def interrupt(*args, **kwargs):
+            raise KeyboardInterrupt();
+
+        request = ews.pool.request;
+        ews.pool.request = interrupt;
+        with self.assertRaises(KeyboardInterrupt):
+            ews.submit(self.email.xml, 'save_only');
+        self.assertEqual(throttle.inflight(ews.server), 0);
+        self.assertEqual(throttle.stats['cancelled'], 1);
+
+        ews.pool.request = request;
+        self.assertFalse(ews.submit(self.email.xml, 'save_only').error);
+        self.assertEqual(throttle.inflight(ews.server), 0);
+        ews.close();
+
+
+    def test_cancelled_attempt(self):
+        throttle = EWSThrottle(initial_limit=2, max_limit=2);
+
+        async def run():
+            ews = AsyncEWSSession('user@example.com', 'password', autodiscover_url=self.mock.autodiscover_url,
+                                  autodiscover_cache=False, throttle=throttle, validation='never');
+            await ews.autodiscover();
+            for i in range(2):
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(ews.submit(self.email.xml, 'save_only'), 0.05);
+            self.assertEqual(throttle.inflight(ews.server), 0);
+            r = await asyncio.wait_for(ews.submit(self.email.xml, 'save_only'), 5);
+            self.assertFalse(r.error);
+            ews.close();
+
+        asyncio.run(run());
+
+
+if __name__ == '__main__':
+    unittest.main();